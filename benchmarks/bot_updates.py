@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+
+from dispatcher import UpdateDispatcher, create_webhook_app, UPDATE_WORKERS
+
+UPDATES = int(os.environ.get('BENCH_UPDATES', 400))
+CHATS = int(os.environ.get('BENCH_CHATS', 100))
+LATENCY = float(os.environ.get('BENCH_LATENCY', 0.02))
+MAX_PENDING = int(os.environ.get('BENCH_MAX_PENDING', 50))
+
+
+def make_fake_update(update_id, chat_id, text):
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'Patient {chat_id}'},
+            'text': text
+        }
+    })
+
+
+def fake_updates():
+    return [make_fake_update(number, 1000 + number % CHATS, f'taken {number}') for number in range(UPDATES)]
+
+
+def make_bot(threaded):
+    bot = telebot.TeleBot('123456:BENCHMARK', threaded=threaded)
+    handled = []
+    lock = threading.Lock()
+
+    @bot.message_handler(func=lambda message: True)
+    def handle(message):
+        time.sleep(LATENCY)
+        with lock:
+            handled.append((message.chat.id, message.message_id))
+
+    return bot, handled
+
+
+def out_of_order(handled):
+    last_seen = {}
+    count = 0
+    for chat_id, message_id in handled:
+        if message_id < last_seen.get(chat_id, -1):
+            count += 1
+        last_seen[chat_id] = max(message_id, last_seen.get(chat_id, -1))
+    return count
+
+
+def run_polling(payloads):
+    bot, handled = make_bot(threaded=True)
+    started = time.monotonic()
+    bot.process_new_updates([telebot.types.Update.de_json(payload) for payload in payloads])
+    while len(handled) < len(payloads):
+        time.sleep(0.001)
+    elapsed = time.monotonic() - started
+    bot.worker_pool.close()
+    return elapsed, handled
+
+
+def run_webhook(payloads, max_pending=None):
+    bot, handled = make_bot(threaded=False)
+    dispatcher = UpdateDispatcher(lambda update: bot.process_new_updates([update]),
+                                  max_pending=max_pending or len(payloads))
+    client = create_webhook_app(dispatcher, submit_timeout=0).test_client()
+    dispatcher.start()
+    started = time.monotonic()
+    statuses = {}
+    for payload in payloads:
+        status = client.post('/telegram/webhook', data=payload).status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    accepted = time.monotonic() - started
+    dispatcher.join()
+    elapsed = time.monotonic() - started
+    dispatcher.stop()
+    return accepted, elapsed, handled, statuses
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    payloads = fake_updates()
+    polling_elapsed, polling = run_polling(payloads)
+    accepted, elapsed, handled, statuses = run_webhook(payloads)
+    _, bounded_elapsed, bounded, bounded_statuses = run_webhook(payloads, MAX_PENDING)
+
+    print(f'{UPDATES} updates from {CHATS} chats, {LATENCY * 1000:.0f}ms per handler')
+    print(f'polling (2 threads)     total={polling_elapsed:>6.2f}s '
+          f'rate={UPDATES / polling_elapsed:>7.0f}/s out of order={out_of_order(polling)}')
+    print(f'webhook ({UPDATE_WORKERS} workers)     total={elapsed:>6.2f}s accept={accepted * 1000:.1f}ms '
+          f'rate={UPDATES / elapsed:>7.0f}/s out of order={out_of_order(handled)} responses={statuses}')
+    print(f'webhook, {MAX_PENDING} pending max total={bounded_elapsed:>6.2f}s handled={len(bounded)} '
+          f'out of order={out_of_order(bounded)} responses={bounded_statuses}')
+
+
+if __name__ == '__main__':
+    main()
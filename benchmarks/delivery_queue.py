@@ -0,0 +1,76 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delivery import DeliveryQueue, LocalTransport, OutboundMessage, TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_RATE
+
+MESSAGES = int(os.environ.get('BENCH_MESSAGES', 300))
+CHATS = int(os.environ.get('BENCH_CHATS', 100))
+LATENCY = float(os.environ.get('BENCH_LATENCY', 0.05))
+FAILURES = int(os.environ.get('BENCH_FAILURES', 10))
+
+
+def max_per_window(timestamps, window=1.0):
+    best = 0
+    start = 0
+    for end, stamp in enumerate(timestamps):
+        while stamp - timestamps[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def min_chat_gap(sent):
+    last_seen = {}
+    gap = float('inf')
+    for stamp, chat_id, text in sent:
+        if chat_id in last_seen:
+            gap = min(gap, stamp - last_seen[chat_id])
+        last_seen[chat_id] = stamp
+    return gap
+
+
+def run_sequential():
+    transport = LocalTransport(latency=LATENCY)
+    started = time.monotonic()
+    for number in range(MESSAGES):
+        transport.send(OutboundMessage(number % CHATS, f'dose {number}', {}))
+    return time.monotonic() - started, transport
+
+
+def run_queue():
+    transport = LocalTransport(latency=LATENCY, errors=[ConnectionError('simulated')] * FAILURES)
+    queue = DeliveryQueue(transport)
+    queue.start()
+    started = time.monotonic()
+    for number in range(MESSAGES):
+        queue.enqueue(number % CHATS, f'dose {number}')
+    enqueued = time.monotonic() - started
+    queue.join()
+    elapsed = time.monotonic() - started
+    queue.stop()
+    return enqueued, elapsed, transport, queue.stats
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    sequential_elapsed, sequential = run_sequential()
+    enqueued, elapsed, transport, stats = run_queue()
+    sent = sorted(transport.sent)
+    timestamps = [stamp for stamp, chat_id, text in sent]
+
+    print(f'{MESSAGES} messages to {CHATS} chats, {LATENCY * 1000:.0f}ms per send, {FAILURES} transient failures')
+    print(f'inline send_message     total={sequential_elapsed:>6.2f}s '
+          f'max/1s={max_per_window([stamp for stamp, chat_id, text in sequential.sent]):>4} '
+          f'min chat gap={min_chat_gap(sequential.sent):.2f}s')
+    print(f'delivery queue          total={elapsed:>6.2f}s enqueue={enqueued * 1000:.1f}ms '
+          f'max/1s={max_per_window(timestamps):>4} min chat gap={min_chat_gap(sent):.2f}s')
+    print(f'queue stats: {stats}')
+    print(f'limits: {TELEGRAM_GLOBAL_RATE}/s global, {TELEGRAM_CHAT_RATE}/s per chat')
+
+
+if __name__ == '__main__':
+    main()
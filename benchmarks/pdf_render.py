@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+from datetime import date, datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_render import PDF_FONT_NAME, PDF_LAYOUTS, render_pdf
+
+DOCUMENTS = int(os.environ.get('BENCH_DOCUMENTS', 200))
+WORDS = int(os.environ.get('BENCH_WORDS', 2000))
+
+
+def legacy_wrap_text(text, max_length):
+    words = text.split()
+    lines = []
+    current_line = []
+    for word in words:
+        if len(' '.join(current_line + [word])) <= max_length:
+            current_line.append(word)
+        else:
+            if current_line:
+                lines.append(' '.join(current_line))
+            current_line = [word]
+    if current_line:
+        lines.append(' '.join(current_line))
+    return lines
+
+
+def sample_data(words):
+    text = ' '.join(['Гострий', 'бронхіт,', 'призначено', 'постільний', 'режим'] * (words // 5))
+    record = SimpleNamespace(id=1, record_date=datetime(2026, 10, 1, 10, 30), diagnosis=text,
+                             treatment='Відпочинок, тепле пиття', prescriptions='Аспірин - 1 таб - 5 днів',
+                             notes='Контроль через тиждень')
+    patient = SimpleNamespace(first_name='Олена', last_name='Коваль', birthdate=date(1990, 1, 2),
+                              phone='+380501234567', blood_type='A+')
+    doctor = SimpleNamespace(first_name='Іван', last_name='Петренко', specialization='Терапевт',
+                             license_number='L-001', phone='+380441234567')
+    return record, patient, doctor
+
+
+def time_call(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    record, patient, doctor = sample_data(WORDS)
+    layout = PDF_LAYOUTS['medical-record']
+    text = layout.prepare(record.diagnosis)
+
+    legacy = time_call(lambda: legacy_wrap_text(text, 80), 5)
+    metric = time_call(lambda: layout.wrap(text, layout.font_name, layout.font_size, layout.text_width), 5)
+    print(f'wrap {WORDS} words         legacy join={legacy * 1000:>8.1f}ms  stringWidth={metric * 1000:>7.1f}ms')
+
+    short_record, _, _ = sample_data(40)
+    telegram_data = (1, short_record.record_date, short_record.prescriptions, doctor.first_name, doctor.last_name,
+                     doctor.specialization, patient.first_name, patient.last_name, patient.birthdate)
+    print(f'render {DOCUMENTS} documents per kind, font={PDF_FONT_NAME}')
+    for kind in ('prescription', 'prescription-simple', 'medical-record', 'telegram-prescription'):
+        args = (telegram_data,) if kind == 'telegram-prescription' else (short_record, patient, doctor)
+        elapsed = time_call(lambda: render_pdf(kind, *args), DOCUMENTS)
+        size = len(render_pdf(kind, *args))
+        print(f'  {kind:<22} {elapsed * 1000:>6.2f}ms/doc  {1 / elapsed:>7.0f} docs/s  {size:>6} bytes')
+
+
+if __name__ == '__main__':
+    main()
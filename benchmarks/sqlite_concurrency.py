@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import create_database_engine
+
+DURATION = float(os.environ.get('BENCH_DURATION', 3))
+READERS = int(os.environ.get('BENCH_READERS', 4))
+WRITERS = int(os.environ.get('BENCH_WRITERS', 3))
+ROWS = 20000
+
+
+def setup(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE appointment (id INTEGER PRIMARY KEY, doctor_id INTEGER, appointment_date TEXT, status TEXT)')
+    connection.execute('CREATE INDEX ix_appointment_doctor_date ON appointment (doctor_id, appointment_date)')
+    connection.executemany(
+        'INSERT INTO appointment (doctor_id, appointment_date, status) VALUES (?, ?, ?)',
+        [(i % 50, f'2026-01-{i % 28 + 1:02d}', 'scheduled') for i in range(ROWS)]
+    )
+    connection.commit()
+    connection.close()
+
+
+def run(connect):
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def reader(n):
+        done = 0
+        while not stop.is_set():
+            connection = connect()
+            try:
+                connection.execute(
+                    'SELECT COUNT(*) FROM appointment WHERE doctor_id = ? AND appointment_date = ?',
+                    (done % 50, f'2026-01-{done % 28 + 1:02d}')
+                ).fetchone()
+                done += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counts['errors'] += 1
+            finally:
+                connection.close()
+        with lock:
+            counts['reads'] += done
+
+    def writer(n):
+        done = 0
+        while not stop.is_set():
+            connection = connect()
+            try:
+                connection.execute(
+                    'INSERT INTO appointment (doctor_id, appointment_date, status) VALUES (?, ?, ?)',
+                    (n, '2026-02-01', 'scheduled')
+                )
+                connection.commit()
+                done += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counts['errors'] += 1
+            finally:
+                connection.close()
+        with lock:
+            counts['writes'] += done
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(READERS)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        default_path = os.path.join(directory, 'default.db')
+        setup(default_path)
+        default = run(lambda: sqlite3.connect(default_path, timeout=5, check_same_thread=False))
+
+        tuned_path = os.path.join(directory, 'tuned.db')
+        setup(tuned_path)
+        engine = create_database_engine('sqlite:///' + tuned_path)
+        tuned = run(engine.raw_connection)
+        engine.dispose()
+
+    print(f'{READERS} readers, {WRITERS} writers, {DURATION:.0f}s')
+    for name, counts in (('default connect-per-call', default), ('WAL + pooled', tuned)):
+        print(f'{name:<26} reads/s={counts["reads"] / DURATION:>10.0f} '
+              f'writes/s={counts["writes"] / DURATION:>8.0f} errors={counts["errors"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,385 +1,495 @@
-import sqlite3
 import telebot
 from telebot import types
 import datetime
 import random
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import requests
 import json
 import time
 import threading
-from flask import Flask
 import logging
 import os
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch, mm
-from reportlab.lib import colors
 import io
 import pytz
+import sqlalchemy as sa
+from sqlalchemy import select, insert, update, or_
+from database import create_database_engine
+from delivery import DeliveryQueue, TelegramTransport
+from pdf_cache import PdfCache, PDF_CACHE_FOLDER
+from pdf_service import PdfRenderService, make_pdf_key
+from state_store import MemoryStateStore, DatabaseStateStore
+from dispatcher import UpdateDispatcher, create_webhook_app, get_webhook_path
+from user_cache import ReadThroughCache
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 bot = telebot.TeleBot('8303636514:AAFbdfLKzi0f1tCH6nZ591_nSW5ygJJTnuQ')
+delivery_queue = DeliveryQueue(TelegramTransport(bot))
+pdf_render_service = PdfRenderService(PdfCache(PDF_CACHE_FOLDER))
 WEBSITE_URL = "http://127.0.0.1:5000"
-user_states = {}
-
-def get_db_connection():
-    return sqlite3.connect('DataBase.db', check_same_thread=False)
+BOT_STATE_BACKEND = os.environ.get('BOT_STATE_BACKEND', 'database')
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+BOT_WEBHOOK_URL = os.environ.get('BOT_WEBHOOK_URL')
+BOT_WEBHOOK_SECRET = os.environ.get('BOT_WEBHOOK_SECRET')
+BOT_WEBHOOK_HOST = os.environ.get('BOT_WEBHOOK_HOST', '0.0.0.0')
+BOT_WEBHOOK_PORT = int(os.environ.get('BOT_WEBHOOK_PORT', 8443))
+BOT_UPDATE_WORKERS = int(os.environ.get('BOT_UPDATE_WORKERS', 8))
+TELEGRAM_USER_CACHE_LOG_EVERY = 1000
+APPOINTMENT_REMINDER_LABELS = {'24h': "24 години", '1h': "1 година"}
+APPOINTMENT_REMINDER_GRACE = timedelta(hours=1)
+APPOINTMENT_REMINDER_POLL_SECONDS = 60
+APPOINTMENT_REMINDER_BATCH_SIZE = 100
+MEDICATION_DEFAULT_MINUTES = {
+    1: [8 * 60],
+    2: [8 * 60, 20 * 60],
+    3: [8 * 60, 14 * 60, 20 * 60],
+    4: [8 * 60, 12 * 60, 16 * 60, 20 * 60]
+}
+MEDICATION_CATCH_UP_MINUTES = 30
+MEDICATION_TIMETABLE_REBUILD_SECONDS = 15 * 60
+OUTBOX_POLL_SECONDS = 2
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_CLAIM_SECONDS = 300
+OUTBOX_EVENT_SETTINGS = {
+    'appointment_scheduled': 'appointment_reminders',
+    'appointment_cancelled': 'appointment_reminders',
+    'prescription_added': 'prescription_alerts',
+    'notification': 'general_notifications'
+}
+engine = create_database_engine()
+
+metadata = sa.MetaData()
+
+telegram_users = sa.Table(
+    'telegram_users', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('telegram_id', sa.BigInteger, unique=True),
+    sa.Column('user_email', sa.Text),
+    sa.Column('patient_id', sa.Integer),
+    sa.Column('is_verified', sa.Boolean, server_default=sa.false()),
+    sa.Column('created_at', sa.DateTime, server_default=sa.func.current_timestamp()),
+    sqlite_autoincrement=True
+)
+
+notification_settings = sa.Table(
+    'notification_settings', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('telegram_id', sa.BigInteger, sa.ForeignKey('telegram_users.telegram_id')),
+    sa.Column('appointment_reminders', sa.Boolean, server_default=sa.true()),
+    sa.Column('prescription_alerts', sa.Boolean, server_default=sa.true()),
+    sa.Column('general_notifications', sa.Boolean, server_default=sa.true()),
+    sa.Column('medication_reminders', sa.Boolean, server_default=sa.true()),
+    sqlite_autoincrement=True
+)
+
+medication_schedule = sa.Table(
+    'medication_schedule', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('patient_id', sa.Integer),
+    sa.Column('medication_name', sa.Text),
+    sa.Column('dosage', sa.Text),
+    sa.Column('frequency', sa.Text),
+    sa.Column('times_per_day', sa.Integer),
+    sa.Column('specific_times', sa.Text),
+    sa.Column('start_date', sa.Date),
+    sa.Column('end_date', sa.Date),
+    sa.Column('is_active', sa.Boolean, server_default=sa.true()),
+    sa.Column('created_at', sa.DateTime, server_default=sa.func.current_timestamp()),
+    sqlite_autoincrement=True
+)
+
+bot_user_state = sa.Table(
+    'bot_user_state', metadata,
+    sa.Column('telegram_id', sa.BigInteger, primary_key=True, autoincrement=False),
+    sa.Column('state', sa.String(100), nullable=False),
+    sa.Column('data', sa.Text),
+    sa.Column('version', sa.Integer, nullable=False),
+    sa.Column('updated_at', sa.DateTime, nullable=False)
+)
+
+web_metadata = sa.MetaData()
+
+user_table = sa.Table(
+    'user', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('email', sa.String(120))
+)
+
+patient_table = sa.Table(
+    'patient', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('user_id', sa.Integer),
+    sa.Column('first_name', sa.String(50)),
+    sa.Column('last_name', sa.String(50)),
+    sa.Column('birthdate', sa.Date)
+)
+
+doctor_table = sa.Table(
+    'doctor', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('first_name', sa.String(50)),
+    sa.Column('last_name', sa.String(50)),
+    sa.Column('specialization', sa.String(100))
+)
+
+appointment_table = sa.Table(
+    'appointment', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('patient_id', sa.Integer),
+    sa.Column('doctor_id', sa.Integer),
+    sa.Column('appointment_date', sa.Date),
+    sa.Column('appointment_time', sa.Time),
+    sa.Column('status', sa.String(20))
+)
+
+appointment_reminder_table = sa.Table(
+    'appointment_reminder', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('appointment_id', sa.Integer),
+    sa.Column('reminder_type', sa.String(10)),
+    sa.Column('due_at', sa.DateTime),
+    sa.Column('sent_at', sa.DateTime)
+)
+
+outbox_event_table = sa.Table(
+    'outbox_event', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('event_type', sa.String(50)),
+    sa.Column('user_id', sa.Integer),
+    sa.Column('payload', sa.Text),
+    sa.Column('claimed_at', sa.DateTime),
+    sa.Column('processed_at', sa.DateTime)
+)
+
+medical_record_table = sa.Table(
+    'medical_record', web_metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('patient_id', sa.Integer),
+    sa.Column('doctor_id', sa.Integer),
+    sa.Column('record_date', sa.DateTime),
+    sa.Column('prescriptions', sa.Text)
+)
+
+def add_missing_columns(conn):
+    inspector = sa.inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                column_ddl += f" DEFAULT {column.server_default.arg.compile(dialect=conn.dialect)}"
+            conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+            logging.info(f"Added missing column {table.name}.{column.name}")
 
 def init_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS telegram_users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE,
-                user_email TEXT,
-                patient_id INTEGER,
-                is_verified BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notification_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER,
-                appointment_reminders BOOLEAN DEFAULT TRUE,
-                prescription_alerts BOOLEAN DEFAULT TRUE,
-                general_notifications BOOLEAN DEFAULT TRUE,
-                medication_reminders BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (telegram_id) REFERENCES telegram_users (telegram_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medication_schedule (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                medication_name TEXT,
-                dosage TEXT,
-                frequency TEXT,
-                times_per_day INTEGER,
-                specific_times TEXT,
-                start_date DATE,
-                end_date DATE,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appointment_reminders_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_id INTEGER,
-                appointment_id INTEGER,
-                reminder_type TEXT,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        conn.commit()
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            add_missing_columns(conn)
         logging.info("Database tables initialized successfully")
     except Exception as e:
         logging.error(f"Error initializing database: {e}")
-    finally:
-        conn.close()
 
 init_database()
 
+if BOT_STATE_BACKEND == 'memory':
+    state_store = MemoryStateStore()
+else:
+    state_store = DatabaseStateStore(engine, bot_user_state)
+
 def get_user_state(telegram_id):
-    return user_states.get(telegram_id, {})
+    return state_store.get(telegram_id)
+
+def get_message_state(message):
+    state = getattr(message, 'user_state', None)
+    if state is None:
+        state = message.user_state = get_user_state(message.chat.id)
+    return state
 
 def set_user_state(telegram_id, state, data=None):
-    if telegram_id not in user_states:
-        user_states[telegram_id] = {}
-    user_states[telegram_id]['state'] = state
-    if data:
-        user_states[telegram_id]['data'] = data
+    state_store.set(telegram_id, state, data)
 
 def clear_user_state(telegram_id):
-    if telegram_id in user_states:
-        del user_states[telegram_id]
+    state_store.clear(telegram_id)
 
 def get_patient_by_email(email):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            SELECT p.id, p.first_name, p.last_name, u.email 
-            FROM patient p 
-            JOIN user u ON p.user_id = u.id 
-            WHERE u.email = ?
-        ''', (email,))
-        result = cursor.fetchone()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(patient_table.c.id, patient_table.c.first_name, patient_table.c.last_name, user_table.c.email)
+                .join(user_table, patient_table.c.user_id == user_table.c.id)
+                .where(user_table.c.email == email)
+            ).fetchone()
     except Exception as e:
         logging.error(f"Error getting patient by email: {e}")
         return None
-    finally:
-        conn.close()
 
 def verify_patient_email(email, telegram_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
         patient = get_patient_by_email(email)
         if patient:
             patient_id, first_name, last_name, patient_email = patient
-            cursor.execute('''
-                INSERT OR REPLACE INTO telegram_users 
-                (telegram_id, user_email, patient_id, is_verified) 
-                VALUES (?, ?, ?, TRUE)
-            ''', (telegram_id, patient_email, patient_id))
-            cursor.execute('''
-                INSERT OR IGNORE INTO notification_settings 
-                (telegram_id, appointment_reminders, prescription_alerts, general_notifications, medication_reminders) 
-                VALUES (?, TRUE, TRUE, TRUE, TRUE)
-            ''', (telegram_id,))
-
-            conn.commit()
+            with engine.begin() as conn:
+                previous_patient_id = conn.execute(
+                    select(telegram_users.c.patient_id).where(telegram_users.c.telegram_id == telegram_id)
+                ).scalar()
+                result = conn.execute(
+                    update(telegram_users)
+                    .where(telegram_users.c.telegram_id == telegram_id)
+                    .values(user_email=patient_email, patient_id=patient_id, is_verified=True)
+                )
+                if result.rowcount == 0:
+                    conn.execute(insert(telegram_users).values(
+                        telegram_id=telegram_id, user_email=patient_email, patient_id=patient_id, is_verified=True
+                    ))
+                settings_id = conn.execute(
+                    select(notification_settings.c.id).where(notification_settings.c.telegram_id == telegram_id)
+                ).scalar()
+                if settings_id is None:
+                    conn.execute(insert(notification_settings).values(
+                        telegram_id=telegram_id, appointment_reminders=True, prescription_alerts=True,
+                        general_notifications=True, medication_reminders=True
+                    ))
+
+            telegram_user_cache.invalidate(telegram_id)
+            refresh_medication_timetable(patient_id)
+            if previous_patient_id is not None and previous_patient_id != patient_id:
+                # The chat no longer belongs to the old patient, so their doses must stop going to it
+                refresh_medication_timetable(previous_patient_id)
             logging.info(f"Patient {patient_email} verified successfully for Telegram ID {telegram_id}")
             return True, patient
         return False, None
     except Exception as e:
         logging.error(f"Error verifying email: {e}")
-        conn.rollback()
         return False, None
-    finally:
-        conn.close()
 
 
 def get_patient_appointments(patient_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            SELECT a.id, a.appointment_date, a.appointment_time, 
-                   d.first_name, d.last_name, d.specialization
-            FROM appointment a
-            JOIN doctor d ON a.doctor_id = d.id
-            WHERE a.patient_id = ? AND a.status = 'scheduled'
-            AND a.appointment_date >= date('now')
-            ORDER BY a.appointment_date, a.appointment_time
-        ''', (patient_id,))
-        result = cursor.fetchall()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(appointment_table.c.id, appointment_table.c.appointment_date,
+                       appointment_table.c.appointment_time, doctor_table.c.first_name,
+                       doctor_table.c.last_name, doctor_table.c.specialization)
+                .join(doctor_table, appointment_table.c.doctor_id == doctor_table.c.id)
+                .where(appointment_table.c.patient_id == patient_id,
+                       appointment_table.c.status == 'scheduled',
+                       appointment_table.c.appointment_date >= date.today())
+                .order_by(appointment_table.c.appointment_date, appointment_table.c.appointment_time)
+            ).fetchall()
     except Exception as e:
         logging.error(f"Error getting patient appointments: {e}")
         return []
-    finally:
-        conn.close()
 
 
 def get_recent_prescriptions(patient_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT mr.id, mr.record_date, mr.prescriptions, 
-                   d.first_name, d.last_name, d.specialization
-            FROM medical_record mr
-            JOIN doctor d ON mr.doctor_id = d.id
-            WHERE mr.patient_id = ? AND mr.prescriptions IS NOT NULL
-            ORDER BY mr.record_date DESC
-            LIMIT 10
-        ''', (patient_id,))
-        result = cursor.fetchall()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(medical_record_table.c.id, medical_record_table.c.record_date,
+                       medical_record_table.c.prescriptions, doctor_table.c.first_name,
+                       doctor_table.c.last_name, doctor_table.c.specialization)
+                .join(doctor_table, medical_record_table.c.doctor_id == doctor_table.c.id)
+                .where(medical_record_table.c.patient_id == patient_id,
+                       medical_record_table.c.prescriptions.is_not(None))
+                .order_by(medical_record_table.c.record_date.desc())
+                .limit(10)
+            ).fetchall()
     except Exception as e:
         logging.error(f"Error getting patient prescriptions: {e}")
         return []
-    finally:
-        conn.close()
 
 
 def get_prescription_details(prescription_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            SELECT mr.id, mr.record_date, mr.prescriptions, 
-                   d.first_name, d.last_name, d.specialization,
-                   p.first_name, p.last_name, p.date_of_birth
-            FROM medical_record mr
-            JOIN doctor d ON mr.doctor_id = d.id
-            JOIN patient p ON mr.patient_id = p.id
-            WHERE mr.id = ?
-        ''', (prescription_id,))
-        result = cursor.fetchone()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(medical_record_table.c.id, medical_record_table.c.record_date,
+                       medical_record_table.c.prescriptions, doctor_table.c.first_name,
+                       doctor_table.c.last_name, doctor_table.c.specialization,
+                       patient_table.c.first_name, patient_table.c.last_name, patient_table.c.birthdate)
+                .join(doctor_table, medical_record_table.c.doctor_id == doctor_table.c.id)
+                .join(patient_table, medical_record_table.c.patient_id == patient_table.c.id)
+                .where(medical_record_table.c.id == prescription_id)
+            ).fetchone()
     except Exception as e:
         logging.error(f"Error getting prescription details: {e}")
         return None
-    finally:
-        conn.close()
 
 
-def get_telegram_user(telegram_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def load_telegram_user(telegram_id):
     try:
-        cursor.execute('''
-            SELECT tu.*, p.first_name, p.last_name 
-            FROM telegram_users tu
-            LEFT JOIN patient p ON tu.patient_id = p.id
-            WHERE tu.telegram_id = ?
-        ''', (telegram_id,))
-        result = cursor.fetchone()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(telegram_users, patient_table.c.first_name, patient_table.c.last_name)
+                .outerjoin(patient_table, telegram_users.c.patient_id == patient_table.c.id)
+                .where(telegram_users.c.telegram_id == telegram_id)
+            ).fetchone()
     except Exception as e:
         logging.error(f"Error getting telegram user: {e}")
         return None
-    finally:
-        conn.close()
+
+telegram_user_cache = ReadThroughCache(load_telegram_user, should_cache=lambda user: user is not None and user.is_verified)
+
+def get_telegram_user(telegram_id):
+    user = telegram_user_cache.get(telegram_id)
+    stats = telegram_user_cache.stats
+    if (stats['hits'] + stats['misses']) % TELEGRAM_USER_CACHE_LOG_EVERY == 0:
+        logging.info(f"Telegram user cache: {stats['hits']} hits, {stats['misses']} misses, "
+                     f"{stats['invalidations']} invalidations, hit ratio {telegram_user_cache.hit_ratio():.1%}")
+    return user
 
 
 def get_medication_schedule(patient_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT * FROM medication_schedule 
-            WHERE patient_id = ? AND is_active = TRUE
-            ORDER BY created_at DESC
-        ''', (patient_id,))
-        result = cursor.fetchall()
-        return result
+        with engine.connect() as conn:
+            return conn.execute(
+                select(medication_schedule)
+                .where(medication_schedule.c.patient_id == patient_id,
+                       medication_schedule.c.is_active == True)
+                .order_by(medication_schedule.c.created_at.desc())
+            ).fetchall()
     except Exception as e:
         logging.error(f"Error getting medication schedule: {e}")
         return []
-    finally:
-        conn.close()
 
 
 def add_medication_schedule(patient_id, medication_name, dosage, frequency, times_per_day, specific_times, start_date,
                             end_date):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO medication_schedule 
-            (patient_id, medication_name, dosage, frequency, times_per_day, specific_times, start_date, end_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (patient_id, medication_name, dosage, frequency, times_per_day, specific_times, start_date, end_date))
-        conn.commit()
+        with engine.begin() as conn:
+            conn.execute(insert(medication_schedule).values(
+                patient_id=patient_id, medication_name=medication_name, dosage=dosage, frequency=frequency,
+                times_per_day=times_per_day, specific_times=specific_times, start_date=start_date,
+                end_date=end_date, is_active=True
+            ))
+        refresh_medication_timetable(patient_id)
         return True
     except Exception as e:
         logging.error(f"Error adding medication schedule: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
-def generate_prescription_pdf(prescription_data):
+def get_medication_reminder_rows(patient_id=None):
+    query = (
+        select(medication_schedule.c.id, medication_schedule.c.patient_id, medication_schedule.c.medication_name,
+               medication_schedule.c.dosage, medication_schedule.c.times_per_day,
+               medication_schedule.c.specific_times, medication_schedule.c.start_date,
+               medication_schedule.c.end_date, telegram_users.c.telegram_id,
+               patient_table.c.first_name, patient_table.c.last_name)
+        .join(patient_table, medication_schedule.c.patient_id == patient_table.c.id)
+        .join(telegram_users, patient_table.c.id == telegram_users.c.patient_id)
+        .join(notification_settings, telegram_users.c.telegram_id == notification_settings.c.telegram_id)
+        .where(medication_schedule.c.is_active == True,
+               notification_settings.c.medication_reminders == True,
+               telegram_users.c.is_verified == True)
+    )
+    if patient_id is not None:
+        query = query.where(medication_schedule.c.patient_id == patient_id)
+    with engine.connect() as conn:
+        return conn.execute(query).fetchall()
+
+
+def get_medication_minutes(specific_times, times_per_day):
+    if not specific_times:
+        return list(MEDICATION_DEFAULT_MINUTES.get(times_per_day, []))
+
+    minutes = []
+    for med_time in specific_times.split(','):
+        try:
+            parsed = datetime.strptime(med_time.strip(), '%H:%M')
+        except ValueError:
+            logging.warning(f"Ignoring invalid medication time {med_time!r}")
+            continue
+        minutes.append(parsed.hour * 60 + parsed.minute)
+    return minutes
+
+
+class MedicationTimetable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._patient_doses = {}
+
+    def rebuild(self):
+        rows = get_medication_reminder_rows()
+        with self._lock:
+            self._buckets = {}
+            self._patient_doses = {}
+            for row in rows:
+                self._add(row)
+        logging.info(f"Medication timetable built with {len(rows)} schedules")
+
+    def refresh_patient(self, patient_id):
+        rows = get_medication_reminder_rows(patient_id)
+        with self._lock:
+            for minute, dose in self._patient_doses.pop(patient_id, []):
+                bucket = self._buckets[minute]
+                bucket.remove(dose)
+                if not bucket:
+                    del self._buckets[minute]
+            for row in rows:
+                self._add(row)
+
+    def due(self, minute):
+        with self._lock:
+            return list(self._buckets.get(minute, ()))
+
+    def _add(self, row):
+        for minute in get_medication_minutes(row.specific_times, row.times_per_day):
+            dose = (row, minute)
+            self._buckets.setdefault(minute, []).append(dose)
+            self._patient_doses.setdefault(row.patient_id, []).append((minute, dose))
+
+
+medication_timetable = MedicationTimetable()
+
+
+def refresh_medication_timetable(patient_id):
     try:
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=20 * mm, bottomMargin=20 * mm)
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30,
-            alignment=1,
-            textColor=colors.darkblue
-        )
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            textColor=colors.darkblue
-        )
-
-        normal_style = styles['Normal']
-        story = []
-        story.append(Paragraph("МЕДИЧНИЙ РЕЦЕПТ", title_style))
-        story.append(Spacer(1, 20))
-        story.append(Paragraph("ІНФОРМАЦІЯ ПРО ПАЦІЄНТА", heading_style))
-        patient_info = [
-            f"ПІБ: {prescription_data[6]} {prescription_data[7]}",
-            f"Дата народження: {prescription_data[8]}",
-            f"Дата призначення: {prescription_data[1]}"
-        ]
-        for info in patient_info:
-            story.append(Paragraph(info, normal_style))
-        story.append(Spacer(1, 15))
-        story.append(Paragraph("ЛІКАР", heading_style))
-        doctor_info = [
-            f"ПІБ: Др. {prescription_data[3]} {prescription_data[4]}",
-            f"Спеціалізація: {prescription_data[5]}"
-        ]
-        for info in doctor_info:
-            story.append(Paragraph(info, normal_style))
-        story.append(Spacer(1, 15))
-        story.append(Paragraph("ПРИЗНАЧЕННЯ", heading_style))
-        prescription_text = prescription_data[2] or "Інформація відсутня"
-        story.append(Paragraph(prescription_text, normal_style))
-        story.append(Spacer(1, 20))
-        footer_text = f"Згенеровано: {datetime.now().strftime('%d.%m.%Y о %H:%M')}"
-        story.append(Paragraph(footer_text, normal_style))
-        doc.build(story)
-        pdf = buffer.getvalue()
-        buffer.close()
-        return pdf
+        medication_timetable.refresh_patient(patient_id)
     except Exception as e:
-        logging.error(f"Error generating PDF: {e}")
-        return None
+        logging.error(f"Error refreshing medication timetable for patient {patient_id}: {e}")
+
+
+def send_due_medication_reminders(moment):
+    minute = moment.hour * 60 + moment.minute
+    today = moment.date()
+    for row, dose_minute in medication_timetable.due(minute):
+        if row.start_date and row.start_date > today:
+            continue
+        if row.end_date and row.end_date < today:
+            continue
+        send_medication_alert(row.telegram_id, row.first_name, row.last_name, row.medication_name, row.dosage,
+                              f"{dose_minute // 60:02d}:{dose_minute % 60:02d}")
 
 
 def send_medication_reminders():
+    last_minute = None
+    last_rebuild = None
     while True:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            current_time = datetime.now()
-            current_time_str = current_time.strftime('%H:%M')
-            cursor.execute('''
-                SELECT ms.*, tu.telegram_id, p.first_name, p.last_name
-                FROM medication_schedule ms
-                JOIN patient p ON ms.patient_id = p.id
-                JOIN telegram_users tu ON p.id = tu.patient_id
-                JOIN notification_settings ns ON tu.telegram_id = ns.telegram_id
-                WHERE ms.is_active = TRUE 
-                AND ns.medication_reminders = TRUE
-                AND tu.is_verified = TRUE
-                AND ms.start_date <= date('now') 
-                AND (ms.end_date IS NULL OR ms.end_date >= date('now'))
-            ''')
-            medications = cursor.fetchall()
-            for med in medications:
-                if len(med) >= 14:
-                    med_id, patient_id, med_name, dosage, frequency, times_per_day, specific_times, start_date, end_date, is_active, created_at, telegram_id, first_name, last_name = med
-                    if specific_times:
-                        times_list = [t.strip() for t in specific_times.split(',')]
-                        for med_time in times_list:
-                            if current_time_str == med_time:
-                                send_medication_alert(telegram_id, first_name, last_name, med_name, dosage, med_time)
-                    else:
-                        default_times = {
-                            1: ["08:00"],
-                            2: ["08:00", "20:00"],
-                            3: ["08:00", "14:00", "20:00"],
-                            4: ["08:00", "12:00", "16:00", "20:00"]
-                        }
-                        if times_per_day in default_times:
-                            for default_time in default_times[times_per_day]:
-                                if current_time_str == default_time:
-                                    send_medication_alert(telegram_id, first_name, last_name, med_name, dosage,
-                                                          default_time)
-            conn.close()
-            time.sleep(60)
+            # Refreshes only cover changes made through this bot; the rebuild picks up
+            # schedules and links changed by the web app or another bot process
+            if last_rebuild is None or time.monotonic() - last_rebuild >= MEDICATION_TIMETABLE_REBUILD_SECONDS:
+                medication_timetable.rebuild()
+                last_rebuild = time.monotonic()
+            if last_minute is None:
+                last_minute = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+
+            current_minute = datetime.now().replace(second=0, microsecond=0)
+            minute = max(last_minute + timedelta(minutes=1),
+                         current_minute - timedelta(minutes=MEDICATION_CATCH_UP_MINUTES))
+            while minute <= current_minute:
+                send_due_medication_reminders(minute)
+                last_minute = minute
+                minute += timedelta(minutes=1)
+
+            now = datetime.now()
+            time.sleep(60 - now.second - now.microsecond / 1000000)
         except Exception as e:
             logging.error(f"Error in medication reminder loop: {e}")
-            time.sleep(300)
+            time.sleep(60)
 
 
 def send_medication_alert(telegram_id, first_name, last_name, medication_name, dosage, med_time):
@@ -397,65 +507,90 @@ def send_medication_alert(telegram_id, first_name, last_name, medication_name, d
 Будьте здорові! ❤️
         """
 
-        bot.send_message(telegram_id, message, parse_mode='Markdown')
-        logging.info(f"Sent medication reminder to {telegram_id}")
+        delivery_queue.enqueue(telegram_id, message, parse_mode='Markdown')
+        logging.info(f"Queued medication reminder for {telegram_id}")
 
     except Exception as e:
-        logging.error(f"Failed to send medication reminder to {telegram_id}: {e}")
+        logging.error(f"Failed to queue medication reminder for {telegram_id}: {e}")
+
+
+def get_due_appointment_reminders(conn, now):
+    due = (
+        select(appointment_reminder_table.c.id)
+        .where(appointment_reminder_table.c.sent_at.is_(None), appointment_reminder_table.c.due_at <= now)
+        .order_by(appointment_reminder_table.c.due_at)
+        .limit(APPOINTMENT_REMINDER_BATCH_SIZE)
+        .subquery()
+    )
+    return conn.execute(
+        select(appointment_reminder_table.c.id, appointment_reminder_table.c.reminder_type,
+               appointment_reminder_table.c.due_at, appointment_table.c.appointment_date,
+               appointment_table.c.appointment_time, doctor_table.c.first_name, doctor_table.c.last_name,
+               doctor_table.c.specialization, patient_table.c.first_name, patient_table.c.last_name,
+               telegram_users.c.telegram_id, telegram_users.c.is_verified,
+               notification_settings.c.appointment_reminders)
+        .join(due, appointment_reminder_table.c.id == due.c.id)
+        .outerjoin(appointment_table, appointment_reminder_table.c.appointment_id == appointment_table.c.id)
+        .outerjoin(doctor_table, appointment_table.c.doctor_id == doctor_table.c.id)
+        .outerjoin(patient_table, appointment_table.c.patient_id == patient_table.c.id)
+        .outerjoin(telegram_users, patient_table.c.id == telegram_users.c.patient_id)
+        .outerjoin(notification_settings, telegram_users.c.telegram_id == notification_settings.c.telegram_id)
+        .order_by(appointment_reminder_table.c.due_at)
+    ).fetchall()
+
+
+def send_due_appointment_reminders(now):
+    with engine.connect() as conn:
+        reminders = get_due_appointment_reminders(conn, now)
+
+    handled_ids = set()
+    for reminder in reminders:
+        reminder_id, reminder_type, due_at, app_date, app_time, doc_first, doc_last, specialization, pat_first, pat_last, telegram_id, is_verified, enabled = reminder
+        handled_ids.add(reminder_id)
+        if app_date is None or pat_first is None or doc_first is None:
+            # Still marked sent below, otherwise it stays due and the loop never sleeps
+            logging.info(f"Skipping {reminder_type} reminder {reminder_id} for a deleted appointment")
+            continue
+        if not (telegram_id and is_verified and enabled):
+            continue
+        if now - due_at > APPOINTMENT_REMINDER_GRACE:
+            logging.info(f"Skipping expired {reminder_type} reminder {reminder_id}")
+            continue
+        send_single_appointment_reminder(telegram_id, pat_first, pat_last, doc_first, doc_last, specialization,
+                                         app_date, app_time.strftime('%H:%M'),
+                                         APPOINTMENT_REMINDER_LABELS[reminder_type])
+
+    if handled_ids:
+        with engine.begin() as conn:
+            conn.execute(
+                update(appointment_reminder_table)
+                .where(appointment_reminder_table.c.id.in_(handled_ids))
+                .values(sent_at=now)
+            )
+    return len(handled_ids)
+
+
+def get_next_appointment_reminder_due():
+    with engine.connect() as conn:
+        return conn.execute(
+            select(sa.func.min(appointment_reminder_table.c.due_at))
+            .where(appointment_reminder_table.c.sent_at.is_(None))
+        ).scalar()
 
 
 def send_appointment_reminders():
     while True:
-        conn = None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT a.id, a.patient_id, a.appointment_date, a.appointment_time,
-                       d.first_name, d.last_name, d.specialization,
-                       p.first_name, p.last_name, tu.telegram_id
-                FROM appointment a
-                JOIN doctor d ON a.doctor_id = d.id
-                JOIN patient p ON a.patient_id = p.id
-                JOIN telegram_users tu ON p.id = tu.patient_id
-                JOIN notification_settings ns ON tu.telegram_id = ns.telegram_id
-                WHERE a.status = 'scheduled'
-                AND ns.appointment_reminders = TRUE
-                AND tu.is_verified = TRUE
-            ''')
-            appointments = cursor.fetchall()
-            for appointment in appointments:
-                app_id, patient_id, app_date, app_time, doc_first, doc_last, specialization, pat_first, pat_last, telegram_id = appointment
-                if '.' in app_time:
-                    app_time = app_time.split('.')[0]
-                try:
-                    app_datetime = datetime.strptime(f"{app_date} {app_time}", "%Y-%m-%d %H:%M")
-                    now = datetime.now()
-                    time_diff = (app_datetime - now).total_seconds() / 3600
-                    cursor.execute('''
-                        SELECT reminder_type FROM appointment_reminders_log 
-                        WHERE appointment_id = ? AND patient_id = ?
-                        AND date(sent_at) = date('now')
-                    ''', (app_id, patient_id))
-                    sent_reminders = [row[0] for row in cursor.fetchall()]
-                    if 24 <= time_diff < 25 and '24h' not in sent_reminders:
-                        send_single_appointment_reminder(telegram_id, pat_first, pat_last, doc_first, doc_last,
-                                                         specialization, app_date, app_time, "24 години")
-                        log_appointment_reminder(conn, patient_id, app_id, '24h')
-                    elif 1 <= time_diff < 2 and '1h' not in sent_reminders:
-                        send_single_appointment_reminder(telegram_id, pat_first, pat_last, doc_first, doc_last,
-                                                         specialization, app_date, app_time, "1 година")
-                        log_appointment_reminder(conn, patient_id, app_id, '1h')
-                except ValueError as e:
-                    logging.error(f"Error parsing time: {e}")
-                    continue
-            time.sleep(300)
+            if send_due_appointment_reminders(datetime.now()) >= APPOINTMENT_REMINDER_BATCH_SIZE:
+                continue
+            delay = APPOINTMENT_REMINDER_POLL_SECONDS
+            next_due = get_next_appointment_reminder_due()
+            if next_due is not None:
+                delay = min(delay, max((next_due - datetime.now()).total_seconds(), 0))
+            time.sleep(delay)
         except Exception as e:
             logging.error(f"Error in appointment reminder loop: {e}")
             time.sleep(300)
-        finally:
-            if conn:
-                conn.close()
 def send_single_appointment_reminder(telegram_id, pat_first, pat_last, doc_first, doc_last, specialization, app_date,
                                      app_time, reminder_time):
     try:
@@ -471,82 +606,184 @@ def send_single_appointment_reminder(telegram_id, pat_first, pat_last, doc_first
 Не забудьте про ваш запис! 🏥
         """
 
-        bot.send_message(telegram_id, reminder_message, parse_mode='Markdown')
-        logging.info(f"Sent appointment reminder to {telegram_id}")
+        delivery_queue.enqueue(telegram_id, reminder_message, parse_mode='Markdown')
+        logging.info(f"Queued appointment reminder for {telegram_id}")
 
     except Exception as e:
-        logging.error(f"Failed to send appointment reminder to {telegram_id}: {e}")
+        logging.error(f"Failed to queue appointment reminder for {telegram_id}: {e}")
+
+
+def get_outbox_recipients(conn, user_ids):
+    rows = conn.execute(
+        select(patient_table.c.user_id, telegram_users.c.telegram_id,
+               notification_settings.c.appointment_reminders, notification_settings.c.prescription_alerts,
+               notification_settings.c.general_notifications)
+        .join(telegram_users, patient_table.c.id == telegram_users.c.patient_id)
+        .join(notification_settings, telegram_users.c.telegram_id == notification_settings.c.telegram_id)
+        .where(patient_table.c.user_id.in_(user_ids), telegram_users.c.is_verified == True)
+    ).fetchall()
+    recipients = {}
+    for row in rows:
+        recipients.setdefault(row.user_id, []).append(row)
+    return recipients
+
+
+def format_outbox_message(event_type, payload):
+    if event_type == 'appointment_scheduled':
+        return f"""
+📅 **Новий запис на прийом**
+
+👤 Пацієнт: {payload['patient']}
+👨‍⚕️ Лікар: Др. {payload['doctor']}
+🎯 Спеціалізація: {payload['specialization']}
+📅 Дата: {payload['date']}
+⏰ Час: {payload['time']}
+        """, {'parse_mode': 'Markdown'}
+    if event_type == 'appointment_cancelled':
+        return f"""
+❌ **Запис скасовано**
+
+👤 Пацієнт: {payload['patient']}
+📅 Дата: {payload['date']}
+⏰ Час: {payload['time']}
+        """, {'parse_mode': 'Markdown'}
+    if event_type == 'prescription_added':
+        return f"""
+💊 **Нове призначення ліків**
 
+👤 Пацієнт: {payload['patient']}
+👨‍⚕️ Лікар: Др. {payload['doctor']}
+📅 Дата призначення: {payload['date']}
+💊 Призначення: {payload['prescriptions']}
 
-def log_appointment_reminder(conn, patient_id, appointment_id, reminder_type):
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO appointment_reminders_log (patient_id, appointment_id, reminder_type)
-            VALUES (?, ?, ?)
-        ''', (patient_id, appointment_id, reminder_type))
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Error logging appointment reminder: {e}")
+Будьте здорові! ❤️
+        """, {'parse_mode': 'Markdown'}
+    return f"🔔 {payload['title']}\n\n👨‍⚕️ Др. {payload['doctor']}\n\n{payload['message']}", {}
 
 
-def send_prescription_alerts():
-    while True:
-        conn = None
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT mr.id, mr.patient_id, mr.record_date, mr.prescriptions,
-                       d.first_name, d.last_name, p.first_name, p.last_name,
-                       tu.telegram_id
-                FROM medical_record mr
-                JOIN doctor d ON mr.doctor_id = d.id
-                JOIN patient p ON mr.patient_id = p.id
-                JOIN telegram_users tu ON p.id = tu.patient_id
-                JOIN notification_settings ns ON tu.telegram_id = ns.telegram_id
-                WHERE mr.prescriptions IS NOT NULL
-                AND mr.record_date >= datetime('now', '-1 hour')
-                AND ns.prescription_alerts = TRUE
-                AND tu.is_verified = TRUE
-            ''')
-            prescriptions = cursor.fetchall()
-            for prescription in prescriptions:
-                mr_id, patient_id, record_date, prescriptions_text, doc_first, doc_last, pat_first, pat_last, telegram_id = prescription
-
-                alert_message = f"""
-💊 **Нове призначення ліків**
+outbox_in_flight = {}
+outbox_unacked = set()
+outbox_lock = threading.Lock()
 
-👤 Пацієнт: {pat_first} {pat_last}
-👨‍⚕️ Лікар: Др. {doc_first} {doc_last}
-📅 Дата призначення: {record_date}
-💊 Призначення: {prescriptions_text}
 
-Будьте здорові! ❤️
-                """
+def mark_outbox_processed(conn, event_ids):
+    conn.execute(
+        update(outbox_event_table)
+        .where(outbox_event_table.c.id.in_(event_ids))
+        .values(processed_at=datetime.utcnow())
+    )
 
-                try:
-                    bot.send_message(telegram_id, alert_message, parse_mode='Markdown')
-                    logging.info(f"Sent prescription alert to {telegram_id}")
-                except Exception as e:
-                    logging.error(f"Failed to send prescription alert to {telegram_id}: {e}")
 
-            time.sleep(1800)
+def ack_outbox_events(event_ids):
+    # A failed ack keeps the events in flight here and is retried on the next batch. Delivery is
+    # still at-least-once: if the process dies first, the claim expires and the events are sent again
+    try:
+        with engine.begin() as conn:
+            mark_outbox_processed(conn, event_ids)
+    except Exception as e:
+        logging.error(f"Failed to acknowledge outbox events {event_ids}, will retry: {e}")
+        with outbox_lock:
+            outbox_unacked.update(event_ids)
+        return False
+    with outbox_lock:
+        for event_id in event_ids:
+            del outbox_in_flight[event_id]
+            outbox_unacked.discard(event_id)
+    return True
+
+
+def outbox_delivery_callback(event_id):
+    def on_done(outcome):
+        with outbox_lock:
+            outbox_in_flight[event_id] -= 1
+            if outbox_in_flight[event_id]:
+                return
+        if ack_outbox_events([event_id]):
+            logging.info(f"Outbox event {event_id} delivered")
+    return on_done
+
+
+def process_outbox_batch():
+    with outbox_lock:
+        unacked = list(outbox_unacked)
+    if unacked:
+        ack_outbox_events(unacked)
+
+    now = datetime.utcnow()
+    with outbox_lock:
+        in_flight = list(outbox_in_flight)
+
+    # Events stay unprocessed until every message is delivered; the claim stops
+    # other consumers from sending them again and expires if this process dies
+    with engine.begin() as conn:
+        events = conn.execute(
+            select(outbox_event_table.c.id, outbox_event_table.c.event_type,
+                   outbox_event_table.c.user_id, outbox_event_table.c.payload)
+            .where(outbox_event_table.c.processed_at.is_(None),
+                   or_(outbox_event_table.c.claimed_at.is_(None),
+                       outbox_event_table.c.claimed_at < now - timedelta(seconds=OUTBOX_CLAIM_SECONDS)),
+                   outbox_event_table.c.id.not_in(in_flight))
+            .order_by(outbox_event_table.c.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).fetchall()
+        if not events:
+            return 0
+
+        recipients = get_outbox_recipients(conn, {event.user_id for event in events})
+        deliveries = {}
+        for event in events:
+            setting = OUTBOX_EVENT_SETTINGS.get(event.event_type)
+            if setting is None:
+                logging.warning(f"Skipping outbox event {event.id} with unknown type {event.event_type}")
+                continue
+            try:
+                text, options = format_outbox_message(event.event_type, json.loads(event.payload))
+            except (ValueError, KeyError) as e:
+                logging.error(f"Skipping malformed outbox event {event.id}: {e}")
+                continue
+            messages = [(recipient.telegram_id, text, options)
+                        for recipient in recipients.get(event.user_id, []) if getattr(recipient, setting)]
+            if messages:
+                deliveries[event.id] = (event.event_type, messages)
+
+        done_ids = [event.id for event in events if event.id not in deliveries]
+        if done_ids:
+            mark_outbox_processed(conn, done_ids)
+        if deliveries:
+            conn.execute(
+                update(outbox_event_table)
+                .where(outbox_event_table.c.id.in_(list(deliveries)))
+                .values(claimed_at=now)
+            )
 
+    for event_id, (event_type, messages) in deliveries.items():
+        with outbox_lock:
+            outbox_in_flight[event_id] = len(messages)
+        on_done = outbox_delivery_callback(event_id)
+        for telegram_id, text, options in messages:
+            delivery_queue.enqueue(telegram_id, text, on_done=on_done, **options)
+            logging.info(f"Queued {event_type} for {telegram_id}")
+    return len(events)
+
+
+def consume_outbox():
+    while True:
+        try:
+            if process_outbox_batch() < OUTBOX_BATCH_SIZE:
+                time.sleep(OUTBOX_POLL_SECONDS)
         except Exception as e:
-            logging.error(f"Error in prescription alert loop: {e}")
-            time.sleep(300)
-        finally:
-            if conn:
-                conn.close()
+            logging.error(f"Error in outbox consumer loop: {e}")
+            time.sleep(30)
 
 
 def start_notification_threads():
+    delivery_queue.start()
     appointment_thread = threading.Thread(target=send_appointment_reminders, daemon=True)
-    prescription_thread = threading.Thread(target=send_prescription_alerts, daemon=True)
+    outbox_thread = threading.Thread(target=consume_outbox, daemon=True)
     medication_thread = threading.Thread(target=send_medication_reminders, daemon=True)
     appointment_thread.start()
-    prescription_thread.start()
+    outbox_thread.start()
     medication_thread.start()
     logging.info("All notification threads started successfully")
 @bot.message_handler(commands=['start'])
@@ -579,7 +816,7 @@ def send_welcome(message):
         """
         set_user_state(telegram_id, 'awaiting_email')
         bot.send_message(telegram_id, welcome_message, parse_mode='Markdown')
-@bot.message_handler(func=lambda message: get_user_state(message.chat.id).get('state') == 'awaiting_email')
+@bot.message_handler(func=lambda message: get_message_state(message).get('state') == 'awaiting_email')
 def handle_email_input(message):
     telegram_id = message.chat.id
     email = message.text.strip()
@@ -641,7 +878,7 @@ def show_appointments(message):
         app_id, app_date, app_time, doc_first, doc_last, specialization = appointment
         appointments_text += f"{i}. **Др. {doc_first} {doc_last}**\n"
         appointments_text += f"   🎯 {specialization}\n"
-        appointments_text += f"   📅 {app_date} ⏰ {app_time}\n\n"
+        appointments_text += f"   📅 {app_date} ⏰ {app_time.strftime('%H:%M')}\n\n"
 
     bot.send_message(telegram_id, appointments_text, parse_mode='Markdown')
 
@@ -756,15 +993,13 @@ def show_settings(message):
         bot.send_message(telegram_id, "❌ Будь ласка, спочатку підтвердіть ваш обліковий запис командою /start")
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            SELECT appointment_reminders, prescription_alerts, general_notifications, medication_reminders
-            FROM notification_settings WHERE telegram_id = ?
-        ''', (telegram_id,))
-        settings = cursor.fetchone()
+        with engine.connect() as conn:
+            settings = conn.execute(
+                select(notification_settings.c.appointment_reminders, notification_settings.c.prescription_alerts,
+                       notification_settings.c.general_notifications, notification_settings.c.medication_reminders)
+                .where(notification_settings.c.telegram_id == telegram_id)
+            ).fetchone()
 
         if settings:
             app_reminders, presc_alerts, gen_notif, med_reminders = settings
@@ -811,8 +1046,6 @@ def show_settings(message):
     except Exception as e:
         logging.error(f"Error getting settings: {e}")
         bot.send_message(telegram_id, "❌ Помилка при завантаженні налаштувань.")
-    finally:
-        conn.close()
 
 
 @bot.message_handler(func=lambda message: message.text == 'ℹ️ Допомога')
@@ -872,7 +1105,15 @@ def download_prescription_pdf(telegram_id, prescription_id):
         if not prescription_data:
             bot.send_message(telegram_id, "❌ Не вдалося знайти інформацію про призначення.")
             return
-        pdf_data = generate_prescription_pdf(prescription_data)
+        prescription_data = tuple(prescription_data)
+        try:
+            pdf_data = pdf_render_service.render_bytes(
+                make_pdf_key('telegram-prescription', prescription_id, prescription_data),
+                'telegram-prescription', prescription_data
+            )
+        except Exception as e:
+            logging.error(f"Error generating PDF: {e}")
+            pdf_data = None
 
         if pdf_data:
             pdf_file = io.BytesIO(pdf_data)
@@ -900,9 +1141,6 @@ def handle_toggle_callback(call):
         setting_type = data.split('_')[1]
         new_value = data.split('_')[2] == 'True'
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         setting_map = {
             'appointments': 'appointment_reminders',
             'prescriptions': 'prescription_alerts',
@@ -912,12 +1150,17 @@ def handle_toggle_callback(call):
 
         if setting_type in setting_map:
             column = setting_map[setting_type]
-            cursor.execute(f'''
-                UPDATE notification_settings 
-                SET {column} = ? 
-                WHERE telegram_id = ?
-            ''', (new_value, telegram_id))
-            conn.commit()
+            with engine.begin() as conn:
+                conn.execute(
+                    update(notification_settings)
+                    .where(notification_settings.c.telegram_id == telegram_id)
+                    .values({column: new_value})
+                )
+            telegram_user_cache.invalidate(telegram_id)
+            if column == 'medication_reminders':
+                user = get_telegram_user(telegram_id)
+                if user:
+                    refresh_medication_timetable(user[3])
 
             status = "увімкнено" if new_value else "вимкнено"
             bot.answer_callback_query(call.id, f"✅ Налаштування {status}!")
@@ -926,8 +1169,6 @@ def handle_toggle_callback(call):
     except Exception as e:
         logging.error(f"Error toggling setting: {e}")
         bot.answer_callback_query(call.id, "❌ Помилка при зміні налаштувань.")
-    finally:
-        conn.close()
 
 
 @bot.callback_query_handler(func=lambda call: call.data == 'add_medication')
@@ -943,11 +1184,11 @@ def start_medication_setup(telegram_id):
 
 
 @bot.message_handler(
-    func=lambda message: get_user_state(message.chat.id).get('state', '').startswith('awaiting_medication'))
+    func=lambda message: get_message_state(message).get('state', '').startswith('awaiting_medication'))
 def handle_medication_setup(message):
     telegram_id = message.chat.id
-    current_state = get_user_state(telegram_id).get('state')
-    user_data = get_user_state(telegram_id).get('data', {})
+    current_state = get_message_state(message).get('state')
+    user_data = get_message_state(message).get('data', {})
 
     if current_state == 'awaiting_medication_name':
         user_data['medication_name'] = message.text
@@ -977,13 +1218,23 @@ def handle_medication_setup(message):
             bot.send_message(telegram_id, "❌ Будь ласка, введіть коректне число:")
 
     elif current_state == 'awaiting_medication_start':
-        user_data['start_date'] = message.text
-        set_user_state(telegram_id, 'awaiting_medication_end', user_data)
-        bot.send_message(telegram_id,
-                         "📅 Введіть дату завершення прийому (РРРР-ММ-ДД) або 'немає' для постійного прийому:")
+        try:
+            user_data['start_date'] = datetime.strptime(message.text.strip(), '%Y-%m-%d').date()
+            set_user_state(telegram_id, 'awaiting_medication_end', user_data)
+            bot.send_message(telegram_id,
+                             "📅 Введіть дату завершення прийому (РРРР-ММ-ДД) або 'немає' для постійного прийому:")
+        except ValueError:
+            bot.send_message(telegram_id, "❌ Будь ласка, введіть дату у форматі РРРР-ММ-ДД:")
 
     elif current_state == 'awaiting_medication_end':
-        end_date = None if message.text.lower() == 'немає' else message.text
+        if message.text.lower() == 'немає':
+            end_date = None
+        else:
+            try:
+                end_date = datetime.strptime(message.text.strip(), '%Y-%m-%d').date()
+            except ValueError:
+                bot.send_message(telegram_id, "❌ Будь ласка, введіть дату у форматі РРРР-ММ-ДД або 'немає':")
+                return
         user_data['end_date'] = end_date
 
         user = get_telegram_user(telegram_id)
@@ -1018,12 +1269,40 @@ def handle_other_messages(message):
     else:
         bot.send_message(telegram_id, "❓ Будь ласка, спочатку підтвердіть ваш обліковий запис. Введіть /start")
 
+def process_update(update):
+    bot.process_new_updates([update])
+
+update_dispatcher = UpdateDispatcher(process_update, workers=BOT_UPDATE_WORKERS)
+
+def run_webhook():
+    path = get_webhook_path(BOT_WEBHOOK_URL, BOT_WEBHOOK_SECRET)
+    try:
+        from waitress import serve
+    except ImportError:
+        raise RuntimeError('Webhook mode needs the waitress package: pip install waitress')
+
+    # Handlers run inline on the dispatcher workers so updates from one chat stay in order
+    bot.threaded = False
+    update_dispatcher.start()
+    bot.remove_webhook()
+    bot.set_webhook(url=BOT_WEBHOOK_URL, secret_token=BOT_WEBHOOK_SECRET,
+                    max_connections=BOT_UPDATE_WORKERS, allowed_updates=['message', 'callback_query'])
+    logging.info(f"Webhook registered at {BOT_WEBHOOK_URL}")
+    # waitress serves plain HTTP; TLS for BOT_WEBHOOK_URL ends at the reverse proxy in front of it
+    serve(create_webhook_app(update_dispatcher, secret_token=BOT_WEBHOOK_SECRET, path=path),
+          host=BOT_WEBHOOK_HOST, port=BOT_WEBHOOK_PORT, threads=BOT_UPDATE_WORKERS)
+
 if __name__ == '__main__':
     try:
         logging.info("Starting Mediconnect Telegram Bot...")
+        logging.info(f"Purged {state_store.purge_expired()} expired conversation states")
         start_notification_threads()
         logging.info("Bot is running. Press Ctrl+C to stop.")
-        bot.polling(none_stop=True, interval=1, timeout=60)
+        if BOT_MODE == 'webhook':
+            run_webhook()
+        else:
+            bot.remove_webhook()
+            bot.polling(none_stop=True, interval=1, timeout=60)
     except KeyboardInterrupt:
         logging.info("Bot stopped by user")
     except Exception as e:
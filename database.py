@@ -0,0 +1,71 @@
+import os
+import sqlite3
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+DATABASE_PATH = os.path.join(basedir, 'DataBase.db')
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///' + DATABASE_PATH)
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'mmap_size': 256 * 1024 * 1024,
+    # negative cache_size is in KiB, so this is a 64 MiB page cache per connection
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def apply_sqlite_pragmas(connection):
+    cursor = connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def connect_sqlite(path=DATABASE_PATH):
+    connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    apply_sqlite_pragmas(connection)
+    return connection
+
+
+def normalize_database_url(url):
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def sqlite_engine_options(path=DATABASE_PATH, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    return {
+        'creator': lambda: connect_sqlite(path),
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+    }
+
+
+def engine_options(url=DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    url = make_url(normalize_database_url(url))
+    if url.get_backend_name() == 'sqlite':
+        return sqlite_engine_options(url.database or DATABASE_PATH, pool_size, max_overflow)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def create_database_engine(url=DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    url = normalize_database_url(url)
+    return create_engine(url, **engine_options(url, pool_size, max_overflow))
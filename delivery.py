@@ -0,0 +1,206 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+
+DELIVERY_WORKERS = 8
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_BACKOFF_SECONDS = 1
+DELIVERY_MAX_BACKOFF_SECONDS = 60
+DELIVERY_CHAT_LIMITERS = 10000
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_free = 0.0
+
+    def next_slot(self, earliest):
+        return max(earliest, self._next_free)
+
+    def reserve(self, earliest):
+        slot = self.next_slot(earliest)
+        self._next_free = slot + self.interval
+        return slot
+
+    def is_idle(self, now):
+        return self._next_free <= now
+
+
+class OutboundMessage:
+    def __init__(self, chat_id, text, options, on_done=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options
+        self.on_done = on_done
+        self.attempts = 0
+
+
+class TelegramTransport:
+    def __init__(self, bot):
+        self.bot = bot
+
+    def send(self, message):
+        self.bot.send_message(message.chat_id, message.text, **message.options)
+
+
+class LocalTransport:
+    def __init__(self, latency=0.0, errors=None):
+        self.latency = latency
+        self.errors = list(errors or [])
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append((time.monotonic(), message.chat_id, message.text))
+
+
+def get_retry_delay(error, attempts):
+    if isinstance(error, ApiTelegramException):
+        if error.error_code == 429:
+            parameters = (error.result_json or {}).get('parameters', {})
+            return parameters.get('retry_after', DELIVERY_BACKOFF_SECONDS)
+        if error.error_code < 500:
+            return None
+    return min(DELIVERY_BACKOFF_SECONDS * 2 ** (attempts - 1), DELIVERY_MAX_BACKOFF_SECONDS)
+
+
+class DeliveryQueue:
+    def __init__(self, transport, workers=DELIVERY_WORKERS, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_rate=TELEGRAM_CHAT_RATE, max_attempts=DELIVERY_MAX_ATTEMPTS):
+        self.transport = transport
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.stats = {'queued': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+        self._global_limiter = RateLimiter(global_rate)
+        self._chat_limiters = {}
+        self._heap = []
+        self._retries = []
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._stopping = False
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def start(self):
+        self._stopping = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'delivery-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Delivery queue started with {self.workers} workers")
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, chat_id, text, on_done=None, **options):
+        message = OutboundMessage(chat_id, text, options, on_done)
+        with self._condition:
+            self._schedule(message, time.monotonic())
+            self._pending += 1
+            self.stats['queued'] += 1
+            self._condition.notify()
+        return message
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def pending(self):
+        with self._condition:
+            return self._pending
+
+    def _schedule(self, message, earliest):
+        chat_limiter = self._chat_limiters.get(message.chat_id)
+        if chat_limiter is None:
+            if len(self._chat_limiters) >= DELIVERY_CHAT_LIMITERS:
+                self._prune_chat_limiters(time.monotonic())
+            chat_limiter = RateLimiter(self.chat_rate)
+            self._chat_limiters[message.chat_id] = chat_limiter
+
+        send_at = self._global_limiter.reserve(chat_limiter.next_slot(earliest))
+        chat_limiter.reserve(send_at)
+        heapq.heappush(self._heap, (send_at, next(self._sequence), message))
+
+    def _prune_chat_limiters(self, now):
+        for chat_id in [chat_id for chat_id, limiter in self._chat_limiters.items() if limiter.is_idle(now)]:
+            del self._chat_limiters[chat_id]
+
+    def _promote_retries(self, now):
+        # Retries only take rate limiter slots once their backoff is over, so one
+        # chat's backoff never pushes back the global limiter for everyone else
+        while self._retries and self._retries[0][0] <= now:
+            self._schedule(heapq.heappop(self._retries)[2], now)
+
+    def _next_message(self):
+        with self._condition:
+            while not self._stopping:
+                now = time.monotonic()
+                self._promote_retries(now)
+                wake_at = [queue[0][0] for queue in (self._heap, self._retries) if queue]
+                if not wake_at:
+                    self._condition.wait()
+                    continue
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                self._condition.wait(min(wake_at) - now)
+            return None
+
+    def _work(self):
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+
+            message.attempts += 1
+            try:
+                self.transport.send(message)
+            except Exception as e:
+                delay = get_retry_delay(e, message.attempts)
+                if delay is None or message.attempts >= self.max_attempts:
+                    logging.error(f"Giving up on message to {message.chat_id} after {message.attempts} attempts: {e}")
+                    self._finish(message, 'failed')
+                    continue
+                logging.warning(f"Retrying message to {message.chat_id} in {delay}s: {e}")
+                with self._condition:
+                    self.stats['retried'] += 1
+                    heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence), message))
+                    self._condition.notify()
+                continue
+
+            self._finish(message, 'sent')
+
+    def _finish(self, message, outcome):
+        if message.on_done is not None:
+            try:
+                message.on_done(outcome)
+            except Exception as e:
+                logging.error(f"Error in delivery callback for {message.chat_id}: {e}")
+        with self._condition:
+            self.stats[outcome] += 1
+            self._pending -= 1
+            if not self._pending:
+                self._condition.notify_all()
@@ -0,0 +1,155 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from flask import Flask, request
+from telebot import types
+
+UPDATE_WORKERS = 8
+UPDATE_MAX_PENDING = 1000
+WEBHOOK_SUBMIT_TIMEOUT = 1.0
+WEBHOOK_RETRY_AFTER = 5
+WEBHOOK_SECRET_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+
+def get_webhook_path(url, secret_token):
+    parts = urlsplit(url or '')
+    if parts.scheme != 'https' or not parts.hostname:
+        raise ValueError(f'Webhook URL must be an https:// URL, got {url!r}')
+    # Telegram sends the token back in a header on every update; without it anyone can post updates
+    if not secret_token or not WEBHOOK_SECRET_PATTERN.fullmatch(secret_token):
+        raise ValueError('Webhook secret token must be 1-256 characters of A-Z, a-z, 0-9, _ and -')
+    return parts.path or '/'
+
+
+def get_update_chat_id(update):
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, name, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    return None
+
+
+class UpdateDispatcher:
+    def __init__(self, handler, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.stats = {'queued': 0, 'processed': 0, 'failed': 0, 'rejected': 0}
+        self._chats = {}
+        self._ready = deque()
+        self._pending = 0
+        self._stopping = False
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def start(self):
+        self._stopping = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'updates-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Update dispatcher started with {self.workers} workers")
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, chat_id, update, timeout=0):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['rejected'] += 1
+                    return False
+                self._condition.wait(remaining)
+
+            if chat_id is None:
+                chat_id = ('update', update.update_id)
+            updates = self._chats.get(chat_id)
+            if updates is None:
+                updates = self._chats[chat_id] = deque()
+                self._ready.append(chat_id)
+            updates.append(update)
+            self._pending += 1
+            self.stats['queued'] += 1
+            self._condition.notify_all()
+        return True
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def pending(self):
+        with self._condition:
+            return self._pending
+
+    def _next_update(self):
+        with self._condition:
+            while not self._stopping:
+                if self._ready:
+                    chat_id = self._ready.popleft()
+                    return chat_id, self._chats[chat_id].popleft()
+                self._condition.wait()
+            return None, None
+
+    def _work(self):
+        while True:
+            chat_id, update = self._next_update()
+            if update is None:
+                return
+
+            outcome = 'processed'
+            try:
+                self.handler(update)
+            except Exception as e:
+                logging.error(f"Error processing update {update.update_id} for chat {chat_id}: {e}")
+                outcome = 'failed'
+
+            with self._condition:
+                self.stats[outcome] += 1
+                self._pending -= 1
+                if self._chats[chat_id]:
+                    self._ready.append(chat_id)
+                else:
+                    del self._chats[chat_id]
+                self._condition.notify_all()
+
+
+def create_webhook_app(dispatcher, secret_token=None, path='/telegram/webhook',
+                       submit_timeout=WEBHOOK_SUBMIT_TIMEOUT):
+    app = Flask(__name__)
+
+    @app.route(path, methods=['POST'])
+    def telegram_webhook():
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return '', 403
+
+        update = types.Update.de_json(request.get_data(as_text=True))
+        if update is None:
+            return '', 400
+        if not dispatcher.submit(get_update_chat_id(update), update, timeout=submit_timeout):
+            logging.warning(f"Update queue full, asking Telegram to redeliver update {update.update_id}")
+            return '', 429, {'Retry-After': str(WEBHOOK_RETRY_AFTER)}
+        return '', 200
+
+    return app
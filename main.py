@@ -1,41 +1,142 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from flask_sqlalchemy import SQLAlchemy
 from flask import send_from_directory
-from sqlalchemy import or_
-from flask_migrate import Migrate
+from sqlalchemy import or_, func, case, select, update, insert, delete, union, tuple_, literal, event, inspect, table, column
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from flask_migrate import Migrate, upgrade, stamp
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
 from flask import send_file
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-import io
 import os
+import re
 import random
 import json
 import base64
+from types import SimpleNamespace
 from werkzeug.utils import secure_filename
+from database import DATABASE_URL, engine_options, normalize_database_url
+from pubsub import Broker
+from pdf_cache import PdfCache, PDF_CACHE_FOLDER
+from pdf_service import PdfRenderService, make_pdf_key, iter_zip
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'DataBase.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(DATABASE_URL)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.secret_key = os.urandom(24)
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+notification_broker = Broker()
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'static/uploads')
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
+app.config['PDF_CACHE_FOLDER'] = PDF_CACHE_FOLDER
+pdf_cache = PdfCache(app.config['PDF_CACHE_FOLDER'])
+pdf_render_service = PdfRenderService(pdf_cache)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+SLOT_MINUTES = 30
+MAX_AVAILABILITY_DAYS = 31
+NOTIFICATION_STREAM_BACKLOG = 100
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = 15
+NOTIFICATION_STREAM_RETRY_MS = 5000
+URGENT_NOTIFICATION_MARKER = 'urgent'
+PDF_JOB_KINDS = ('prescription', 'prescription-simple', 'medical-record')
+PATIENT_SEARCH_MAX_TERMS = 8
+PHONE_DIGITS_SQL = "replace(replace(replace(replace(replace(replace({}, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+PATIENT_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(
+        first_name, last_name, phone, phone_digits, email,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+    """INSERT INTO patient_search(patient_search, rank) VALUES ('rank', 'bm25(10.0, 10.0, 2.0, 2.0, 1.0)')""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_search_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+        SELECT new.id, new.first_name, new.last_name, new.phone, {PHONE_DIGITS_SQL.format('new.phone')},
+               (SELECT email FROM "user" WHERE id = new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_search_update
+    AFTER UPDATE OF first_name, last_name, phone, user_id ON patient BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+        INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+        SELECT new.id, new.first_name, new.last_name, new.phone, {PHONE_DIGITS_SQL.format('new.phone')},
+               (SELECT email FROM "user" WHERE id = new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_delete AFTER DELETE ON patient BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_email AFTER UPDATE OF email ON "user" BEGIN
+        UPDATE patient_search SET email = new.email WHERE rowid IN (SELECT id FROM patient WHERE user_id = new.id);
+    END""",
+]
+PATIENT_SEARCH_REBUILD = [
+    "DELETE FROM patient_search",
+    f"""INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+    SELECT patient.id, patient.first_name, patient.last_name, patient.phone,
+           {PHONE_DIGITS_SQL.format('patient.phone')}, "user".email
+    FROM patient JOIN "user" ON "user".id = patient.user_id""",
+]
+APPOINTMENT_REMINDER_OFFSETS = {
+    '24h': timedelta(hours=24),
+    '1h': timedelta(hours=1),
+}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, (date, time)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    values = []
+    for column, value in zip(columns, payload):
+        python_type = column.type.python_type
+        try:
+            if value is None:
+                raise TypeError('Cursor values cannot be null')
+            if python_type in (date, time, datetime):
+                values.append(python_type.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+    return values
+
+
+def page_query(query, columns, values=None, descending=True):
+    # Sort keys must be NOT NULL: a NULL never satisfies the tuple bound and would drop out of later pages
+    if values is not None:
+        key = tuple_(*columns)
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(columns, values)])
+        query = query.filter(key < bound if descending else key > bound)
+    return query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+
+def paginate_query(query, columns, descending=True):
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    values = decode_cursor(cursor, columns) if cursor else None
+
+    items = page_query(query, columns, values, descending).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return items, next_cursor
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
@@ -91,6 +192,10 @@ class Doctor(db.Model):
 
 
 class WorkingHours(db.Model):
+    __table_args__ = (
+        db.Index('ix_working_hours_doctor_day', 'doctor_id', 'day_of_week'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     day_of_week = db.Column(db.Integer, nullable=False)
@@ -99,6 +204,17 @@ class WorkingHours(db.Model):
 
 
 class Appointment(db.Model):
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_date_status', 'doctor_id', 'appointment_date', 'status'),
+        db.Index('ix_appointment_patient_doctor_date', 'patient_id', 'doctor_id', 'appointment_date'),
+        db.Index('ix_appointment_patient_schedule', 'patient_id', 'appointment_date', 'appointment_time'),
+        db.Index('ix_appointment_doctor_schedule', 'doctor_id', 'appointment_date', 'appointment_time'),
+        db.Index('uq_appointment_scheduled_slot', 'doctor_id', 'appointment_date', 'appointment_time',
+                 unique=True,
+                 sqlite_where=db.text("status = 'scheduled'"),
+                 postgresql_where=db.text("status = 'scheduled'")),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False, index=True)
@@ -109,13 +225,33 @@ class Appointment(db.Model):
     reason = db.Column(db.Text)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reminders = db.relationship('AppointmentReminder', backref='appointment', lazy=True,
+                                cascade='all, delete-orphan')
+
+
+class AppointmentReminder(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('appointment_id', 'reminder_type', name='uq_appointment_reminder_type'),
+        db.Index('ix_appointment_reminder_sent_due', 'sent_at', 'due_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    reminder_type = db.Column(db.String(10), nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime)
 
 
 class MedicalRecord(db.Model):
+    __table_args__ = (
+        db.Index('ix_medical_record_doctor_patient', 'doctor_id', 'patient_id'),
+        db.Index('ix_medical_record_patient_date', 'patient_id', 'record_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
-    record_date = db.Column(db.DateTime, default=datetime.utcnow)
+    record_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     diagnosis = db.Column(db.Text)
     treatment = db.Column(db.Text)
     prescriptions = db.Column(db.Text)
@@ -123,13 +259,323 @@ class MedicalRecord(db.Model):
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'))
 
 
+class DoctorPatient(db.Model):
+    __table_args__ = (
+        db.Index('ix_doctor_patient_patient', 'patient_id'),
+    )
+
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True)
+    first_visit = db.Column(db.Date)
+    last_visit = db.Column(db.Date)
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def has_treated_patient(doctor_id, patient_id):
+    return db.session.query(
+        DoctorPatient.query.filter_by(doctor_id=doctor_id, patient_id=patient_id)
+        .filter(DoctorPatient.record_count > 0).exists()
+    ).scalar()
+
+
+def count_doctor_patient_visits(connection, doctor_id, patient_id):
+    visit_count, first_visit, last_visit = connection.execute(
+        select(func.count(Appointment.id), func.min(Appointment.appointment_date), func.max(Appointment.appointment_date))
+        .where(Appointment.doctor_id == doctor_id, Appointment.patient_id == patient_id)
+    ).one()
+    record_count = connection.execute(
+        select(func.count(MedicalRecord.id))
+        .where(MedicalRecord.doctor_id == doctor_id, MedicalRecord.patient_id == patient_id)
+    ).scalar()
+    return {'first_visit': first_visit, 'last_visit': last_visit,
+            'visit_count': visit_count, 'record_count': record_count}
+
+
+def refresh_doctor_patient_link(connection, doctor_id, patient_id):
+    values = count_doctor_patient_visits(connection, doctor_id, patient_id)
+    link = (DoctorPatient.doctor_id == doctor_id, DoctorPatient.patient_id == patient_id)
+    if not values['visit_count'] and not values['record_count']:
+        connection.execute(delete(DoctorPatient).where(*link))
+        return
+    result = connection.execute(update(DoctorPatient).where(*link).values(**values))
+    if not result.rowcount:
+        connection.execute(insert(DoctorPatient).values(doctor_id=doctor_id, patient_id=patient_id, **values))
+
+
+def backfill_doctor_patient_links():
+    visits = select(
+        Appointment.doctor_id, Appointment.patient_id,
+        func.count(Appointment.id).label('visit_count'),
+        func.min(Appointment.appointment_date).label('first_visit'),
+        func.max(Appointment.appointment_date).label('last_visit')
+    ).group_by(Appointment.doctor_id, Appointment.patient_id).subquery()
+    records = select(
+        MedicalRecord.doctor_id, MedicalRecord.patient_id,
+        func.count(MedicalRecord.id).label('record_count')
+    ).group_by(MedicalRecord.doctor_id, MedicalRecord.patient_id).subquery()
+    pairs = union(
+        select(Appointment.doctor_id, Appointment.patient_id),
+        select(MedicalRecord.doctor_id, MedicalRecord.patient_id)
+    ).subquery()
+
+    links = select(
+        pairs.c.doctor_id, pairs.c.patient_id, visits.c.first_visit, visits.c.last_visit,
+        func.coalesce(visits.c.visit_count, 0), func.coalesce(records.c.record_count, 0)
+    ).select_from(
+        pairs.outerjoin(visits, (visits.c.doctor_id == pairs.c.doctor_id) & (visits.c.patient_id == pairs.c.patient_id))
+        .outerjoin(records, (records.c.doctor_id == pairs.c.doctor_id) & (records.c.patient_id == pairs.c.patient_id))
+    )
+    db.session.execute(delete(DoctorPatient))
+    db.session.execute(insert(DoctorPatient).from_select(
+        ['doctor_id', 'patient_id', 'first_visit', 'last_visit', 'visit_count', 'record_count'], links
+    ))
+    return db.session.query(func.count()).select_from(DoctorPatient).scalar()
+
+
+def get_doctor_patient_pair(instance, committed):
+    if not committed:
+        return instance.doctor_id, instance.patient_id
+    state = inspect(instance)
+    values = []
+    for name in ('doctor_id', 'patient_id'):
+        history = state.attrs[name].history
+        previous = history.deleted or history.unchanged
+        if not previous:
+            return None
+        values.append(previous[0])
+    return tuple(values)
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_doctor_patient_links(session, flush_context):
+    deltas = {}
+    stale_pairs = set()
+
+    for instance in session.new:
+        if not isinstance(instance, (Appointment, MedicalRecord)):
+            continue
+        pair = get_doctor_patient_pair(instance, committed=False)
+        visit_count, record_count, first_visit, last_visit = deltas.get(pair, (0, 0, None, None))
+        if isinstance(instance, MedicalRecord):
+            deltas[pair] = (visit_count, record_count + 1, first_visit, last_visit)
+            continue
+        visit_date = instance.appointment_date
+        deltas[pair] = (visit_count + 1, record_count,
+                        min(first_visit or visit_date, visit_date), max(last_visit or visit_date, visit_date))
+    for instance in session.deleted:
+        if isinstance(instance, (Appointment, MedicalRecord)):
+            stale_pairs.add(get_doctor_patient_pair(instance, committed=True)
+                            or (instance.doctor_id, instance.patient_id))
+    for instance in session.dirty:
+        if not isinstance(instance, (Appointment, MedicalRecord)) or not session.is_modified(instance):
+            continue
+        names = ('doctor_id', 'patient_id', 'appointment_date') if isinstance(instance, Appointment) \
+            else ('doctor_id', 'patient_id')
+        state = inspect(instance)
+        if not any(state.attrs[name].history.has_changes() for name in names):
+            continue
+        previous_pair = get_doctor_patient_pair(instance, committed=True)
+        if previous_pair is not None:
+            stale_pairs.add(previous_pair)
+        stale_pairs.add(get_doctor_patient_pair(instance, committed=False))
+
+    connection = session.connection()
+    for pair, (visit_count, record_count, first_visit, last_visit) in deltas.items():
+        if pair in stale_pairs:
+            continue
+        doctor_id, patient_id = pair
+        values = {
+            'visit_count': DoctorPatient.visit_count + visit_count,
+            'record_count': DoctorPatient.record_count + record_count
+        }
+        if first_visit is not None:
+            values['first_visit'] = case(
+                (or_(DoctorPatient.first_visit.is_(None), DoctorPatient.first_visit > first_visit), first_visit),
+                else_=DoctorPatient.first_visit
+            )
+            values['last_visit'] = case(
+                (or_(DoctorPatient.last_visit.is_(None), DoctorPatient.last_visit < last_visit), last_visit),
+                else_=DoctorPatient.last_visit
+            )
+        result = connection.execute(
+            update(DoctorPatient)
+            .where(DoctorPatient.doctor_id == doctor_id, DoctorPatient.patient_id == patient_id)
+            .values(**values)
+        )
+        if not result.rowcount:
+            stale_pairs.add(pair)
+
+    for doctor_id, patient_id in stale_pairs:
+        refresh_doctor_patient_link(connection, doctor_id, patient_id)
+
+
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     message = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class NotificationCounter(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    urgent_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def is_urgent_notification(title):
+    return URGENT_NOTIFICATION_MARKER in (title or '').lower()
+
+
+def count_unread_notifications(connection, user_id):
+    unread_count, urgent_count = connection.execute(
+        select(
+            func.count(Notification.id),
+            func.sum(case((func.lower(Notification.title).like(f'%{URGENT_NOTIFICATION_MARKER}%'), 1), else_=0))
+        ).where(
+            Notification.user_id == user_id,
+            Notification.is_read == False
+        )
+    ).one()
+    return unread_count, urgent_count or 0
+
+
+def get_notification_counts(user_id):
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is None:
+        return count_unread_notifications(db.session.connection(), user_id)
+    return counter.unread_count, counter.urgent_count
+
+
+def reset_notification_counter(user_id):
+    db.session.execute(
+        update(NotificationCounter)
+        .where(NotificationCounter.user_id == user_id)
+        .values(unread_count=0, urgent_count=0)
+    )
+
+
+def get_notification_counter_state(instance, committed):
+    state = inspect(instance)
+    values = []
+    for name in ('user_id', 'is_read', 'title'):
+        if not committed:
+            values.append(getattr(instance, name))
+            continue
+        history = state.attrs[name].history
+        previous = history.deleted or history.unchanged
+        if not previous:
+            return None
+        values.append(previous[0])
+    user_id, is_read, title = values
+    if is_read:
+        return user_id, 0, 0
+    return user_id, 1, 1 if is_urgent_notification(title) else 0
+
+
+def notification_to_dict(notification):
+    return {
+        'id': notification.id,
+        'user_id': notification.user_id,
+        'title': notification.title,
+        'message': notification.message,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M') if notification.created_at else None,
+        'is_read': bool(notification.is_read)
+    }
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_new_notifications(session, flush_context):
+    for instance in session.new:
+        if isinstance(instance, Notification):
+            session.info.setdefault('new_notifications', []).append(notification_to_dict(instance))
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_notification_counters(session, flush_context):
+    deltas = {}
+    stale_user_ids = set()
+
+    def add_delta(counter_state, sign):
+        user_id, unread, urgent = counter_state
+        unread_delta, urgent_delta = deltas.get(user_id, (0, 0))
+        deltas[user_id] = (unread_delta + sign * unread, urgent_delta + sign * urgent)
+
+    for instance in session.new:
+        if isinstance(instance, Notification):
+            add_delta(get_notification_counter_state(instance, committed=False), 1)
+    for instance in session.deleted:
+        if isinstance(instance, Notification):
+            counter_state = get_notification_counter_state(instance, committed=True)
+            if counter_state is None:
+                stale_user_ids.add(instance.user_id)
+            else:
+                add_delta(counter_state, -1)
+    for instance in session.dirty:
+        if not isinstance(instance, Notification) or not session.is_modified(instance):
+            continue
+        previous_state = get_notification_counter_state(instance, committed=True)
+        if previous_state is None:
+            stale_user_ids.add(instance.user_id)
+            continue
+        add_delta(previous_state, -1)
+        add_delta(get_notification_counter_state(instance, committed=False), 1)
+
+    connection = session.connection()
+    for user_id, (unread_delta, urgent_delta) in deltas.items():
+        if user_id in stale_user_ids or (not unread_delta and not urgent_delta):
+            continue
+        result = connection.execute(
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id == user_id)
+            .values(
+                unread_count=NotificationCounter.unread_count + unread_delta,
+                urgent_count=NotificationCounter.urgent_count + urgent_delta
+            )
+        )
+        if not result.rowcount:
+            stale_user_ids.add(user_id)
+
+    for user_id in stale_user_ids:
+        unread_count, urgent_count = count_unread_notifications(connection, user_id)
+        values = {'unread_count': unread_count, 'urgent_count': urgent_count}
+        result = connection.execute(
+            update(NotificationCounter).where(NotificationCounter.user_id == user_id).values(**values)
+        )
+        if not result.rowcount:
+            connection.execute(insert(NotificationCounter).values(user_id=user_id, **values))
+
+
+@event.listens_for(db.session, 'after_commit')
+def publish_new_notifications(session):
+    for notification in session.info.pop('new_notifications', []):
+        notification_broker.publish(notification['user_id'], notification)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_new_notifications(session, previous_transaction):
+    session.info.pop('new_notifications', None)
+
+
+class OutboxEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_outbox_event_processed_id', 'processed_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
 
 @app.route('/')
 def index():
@@ -326,25 +772,22 @@ def api_doctor_patients():
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    appointments = Appointment.query.filter_by(doctor_id=doctor.id).all()
-    patient_ids = set([app.patient_id for app in appointments])
-
-    patients = Patient.query.filter(Patient.id.in_(patient_ids)).all() if patient_ids else []
+    rows = db.session.query(Patient, DoctorPatient.last_visit).join(
+        DoctorPatient, DoctorPatient.patient_id == Patient.id
+    ).options(joinedload(Patient.user)).filter(
+        DoctorPatient.doctor_id == doctor.id,
+        DoctorPatient.visit_count > 0
+    ).all()
 
     patients_data = []
-    for patient in patients:
-        last_appointment = Appointment.query.filter_by(
-            patient_id=patient.id,
-            doctor_id=doctor.id
-        ).order_by(Appointment.appointment_date.desc()).first()
-
+    for patient, last_visit in rows:
         patients_data.append({
             'id': patient.id,
             'first_name': patient.first_name,
             'last_name': patient.last_name,
             'email': patient.user.email,
             'phone': patient.phone,
-            'last_visit': last_appointment.appointment_date.strftime('%Y-%m-%d') if last_appointment else 'Never',
+            'last_visit': last_visit.strftime('%Y-%m-%d') if last_visit else 'Never',
             'blood_type': patient.blood_type or 'Not specified'
         })
 
@@ -360,15 +803,12 @@ def api_doctor_available_patients():
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    all_patients = Patient.query.all()
-
-    doctor_patient_ids = {record.patient_id for record in MedicalRecord.query.filter_by(doctor_id=doctor.id).all()}
-    doctor_patient_ids.update({app.patient_id for app in Appointment.query.filter_by(doctor_id=doctor.id).all()})
-
-    available_patients = [
-        patient for patient in all_patients
-        if patient.id not in doctor_patient_ids
-    ]
+    available_patients = Patient.query.options(joinedload(Patient.user)).filter(
+        ~DoctorPatient.query.filter(
+            DoctorPatient.doctor_id == doctor.id,
+            DoctorPatient.patient_id == Patient.id
+        ).exists()
+    ).all()
 
     patients_data = []
     for patient in available_patients:
@@ -462,10 +902,7 @@ def api_doctor_patient_appointments(patient_id):
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Access denied'}), 403
@@ -552,6 +989,7 @@ def api_doctor_update_appointment(appointment_id):
         if 'reason' in data:
             appointment.reason = data['reason']
 
+        sync_appointment_reminders(appointment)
         db.session.commit()
 
         return jsonify({
@@ -577,10 +1015,7 @@ def api_doctor_create_appointment():
 
     patient_id = data.get('patient_id')
     appointment_date = data.get('appointment_date')
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -599,24 +1034,6 @@ def api_doctor_create_appointment():
         if not patient:
             return jsonify({'error': 'Patient not found'}), 404
 
-        has_treated = MedicalRecord.query.filter_by(
-            doctor_id=doctor.id,
-            patient_id=patient_id
-        ).first() is not None
-
-        if not has_treated:
-            pass
-
-        existing_appointment = Appointment.query.filter(
-            Appointment.doctor_id == doctor.id,
-            Appointment.appointment_date == appointment_date,
-            Appointment.appointment_time == appointment_time,
-            Appointment.status == 'scheduled'
-        ).first()
-
-        if existing_appointment:
-            return jsonify({'error': 'Time slot is already taken'}), 400
-
         appointment = Appointment(
             patient_id=patient_id,
             doctor_id=doctor.id,
@@ -627,16 +1044,20 @@ def api_doctor_create_appointment():
             status='scheduled'
         )
 
-        db.session.add(appointment)
-
         notification = Notification(
             user_id=patient.user_id,
             title='New Appointment Scheduled',
             message=f'Dr. {doctor.first_name} {doctor.last_name} has scheduled an appointment for you on {appointment_date} at {appointment_time.strftime("%H:%M")}'
         )
-        db.session.add(notification)
+        add_outbox_event('appointment_scheduled', patient.user_id,
+                         doctor=f'{doctor.first_name} {doctor.last_name}',
+                         specialization=doctor.specialization,
+                         patient=f'{patient.first_name} {patient.last_name}',
+                         date=appointment_date.strftime('%Y-%m-%d'),
+                         time=appointment_time.strftime('%H:%M'))
 
-        db.session.commit()
+        if not book_appointment(appointment, notification):
+            return slot_conflict_response(doctor.id, appointment_date)
 
         return jsonify({
             'success': True,
@@ -661,10 +1082,7 @@ def api_doctor_add_prescription():
     data = request.get_json()
     patient_id = data.get('patient_id')
 
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -680,7 +1098,6 @@ def api_doctor_add_prescription():
         )
 
         db.session.add(medical_record)
-        db.session.commit()
         patient = Patient.query.get(patient_id)
         notification = Notification(
             user_id=patient.user_id,
@@ -688,6 +1105,7 @@ def api_doctor_add_prescription():
             message=f'Dr. {doctor.first_name} {doctor.last_name} has prescribed {data.get("medication")} for you.'
         )
         db.session.add(notification)
+        add_prescription_event(medical_record, doctor, patient)
         db.session.commit()
 
         return jsonify({
@@ -707,24 +1125,22 @@ def api_doctor_patient_medical_records(patient_id):
     doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Access denied'}), 403
 
-    records = MedicalRecord.query.filter_by(patient_id=patient_id).order_by(
-        MedicalRecord.record_date.desc()
-    ).all()
+    query = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter_by(patient_id=patient_id)
+    try:
+        records, next_cursor = paginate_query(query, [MedicalRecord.record_date, MedicalRecord.id])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     records_data = []
     for record in records:
-        doctor = Doctor.query.get(record.doctor_id)
         records_data.append({
             'id': record.id,
-            'date': record.record_date.strftime('%Y-%m-%d'),
+            'date': record.record_date.strftime('%Y-%m-%d') if record.record_date else None,
             'diagnosis': record.diagnosis,
             'treatment': record.treatment,
             'prescriptions': record.prescriptions,
@@ -732,88 +1148,147 @@ def api_doctor_patient_medical_records(patient_id):
             'doctor_name': f'Dr. {record.doctor.first_name} {record.doctor.last_name}'
         })
 
-    return jsonify(records_data)
+    return jsonify({'items': records_data, 'next_cursor': next_cursor})
 
 
-@app.route('/doctor/dashboard')
-def doctor_dashboard():
-    print(f"Doctor dashboard access - session: {dict(session)}")
+patient_search_table = table('patient_search', column('rowid', db.Integer), column('patient_search'), column('rank'))
 
-    if 'user_id' not in session:
-        print("No user_id in session, redirecting to login")
-        return redirect(url_for('login'))
 
-    if session.get('user_type') != 'doctor':
-        print(f"Wrong user type: {session.get('user_type')}, redirecting to login")
-        return redirect(url_for('login'))
+def has_patient_search_index():
+    if 'PATIENT_SEARCH_FTS' not in app.config:
+        app.config['PATIENT_SEARCH_FTS'] = (db.engine.dialect.name == 'sqlite'
+                                            and inspect(db.engine).has_table('patient_search'))
+    return app.config['PATIENT_SEARCH_FTS']
 
-    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
-    if not doctor:
-        print("Doctor not found in database, redirecting to login")
-        return redirect(url_for('login'))
 
-    print(f"Doctor found: {doctor.first_name} {doctor.last_name}")
+def build_patient_search_match(search_term):
+    terms = re.findall(r'\w+', search_term.lower())[:PATIENT_SEARCH_MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
 
-    today = datetime.now().date()
 
-    appointments_today = Appointment.query.filter_by(
-        doctor_id=doctor.id,
-        appointment_date=today,
-        status='scheduled'
-    ).all()
+def filter_patient_search(query, search_term):
+    if has_patient_search_index():
+        match = build_patient_search_match(search_term)
+        if not match:
+            return query
+        return query.join(patient_search_table, patient_search_table.c.rowid == Patient.id).filter(
+            patient_search_table.c.patient_search.op('MATCH')(match)
+        ).order_by(patient_search_table.c.rank)
 
-    appointments_today_count = len(appointments_today)
-    appointment_patients = Appointment.query.filter_by(doctor_id=doctor.id).all()
-    medical_records = MedicalRecord.query.filter_by(doctor_id=doctor.id).all()
-    patient_ids = set([record.patient_id for record in medical_records])
-    patient_ids.update([app.patient_id for app in appointment_patients])
-    total_patients = len(patient_ids) if patient_ids else 0
-    total_appointments = Appointment.query.filter_by(doctor_id=doctor.id).count()
+    return query.join(User, User.id == Patient.user_id).filter(or_(
+        Patient.first_name.ilike(f'%{search_term}%'),
+        Patient.last_name.ilike(f'%{search_term}%'),
+        Patient.phone.ilike(f'%{search_term}%'),
+        User.email.ilike(f'%{search_term}%')
+    ))
 
-    yesterday = today - timedelta(days=1)
-    yesterday_appointments_count = Appointment.query.filter_by(
-        doctor_id=doctor.id,
-        appointment_date=yesterday
-    ).count()
 
-    week_start = today - timedelta(days=today.weekday())
-    new_patients_this_week = 0
+def get_doctor_dashboard_stats(doctor_id, today):
+    week_ago = today - timedelta(days=6)
 
-    pending_prescriptions_count = 0
+    daily_counts = db.session.query(
+        Appointment.appointment_date,
+        func.count(Appointment.id),
+        func.sum(case((Appointment.status == 'scheduled', 1), else_=0))
+    ).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date >= week_ago,
+        Appointment.appointment_date <= today
+    ).group_by(Appointment.appointment_date).all()
+    counts_by_day = {row[0]: (row[1], row[2] or 0) for row in daily_counts}
 
-    unread_notifications_count = Notification.query.filter_by(
-        user_id=session['user_id'],
-        is_read=False
-    ).count()
+    total_appointments, medical_records_count, total_patients = db.session.query(
+        select(func.count(Appointment.id)).where(Appointment.doctor_id == doctor_id).scalar_subquery(),
+        select(func.count(MedicalRecord.id)).where(MedicalRecord.doctor_id == doctor_id).scalar_subquery(),
+        select(func.count()).where(DoctorPatient.doctor_id == doctor_id).scalar_subquery()
+    ).one()
 
     weekly_appointments_data = []
+    max_appointments = 8
     for i in range(7):
-        day = today - timedelta(days=i)
-        count = Appointment.query.filter_by(
-            doctor_id=doctor.id,
-            appointment_date=day
-        ).count()
+        day = week_ago + timedelta(days=i)
+        count = counts_by_day.get(day, (0, 0))[0]
         weekly_appointments_data.append({
             'day': day.strftime('%a'),
-            'count': count
+            'count': count,
+            'percentage': min(count / max_appointments * 100, 100)
         })
-    weekly_appointments_data.reverse()
 
-    recent_appointments = Appointment.query.filter_by(
-        doctor_id=doctor.id
+    appointments_today = Appointment.query.options(joinedload(Appointment.patient)).filter_by(
+        doctor_id=doctor_id,
+        appointment_date=today,
+        status='scheduled'
+    ).order_by(Appointment.appointment_time.asc()).all()
+
+    upcoming_appointments = Appointment.query.options(joinedload(Appointment.patient)).filter_by(
+        doctor_id=doctor_id,
+        status='scheduled'
+    ).filter(Appointment.appointment_date >= today).order_by(
+        Appointment.appointment_date.asc(), Appointment.appointment_time.asc()
+    ).limit(10).all()
+
+    recent_appointments = Appointment.query.options(joinedload(Appointment.patient)).filter_by(
+        doctor_id=doctor_id
     ).order_by(Appointment.created_at.desc()).limit(5).all()
 
     recent_patients = []
     for app in recent_appointments:
-        patient = Patient.query.get(app.patient_id)
         recent_patients.append({
-            'id': patient.id,
-            'first_name': patient.first_name,
-            'last_name': patient.last_name,
-            'gender': patient.gender or 'male',
+            'id': app.patient.id,
+            'first_name': app.patient.first_name,
+            'last_name': app.patient.last_name,
+            'gender': app.patient.gender or 'male',
+            'avatar': app.patient.avatar,
             'last_visit': app.appointment_date.strftime('%Y-%m-%d')
         })
 
+    medical_records = MedicalRecord.query.options(joinedload(MedicalRecord.patient)).filter_by(
+        doctor_id=doctor_id
+    ).order_by(MedicalRecord.record_date.desc()).limit(5).all()
+
+    all_patients = Patient.query.options(joinedload(Patient.user)).join(
+        DoctorPatient, DoctorPatient.patient_id == Patient.id
+    ).filter(DoctorPatient.doctor_id == doctor_id).all()
+
+    return {
+        'appointments_today': appointments_today,
+        'appointments_today_count': counts_by_day.get(today, (0, 0))[1],
+        'yesterday_appointments_count': counts_by_day.get(today - timedelta(days=1), (0, 0))[0],
+        'total_appointments': total_appointments,
+        'total_patients': total_patients,
+        'medical_records_count': medical_records_count,
+        'weekly_appointments_data': weekly_appointments_data,
+        'upcoming_appointments': upcoming_appointments,
+        'recent_patients': recent_patients,
+        'medical_records': medical_records,
+        'all_patients': all_patients
+    }
+
+
+@app.route('/doctor/dashboard')
+def doctor_dashboard():
+    print(f"Doctor dashboard access - session: {dict(session)}")
+
+    if 'user_id' not in session:
+        print("No user_id in session, redirecting to login")
+        return redirect(url_for('login'))
+
+    if session.get('user_type') != 'doctor':
+        print(f"Wrong user type: {session.get('user_type')}, redirecting to login")
+        return redirect(url_for('login'))
+
+    doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
+    if not doctor:
+        print("Doctor not found in database, redirecting to login")
+        return redirect(url_for('login'))
+
+    print(f"Doctor found: {doctor.first_name} {doctor.last_name}")
+
+    today = datetime.now().date()
+    stats = get_doctor_dashboard_stats(doctor.id, today)
+
+    unread_notifications_count, _ = get_notification_counts(session['user_id'])
+
     recent_notifications = Notification.query.filter_by(
         user_id=session['user_id']
     ).order_by(Notification.created_at.desc()).limit(5).all()
@@ -821,67 +1296,40 @@ def doctor_dashboard():
     formatted_notifications = []
     for notification in recent_notifications:
         formatted_notifications.append({
+            'id': notification.id,
             'title': notification.title,
             'message': notification.message,
             'time_ago': format_timesince(notification.created_at),
             'icon': get_notification_icon(notification.title)
         })
 
-    appointment_patients = set([app.patient_id for app in Appointment.query.filter_by(doctor_id=doctor.id).all()])
-    patient_ids = patient_ids.union(appointment_patients)
-
-    all_patients = Patient.query.filter(Patient.id.in_(patient_ids)).all() if patient_ids else []
-
     medical_records_with_expiry = []
-    medical_records = MedicalRecord.query.filter_by(doctor_id=doctor.id).order_by(
-        MedicalRecord.record_date.desc()).limit(5).all()
-
-    for record in medical_records:
+    for record in stats['medical_records']:
         expiry_date = record.record_date + timedelta(days=30)
         medical_records_with_expiry.append({
             'record': record,
             'expiry_date': expiry_date.strftime('%Y-%m-%d')
         })
 
-        upcoming_appointments = Appointment.query.filter_by(
-            doctor_id=doctor.id,
-            status='scheduled'
-        ).filter(Appointment.appointment_date >= datetime.now().date()).order_by(
-            Appointment.appointment_date.asc()
-        ).limit(10).all()
-        for appointment in upcoming_appointments:
-            appointment.patient = Patient.query.get(appointment.patient_id)
-        weekly_data = []
-        for i in range(7):
-            day = today - timedelta(days=6 - i)
-            count = Appointment.query.filter_by(
-                doctor_id=doctor.id,
-                appointment_date=day
-            ).count()
-            max_appointments = 8
-            percentage = (count / max_appointments) * 100 if max_appointments > 0 else 0
-            weekly_data.append({
-                'day': day.strftime('%a'),
-                'count': count,
-                'percentage': percentage
-            })
-
     return render_template('e1.html',
                            doctor=doctor,
-                           all_patients=all_patients,
-                           appointments_today=appointments_today,
-                           appointments_today_count=appointments_today_count,
-                           total_patients=total_patients,
-                           total_appointments=total_appointments,
-                           yesterday_appointments_count=yesterday_appointments_count,
-                           new_patients_this_week=new_patients_this_week,
-                           pending_prescriptions_count=pending_prescriptions_count,
+                           all_patients=stats['all_patients'],
+                           appointments_today=stats['appointments_today'],
+                           appointments_today_count=stats['appointments_today_count'],
+                           total_patients=stats['total_patients'],
+                           total_appointments=stats['total_appointments'],
+                           yesterday_appointments_count=stats['yesterday_appointments_count'],
+                           new_patients_this_week=0,
+                           pending_prescriptions_count=0,
                            unread_notifications_count=unread_notifications_count,
-                           weekly_appointments_data=weekly_appointments_data,
-                           recent_patients=recent_patients,
+                           weekly_appointments_data=stats['weekly_appointments_data'],
+                           recent_patients=stats['recent_patients'],
                            recent_notifications=formatted_notifications,
                            unread_messages_count=0,
                            urgent_messages_count=0,
+                           upcoming_appointments=stats['upcoming_appointments'],
+                           medical_records=stats['medical_records'],
+                           medical_records_count=stats['medical_records_count'],
                            medical_records_with_expiry=medical_records_with_expiry,
                            today=today,
                            timedelta=timedelta)
@@ -895,16 +1343,9 @@ def api_doctor_my_patients():
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    medical_records = MedicalRecord.query.filter_by(doctor_id=doctor.id).all()
-    appointments = Appointment.query.filter_by(doctor_id=doctor.id).all()
-
-    patient_ids = set()
-    for record in medical_records:
-        patient_ids.add(record.patient_id)
-    for appointment in appointments:
-        patient_ids.add(appointment.patient_id)
-
-    patients = Patient.query.filter(Patient.id.in_(patient_ids)).all() if patient_ids else []
+    patients = Patient.query.join(DoctorPatient, DoctorPatient.patient_id == Patient.id).filter(
+        DoctorPatient.doctor_id == doctor.id
+    ).all()
 
     patients_data = []
     for patient in patients:
@@ -967,12 +1408,7 @@ def api_doctor_associate_patient():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    existing_record = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first()
-
-    if existing_record:
+    if has_treated_patient(doctor.id, patient_id):
         return jsonify({'error': 'Patient is already associated with this doctor'}), 400
 
     try:
@@ -1006,16 +1442,19 @@ def api_patient_appointments():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    appointments = Appointment.query.filter_by(patient_id=patient.id).order_by(
-        Appointment.appointment_date.desc(), Appointment.appointment_time.desc()).all()
+    query = Appointment.query.options(joinedload(Appointment.doctor)).filter_by(patient_id=patient.id)
+    try:
+        appointments, next_cursor = paginate_query(
+            query, [Appointment.appointment_date, Appointment.appointment_time, Appointment.id])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     appointments_data = []
     for app in appointments:
-        doctor = Doctor.query.get(app.doctor_id)
         appointments_data.append({
             'id': app.id,
-            'doctor_name': f'Dr. {doctor.first_name} {doctor.last_name}',
-            'specialization': doctor.specialization,
+            'doctor_name': f'Dr. {app.doctor.first_name} {app.doctor.last_name}',
+            'specialization': app.doctor.specialization,
             'date': app.appointment_date.strftime('%Y-%m-%d'),
             'time': app.appointment_time.strftime('%H:%M'),
             'status': app.status,
@@ -1023,7 +1462,7 @@ def api_patient_appointments():
             'notes': app.notes
         })
 
-    return jsonify(appointments_data)
+    return jsonify({'items': appointments_data, 'next_cursor': next_cursor})
 
 
 @app.route('/api/patient/prescriptions')
@@ -1054,6 +1493,60 @@ def api_patient_prescriptions():
     return jsonify(prescriptions_data)
 
 
+def get_patient_dashboard_stats(patient_id, user_id, today):
+    upcoming_appointments = Appointment.query.options(joinedload(Appointment.doctor)).filter_by(
+        patient_id=patient_id,
+        status='scheduled'
+    ).filter(Appointment.appointment_date >= today).order_by(
+        Appointment.appointment_date.asc(), Appointment.appointment_time.asc()
+    ).all()
+
+    recent_medical_records = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter_by(
+        patient_id=patient_id
+    ).order_by(MedicalRecord.record_date.desc()).limit(5).all()
+
+    doctors = Doctor.query.join(DoctorPatient, DoctorPatient.doctor_id == Doctor.id).filter(
+        DoctorPatient.patient_id == patient_id
+    ).all()
+
+    thirty_days_ago = today - timedelta(days=30)
+    prescriptions_records = MedicalRecord.query.filter(
+        MedicalRecord.patient_id == patient_id,
+        MedicalRecord.prescriptions.isnot(None),
+        MedicalRecord.record_date >= thirty_days_ago
+    ).order_by(MedicalRecord.record_date.desc()).all()
+
+    active_prescriptions = []
+    for record in prescriptions_records:
+        prescription_parts = record.prescriptions.split(' - ')
+        medication = prescription_parts[0] if len(prescription_parts) > 0 else 'Unknown'
+        dosage = prescription_parts[1] if len(prescription_parts) > 1 else 'Not specified'
+        expiry_date = record.record_date + timedelta(days=30)
+
+        active_prescriptions.append({
+            'medication': medication,
+            'dosage': dosage,
+            'expiry_date': expiry_date,
+            'record': record
+        })
+
+    unread_notifications_count, urgent_notifications_count = get_notification_counts(user_id)
+
+    recent_notifications = Notification.query.filter_by(user_id=user_id).order_by(
+        Notification.created_at.desc()
+    ).limit(5).all()
+
+    return {
+        'upcoming_appointments': upcoming_appointments,
+        'recent_medical_records': recent_medical_records,
+        'doctors': doctors,
+        'active_prescriptions': active_prescriptions,
+        'unread_notifications_count': unread_notifications_count,
+        'urgent_notifications_count': urgent_notifications_count,
+        'recent_notifications': recent_notifications
+    }
+
+
 @app.route('/patient/dashboard')
 def patient_dashboard():
     print(f"Patient dashboard access - session: {dict(session)}")
@@ -1078,73 +1571,22 @@ def patient_dashboard():
 
     print(f"Patient found: {patient.first_name} {patient.last_name}")
 
-    upcoming_appointments = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status='scheduled'
-    ).filter(Appointment.appointment_date >= datetime.now().date()).all()
-
-    for appointment in upcoming_appointments:
-        appointment.doctor = Doctor.query.get(appointment.doctor_id)
-
-    doctors = Doctor.query.all()
-    medical_records = MedicalRecord.query.filter_by(patient_id=patient.id).order_by(
-        MedicalRecord.record_date.desc()
-    ).all()
-    for record in medical_records:
-        record.doctor = Doctor.query.get(record.doctor_id)
-    notifications = Notification.query.filter_by(user_id=patient.user_id, is_read=False).all()
-    unread_notifications_count = len(notifications)
-    thirty_days_ago = datetime.now().date() - timedelta(days=30)
-    active_prescriptions_count = MedicalRecord.query.filter(
-        MedicalRecord.patient_id == patient.id,
-        MedicalRecord.prescriptions.isnot(None),
-        MedicalRecord.record_date >= thirty_days_ago
-    ).count()
-    active_prescriptions = []
-    prescriptions_records = MedicalRecord.query.filter(
-        MedicalRecord.patient_id == patient.id,
-        MedicalRecord.prescriptions.isnot(None),
-        MedicalRecord.record_date >= thirty_days_ago
-    ).order_by(MedicalRecord.record_date.desc()).all()
-
-    for record in prescriptions_records:
-        prescription_parts = record.prescriptions.split(' - ')
-        medication = prescription_parts[0] if len(prescription_parts) > 0 else 'Unknown'
-        dosage = prescription_parts[1] if len(prescription_parts) > 1 else 'Not specified'
-        expiry_date = record.record_date + timedelta(days=30)
-
-        active_prescriptions.append({
-            'medication': medication,
-            'dosage': dosage,
-            'expiry_date': expiry_date,
-            'record': record
-        })
-    recent_medical_records = MedicalRecord.query.filter_by(patient_id=patient.id).order_by(
-        MedicalRecord.record_date.desc()
-    ).limit(5).all()
-    for record in recent_medical_records:
-        record.doctor = Doctor.query.get(record.doctor_id)
-    recent_notifications = Notification.query.filter_by(user_id=patient.user_id).order_by(
-        Notification.created_at.desc()
-    ).limit(5).all()
-    urgent_notifications_count = Notification.query.filter_by(
-        user_id=patient.user_id,
-        is_read=False
-    ).filter(Notification.title.ilike('%urgent%')).count()
+    today = datetime.now().date()
+    stats = get_patient_dashboard_stats(patient.id, patient.user_id, today)
 
     return render_template('e2.html',
                            patient=patient,
                            user=user,
-                           upcoming_appointments=upcoming_appointments,
-                           doctors=doctors,
-                           active_prescriptions=active_prescriptions,
-                           medical_records=medical_records,
-                           recent_medical_records=recent_medical_records,
-                           recent_notifications=recent_notifications,
-                           active_prescriptions_count=active_prescriptions_count,
-                           unread_notifications_count=unread_notifications_count,
-                           urgent_notifications_count=urgent_notifications_count,
-                           today=datetime.now().date(),
+                           upcoming_appointments=stats['upcoming_appointments'],
+                           doctors=stats['doctors'],
+                           active_prescriptions=stats['active_prescriptions'],
+                           medical_records=stats['recent_medical_records'],
+                           recent_medical_records=stats['recent_medical_records'],
+                           recent_notifications=stats['recent_notifications'],
+                           active_prescriptions_count=len(stats['active_prescriptions']),
+                           unread_notifications_count=stats['unread_notifications_count'],
+                           urgent_notifications_count=stats['urgent_notifications_count'],
+                           today=today,
                            Doctor=Doctor)
 
 @app.route('/api/doctor/patients-search')
@@ -1157,41 +1599,24 @@ def api_doctor_patients_search():
         return jsonify({'error': 'Doctor not found'}), 404
 
     search_term = request.args.get('search', '')
-    medical_record_patients = MedicalRecord.query.filter_by(doctor_id=doctor.id).with_entities(
-        MedicalRecord.patient_id).all()
-    appointment_patients = Appointment.query.filter_by(doctor_id=doctor.id).with_entities(Appointment.patient_id).all()
-
-    patient_ids = set([record.patient_id for record in medical_record_patients])
-    patient_ids.update([app.patient_id for app in appointment_patients])
-
-    if not patient_ids:
-        return jsonify([])
-
-    query = Patient.query.filter(Patient.id.in_(patient_ids))
+    query = db.session.query(Patient, DoctorPatient.last_visit).join(
+        DoctorPatient, DoctorPatient.patient_id == Patient.id
+    ).options(joinedload(Patient.user)).filter(DoctorPatient.doctor_id == doctor.id)
 
     if search_term:
-        query = query.filter(or_(
-            Patient.first_name.ilike(f'%{search_term}%'),
-            Patient.last_name.ilike(f'%{search_term}%'),
-            Patient.phone.ilike(f'%{search_term}%')
-        ))
+        query = filter_patient_search(query, search_term)
 
-    patients = query.all()
+    rows = query.all()
 
     patients_data = []
-    for patient in patients:
-        last_appointment = Appointment.query.filter_by(
-            patient_id=patient.id,
-            doctor_id=doctor.id
-        ).order_by(Appointment.appointment_date.desc()).first()
-
+    for patient, last_visit in rows:
         patients_data.append({
             'id': patient.id,
             'first_name': patient.first_name,
             'last_name': patient.last_name,
             'email': patient.user.email,
             'phone': patient.phone,
-            'last_visit': last_appointment.appointment_date.strftime('%Y-%m-%d') if last_appointment else 'Never',
+            'last_visit': last_visit.strftime('%Y-%m-%d') if last_visit else 'Never',
             'blood_type': patient.blood_type or 'Not specified'
         })
 
@@ -1207,15 +1632,18 @@ def api_doctor_appointments():
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    appointments = Appointment.query.filter_by(doctor_id=doctor.id).order_by(
-        Appointment.appointment_date.desc(), Appointment.appointment_time.desc()).all()
+    query = Appointment.query.options(joinedload(Appointment.patient)).filter_by(doctor_id=doctor.id)
+    try:
+        appointments, next_cursor = paginate_query(
+            query, [Appointment.appointment_date, Appointment.appointment_time, Appointment.id])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     appointments_data = []
     for appointment in appointments:
-        patient = Patient.query.get(appointment.patient_id)
         appointments_data.append({
             'id': appointment.id,
-            'patient_name': f'{patient.first_name} {patient.last_name}',
+            'patient_name': f'{appointment.patient.first_name} {appointment.patient.last_name}',
             'date': appointment.appointment_date.strftime('%Y-%m-%d'),
             'time': appointment.appointment_time.strftime('%H:%M'),
             'reason': appointment.reason,
@@ -1223,7 +1651,7 @@ def api_doctor_appointments():
             'notes': appointment.notes
         })
 
-    return jsonify(appointments_data)
+    return jsonify({'items': appointments_data, 'next_cursor': next_cursor})
 @app.route('/api/doctor/patient/<int:patient_id>', methods=['DELETE'])
 def api_doctor_delete_patient(patient_id):
     if 'user_id' not in session or session.get('user_type') != 'doctor':
@@ -1232,10 +1660,7 @@ def api_doctor_delete_patient(patient_id):
     doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -1245,10 +1670,18 @@ def api_doctor_delete_patient(patient_id):
             doctor_id=doctor.id,
             patient_id=patient_id
         ).delete()
+        # Bulk deletes skip the ORM cascade, so the reminders have to go first
+        AppointmentReminder.query.filter(AppointmentReminder.appointment_id.in_(
+            select(Appointment.id).filter_by(doctor_id=doctor.id, patient_id=patient_id)
+        )).delete(synchronize_session=False)
         Appointment.query.filter_by(
             doctor_id=doctor.id,
             patient_id=patient_id
         ).delete()
+        DoctorPatient.query.filter_by(
+            doctor_id=doctor.id,
+            patient_id=patient_id
+        ).delete()
 
         db.session.commit()
 
@@ -1271,10 +1704,7 @@ def api_doctor_update_patient(patient_id):
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -1377,10 +1807,14 @@ def api_patient_update_medical_info():
 @app.route('/api/doctors')
 def api_doctors():
     specialization = request.args.get('specialization')
+    query = Doctor.query.filter_by(is_active=True)
     if specialization:
-        doctors = Doctor.query.filter_by(specialization=specialization, is_active=True).all()
-    else:
-        doctors = Doctor.query.filter_by(is_active=True).all()
+        query = query.filter_by(specialization=specialization)
+
+    try:
+        doctors, next_cursor = paginate_query(query, [Doctor.id], descending=False)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     doctors_data = []
     for doctor in doctors:
@@ -1391,7 +1825,69 @@ def api_doctors():
             'bio': doctor.bio
         })
 
-    return jsonify(doctors_data)
+    return jsonify({'items': doctors_data, 'next_cursor': next_cursor})
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def find_available_slots(doctor_ids, start_date, end_date, slot_minutes=SLOT_MINUTES):
+    working_hours = {}
+    for hours in WorkingHours.query.filter(WorkingHours.doctor_id.in_(doctor_ids)).all():
+        working_hours.setdefault((hours.doctor_id, hours.day_of_week), []).append((
+            hours.start_time.hour * 60 + hours.start_time.minute,
+            hours.end_time.hour * 60 + hours.end_time.minute
+        ))
+
+    busy = {}
+    appointments = db.session.query(
+        Appointment.doctor_id, Appointment.appointment_date, Appointment.appointment_time, Appointment.duration
+    ).filter(
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.appointment_date >= start_date,
+        Appointment.appointment_date <= end_date,
+        Appointment.status == 'scheduled'
+    ).all()
+    for doctor_id, appointment_date, appointment_time, duration in appointments:
+        start = appointment_time.hour * 60 + appointment_time.minute
+        busy.setdefault((doctor_id, appointment_date), []).append((start, start + (duration or slot_minutes)))
+
+    now = datetime.now()
+    slots = {doctor_id: {} for doctor_id in doctor_ids}
+    day = max(start_date, now.date())
+    while day <= end_date:
+        # Slots that already started today can no longer be booked
+        earliest = now.hour * 60 + now.minute + 1 if day == now.date() else 0
+        for doctor_id in doctor_ids:
+            windows = working_hours.get((doctor_id, day.weekday()))
+            if not windows:
+                continue
+
+            intervals = merge_intervals(busy.get((doctor_id, day), []))
+            day_slots = []
+            for window_start, window_end in merge_intervals(windows):
+                i = 0
+                slot_start = window_start
+                while slot_start + slot_minutes <= window_end:
+                    while i < len(intervals) and intervals[i][1] <= slot_start:
+                        i += 1
+                    free = i == len(intervals) or intervals[i][0] >= slot_start + slot_minutes
+                    if free and slot_start >= earliest:
+                        day_slots.append(f'{slot_start // 60:02d}:{slot_start % 60:02d}')
+                    slot_start += slot_minutes
+
+            if day_slots:
+                slots[doctor_id][day] = day_slots
+        day += timedelta(days=1)
+
+    return slots
 
 
 @app.route('/api/doctor/<int:doctor_id>/availability')
@@ -1407,40 +1903,70 @@ def api_doctor_availability(doctor_id):
 
     doctor = Doctor.query.get_or_404(doctor_id)
 
-    day_of_week = date.weekday()
-    working_hours = WorkingHours.query.filter_by(doctor_id=doctor_id, day_of_week=day_of_week).first()
+    slots = find_available_slots([doctor.id], date, date)
+    return jsonify({'available_slots': slots[doctor.id].get(date, [])})
 
-    if not working_hours:
-        return jsonify({'available_slots': []})
 
-    appointments = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.appointment_date == date,
-        Appointment.status == 'scheduled'
-    ).all()
+@app.route('/api/availability')
+def api_availability():
+    try:
+        start_date = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d').date() \
+            if request.args.get('start_date') else datetime.now().date()
+        if request.args.get('end_date'):
+            end_date = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d').date()
+        else:
+            end_date = start_date + timedelta(days=request.args.get('days', 7, type=int) - 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
 
-    available_slots = []
-    current_time = datetime.combine(date, working_hours.start_time)
-    end_time = datetime.combine(date, working_hours.end_time)
+    if end_date < start_date:
+        return jsonify({'error': 'end_date must not be before start_date'}), 400
+    if (end_date - start_date).days >= MAX_AVAILABILITY_DAYS:
+        return jsonify({'error': f'Date range is limited to {MAX_AVAILABILITY_DAYS} days'}), 400
 
-    while current_time + timedelta(minutes=30) <= end_time:
-        slot_end = current_time + timedelta(minutes=30)
+    query = Doctor.query.filter_by(is_active=True)
+    if request.args.get('doctor_ids'):
+        try:
+            doctor_ids = [int(doctor_id) for doctor_id in request.args.get('doctor_ids').split(',')]
+        except ValueError:
+            return jsonify({'error': 'Invalid doctor_ids'}), 400
+        query = query.filter(Doctor.id.in_(doctor_ids))
+    if request.args.get('specialization'):
+        query = query.filter_by(specialization=request.args.get('specialization'))
 
-        slot_available = True
-        for app in appointments:
-            app_start = datetime.combine(date, app.appointment_time)
-            app_end = app_start + timedelta(minutes=app.duration or 30)
+    doctors = query.order_by(Doctor.id).all()
+    if not doctors:
+        return jsonify({'doctors': [], 'first_available': None})
 
-            if not (slot_end <= app_start or current_time >= app_end):
-                slot_available = False
-                break
+    slots = find_available_slots([doctor.id for doctor in doctors], start_date, end_date)
 
-        if slot_available:
-            available_slots.append(current_time.time().strftime('%H:%M'))
+    doctors_data = []
+    first_available = None
+    for doctor in doctors:
+        doctor_slots = slots[doctor.id]
+        doctors_data.append({
+            'doctor_id': doctor.id,
+            'name': f'Др. {doctor.first_name} {doctor.last_name}',
+            'specialization': doctor.specialization,
+            'available_slots': {day.strftime('%Y-%m-%d'): times for day, times in sorted(doctor_slots.items())}
+        })
+        if doctor_slots:
+            day = min(doctor_slots)
+            candidate = (day, doctor_slots[day][0], doctor.id)
+            if first_available is None or candidate < first_available:
+                first_available = candidate
 
-        current_time += timedelta(minutes=30)
+    if request.args.get('first') in ('1', 'true'):
+        doctors_data = []
 
-    return jsonify({'available_slots': available_slots})
+    return jsonify({
+        'doctors': doctors_data,
+        'first_available': {
+            'doctor_id': first_available[2],
+            'date': first_available[0].strftime('%Y-%m-%d'),
+            'time': first_available[1]
+        } if first_available else None
+    })
 
 
 @app.route('/api/appointments', methods=['POST'])
@@ -1464,39 +1990,98 @@ def api_create_appointment():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    existing_appointment = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        Appointment.appointment_date == appointment_date,
-        Appointment.appointment_time == appointment_time,
-        Appointment.status == 'scheduled'
-    ).first()
+    doctor = db.session.get(Doctor, doctor_id) if doctor_id else None
+    if not doctor:
+        return jsonify({'error': 'Doctor not found'}), 404
 
-    if existing_appointment:
-        return jsonify({'error': 'Time slot is already taken'}), 400
     appointment = Appointment(
         patient_id=patient.id,
-        doctor_id=doctor_id,
+        doctor_id=doctor.id,
         appointment_date=appointment_date,
         appointment_time=appointment_time,
         reason=reason,
         status='scheduled'
     )
-
-    db.session.add(appointment)
-    db.session.commit()
-
-    doctor = Doctor.query.get(doctor_id)
     notification = Notification(
         user_id=doctor.user_id,
         title='Новий запис на прийом',
         message=f'Пацієнт {patient.first_name} {patient.last_name} записався на {appointment_date} о {appointment_time}'
     )
-    db.session.add(notification)
-    db.session.commit()
+
+    if not book_appointment(appointment, notification):
+        return slot_conflict_response(doctor.id, appointment_date)
 
     return jsonify({'success': True, 'appointment_id': appointment.id})
 
 
+def add_outbox_event(event_type, user_id, **payload):
+    db.session.add(OutboxEvent(event_type=event_type, user_id=user_id,
+                               payload=json.dumps(payload, ensure_ascii=False)))
+
+
+def add_prescription_event(medical_record, doctor, patient):
+    if medical_record.prescriptions:
+        add_outbox_event('prescription_added', patient.user_id,
+                         doctor=f'{doctor.first_name} {doctor.last_name}',
+                         patient=f'{patient.first_name} {patient.last_name}',
+                         prescriptions=medical_record.prescriptions,
+                         date=(medical_record.record_date or datetime.utcnow()).strftime('%Y-%m-%d %H:%M'))
+
+
+def sync_appointment_reminders(appointment, now=None):
+    now = now or datetime.now()
+    starts_at = datetime.combine(appointment.appointment_date, appointment.appointment_time)
+    reminders = {reminder.reminder_type: reminder for reminder in appointment.reminders}
+
+    for reminder_type, offset in APPOINTMENT_REMINDER_OFFSETS.items():
+        reminder = reminders.get(reminder_type)
+        if reminder is not None and reminder.sent_at is not None:
+            continue
+
+        due_at = starts_at - offset
+        if appointment.status == 'scheduled' and due_at >= now:
+            if reminder is None:
+                appointment.reminders.append(AppointmentReminder(reminder_type=reminder_type, due_at=due_at))
+            else:
+                reminder.due_at = due_at
+        elif reminder is not None:
+            appointment.reminders.remove(reminder)
+
+
+def book_appointment(appointment, notification):
+    slot = dict(doctor_id=appointment.doctor_id, appointment_date=appointment.appointment_date,
+                appointment_time=appointment.appointment_time, status='scheduled')
+    sync_appointment_reminders(appointment)
+    db.session.add(appointment)
+    db.session.add(notification)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # Only uq_appointment_scheduled_slot means the slot was taken; any other violation is a real error
+        if Appointment.query.filter_by(**slot).first() is None:
+            raise
+        return False
+    return True
+
+
+def slot_conflict_response(doctor_id, appointment_date, limit=5):
+    slots = find_available_slots([doctor_id], appointment_date, appointment_date + timedelta(days=6))[doctor_id]
+    alternative_slots = []
+    for day in sorted(slots):
+        for slot in slots[day]:
+            alternative_slots.append({'date': day.strftime('%Y-%m-%d'), 'time': slot})
+            if len(alternative_slots) >= limit:
+                break
+        if len(alternative_slots) >= limit:
+            break
+
+    return jsonify({
+        'error': 'Time slot is already taken',
+        'alternative_slots': alternative_slots
+    }), 409
+
+
 @app.route('/api/medical-records/<int:patient_id>')
 def api_medical_records(patient_id):
     if 'user_id' not in session:
@@ -1549,6 +2134,59 @@ def api_notifications():
 
     return jsonify(notifications_data)
 
+@app.route('/api/notifications/stream')
+def api_notifications_stream():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    user_id = session['user_id']
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+    subscription = notification_broker.subscribe(user_id)
+    try:
+        backlog = []
+        if last_event_id.isdigit():
+            backlog = Notification.query.filter(
+                Notification.user_id == user_id,
+                Notification.id > int(last_event_id)
+            ).order_by(Notification.id).limit(NOTIFICATION_STREAM_BACKLOG).all()
+        backlog = [notification_to_dict(notification) for notification in backlog]
+        unread_count, _ = get_notification_counts(user_id)
+        last_id = db.session.query(func.max(Notification.id)).filter(Notification.user_id == user_id).scalar()
+    except Exception:
+        subscription.close()
+        raise
+
+    def format_event(data, event_name, event_id=None):
+        lines = [f'event: {event_name}']
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+        lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+        return '\n'.join(lines) + '\n\n'
+
+    def generate():
+        try:
+            yield f'retry: {NOTIFICATION_STREAM_RETRY_MS}\n\n'
+            for notification in backlog:
+                yield format_event(notification, 'notification', notification['id'])
+            yield format_event({'count': unread_count}, 'unread')
+            if len(backlog) == NOTIFICATION_STREAM_BACKLOG:
+                return
+
+            seen_id = last_id or 0
+            while not subscription.overflowed:
+                notification = subscription.get(timeout=NOTIFICATION_STREAM_HEARTBEAT_SECONDS)
+                if notification is None:
+                    yield ': keepalive\n\n'
+                elif notification['id'] > seen_id:
+                    seen_id = notification['id']
+                    yield format_event(notification, 'notification', notification['id'])
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/doctor/patient/<int:patient_id>/add-prescription', methods=['POST'])
 def api_doctor_add_patient_prescription(patient_id):
     if 'user_id' not in session or session.get('user_type') != 'doctor':
@@ -1557,10 +2195,7 @@ def api_doctor_add_patient_prescription(patient_id):
     doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -1587,6 +2222,7 @@ def api_doctor_add_patient_prescription(patient_id):
             is_read=False
         )
         db.session.add(notification)
+        add_prescription_event(medical_record, doctor, patient)
 
         db.session.commit()
 
@@ -1609,10 +2245,7 @@ def api_doctor_add_medical_record(patient_id):
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
 
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -1639,6 +2272,7 @@ def api_doctor_add_medical_record(patient_id):
             is_read=False
         )
         db.session.add(notification)
+        add_prescription_event(medical_record, doctor, patient)
 
         db.session.commit()
 
@@ -1660,10 +2294,7 @@ def api_doctor_send_notification(patient_id):
     doctor = Doctor.query.filter_by(user_id=session['user_id']).first()
     if not doctor:
         return jsonify({'error': 'Doctor not found'}), 404
-    has_treated = MedicalRecord.query.filter_by(
-        doctor_id=doctor.id,
-        patient_id=patient_id
-    ).first() is not None
+    has_treated = has_treated_patient(doctor.id, patient_id)
 
     if not has_treated:
         return jsonify({'error': 'Patient is not associated with this doctor'}), 403
@@ -1680,6 +2311,10 @@ def api_doctor_send_notification(patient_id):
         )
 
         db.session.add(notification)
+        add_outbox_event('notification', patient.user_id,
+                         doctor=f'{doctor.first_name} {doctor.last_name}',
+                         title=notification.title,
+                         message=notification.message)
         db.session.commit()
 
         return jsonify({
@@ -1701,24 +2336,78 @@ def api_patient_medical_records():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    records = MedicalRecord.query.filter_by(patient_id=patient.id).order_by(
-        MedicalRecord.record_date.desc()
-    ).all()
+    query = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter_by(patient_id=patient.id)
+    try:
+        records, next_cursor = paginate_query(query, [MedicalRecord.record_date, MedicalRecord.id])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     records_data = []
     for record in records:
-        doctor = Doctor.query.get(record.doctor_id)
         records_data.append({
             'id': record.id,
-            'date': record.record_date.strftime('%Y-%m-%d'),
-            'doctor_name': f'Dr. {doctor.first_name} {doctor.last_name}',
+            'date': record.record_date.strftime('%Y-%m-%d') if record.record_date else None,
+            'doctor_name': f'Dr. {record.doctor.first_name} {record.doctor.last_name}',
             'diagnosis': record.diagnosis,
             'treatment': record.treatment,
             'prescriptions': record.prescriptions,
             'notes': record.notes
         })
 
-    return jsonify(records_data)
+    return jsonify({'items': records_data, 'next_cursor': next_cursor})
+
+
+@app.route('/api/patient/medical-records/export')
+def export_medical_records():
+    if 'user_id' not in session or session.get('user_type') != 'patient':
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    patient = Patient.query.filter_by(user_id=session['user_id']).first()
+    if not patient:
+        return jsonify({'error': 'Patient not found'}), 404
+
+    export_format = request.args.get('format', 'pdf')
+    if export_format not in ('pdf', 'zip'):
+        return jsonify({'error': 'Invalid export format'}), 400
+
+    try:
+        date_from = datetime.strptime(request.args.get('date_from'), '%Y-%m-%d').date() \
+            if request.args.get('date_from') else None
+        date_to = datetime.strptime(request.args.get('date_to'), '%Y-%m-%d').date() \
+            if request.args.get('date_to') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+
+    query = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)).filter_by(patient_id=patient.id)
+    if date_from:
+        query = query.filter(MedicalRecord.record_date >= datetime.combine(date_from, time.min))
+    if date_to:
+        query = query.filter(MedicalRecord.record_date < datetime.combine(date_to + timedelta(days=1), time.min))
+    records = query.order_by(MedicalRecord.record_date, MedicalRecord.id).all()
+    if not records:
+        return jsonify({'error': 'No medical records found'}), 404
+
+    pdf_data = [get_record_pdf_data(record, patient, record.doctor) for record in records]
+    filename = f'medical_history_{patient.id}.{export_format}'
+
+    if export_format == 'zip':
+        items = (
+            (get_record_pdf_name(data[0]), get_record_pdf_key('medical-record', data[0], data), 'medical-record', data)
+            for data in pdf_data
+        )
+        return Response(iter_zip(pdf_render_service.render_many(items)), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+    try:
+        entries = [(record_data, doctor_data) for record_data, _, doctor_data in pdf_data]
+        path = pdf_render_service.render_file('medical-history', pdf_data[0][1], entries)
+    except Exception as e:
+        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
+
+    response = send_file(path, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    response.direct_passthrough = False
+    response.call_on_close(lambda: os.remove(path))
+    return response
 
 
 @app.route('/api/patient/notifications')
@@ -1730,9 +2419,11 @@ def api_patient_notifications():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    notifications = Notification.query.filter_by(
-        user_id=session['user_id']
-    ).order_by(Notification.created_at.desc()).all()
+    query = Notification.query.filter_by(user_id=session['user_id'])
+    try:
+        notifications, next_cursor = paginate_query(query, [Notification.created_at, Notification.id])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
     notifications_data = []
     for notification in notifications:
@@ -1741,10 +2432,10 @@ def api_patient_notifications():
             'title': notification.title,
             'message': notification.message,
             'is_read': notification.is_read,
-            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M')
+            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M') if notification.created_at else None
         })
 
-    return jsonify(notifications_data)
+    return jsonify({'items': notifications_data, 'next_cursor': next_cursor})
 
 
 @app.route('/api/notifications/<int:notification_id>/read', methods=['POST'])
@@ -1760,6 +2451,8 @@ def api_mark_notification_read(notification_id):
     db.session.commit()
 
     return jsonify({'success': True})
+
+
 @app.route('/api/patient/prescription/<int:record_id>/pdf')
 def download_prescription_pdf(record_id):
     if 'user_id' not in session or session.get('user_type') != 'patient':
@@ -1774,163 +2467,18 @@ def download_prescription_pdf(record_id):
         return jsonify({'error': 'Access denied'}), 403
 
     try:
-        font_name = register_ukrainian_font()
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        p.setFont(font_name, 12)
-
-        y_position = 750
-        line_height = 14
-
-        def safe_draw_text(text, x=50, y=None, font_size=12, bold=False):
-            nonlocal y_position
-            if y is None:
-                y = y_position
-            if text is None:
-                text = ""
-            text = str(text)
-            if bold:
-                try:
-                    bold_font = font_name + "-Bold"
-                    p.setFont(bold_font, font_size)
-                except:
-                    p.setFont(font_name, font_size)
-                    p.setFillColorRGB(0, 0, 0)
-            else:
-                p.setFont(font_name, font_size)
-                p.setFillColorRGB(0, 0, 0)
-
-            try:
-                p.drawString(x, y, text)
-            except UnicodeEncodeError:
-                ukrainian_chars = {
-                    'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'G', 'Ґ': 'G', 'Д': 'D',
-                    'Е': 'E', 'Є': 'Ye', 'Ж': 'Zh', 'З': 'Z', 'И': 'Y',
-                    'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
-                    'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R',
-                    'С': 'S', 'Т': 'T', 'У': 'U', 'Ф': 'F', 'Х': 'Kh',
-                    'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch', 'Ь': '',
-                    'Ю': 'Yu', 'Я': 'Ya',
-                    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd',
-                    'е': 'e', 'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'y',
-                    'і': 'i', 'ї': 'yi', 'й': 'y', 'к': 'k', 'л': 'l',
-                    'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
-                    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh',
-                    'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ь': '',
-                    'ю': 'yu', 'я': 'ya'
-                }
-                safe_text = ''.join(ukrainian_chars.get(char, char) for char in text)
-                p.drawString(x, y, safe_text)
-            except Exception as e:
-                p.drawString(x, y, "")
-
-            if y == y_position:
-                y_position -= line_height
-
-            return y_position
-
-        def draw_multiline_text(text, x=50, max_width=80):
-            nonlocal y_position
-
-            if not text:
-                return
-            words = text.split()
-            lines = []
-            current_line = []
-
-            for word in words:
-                test_line = ' '.join(current_line + [word])
-                if len(test_line) <= max_width:
-                    current_line.append(word)
-                else:
-                    if current_line:
-                        lines.append(' '.join(current_line))
-                    current_line = [word]
-
-            if current_line:
-                lines.append(' '.join(current_line))
-
-            for line in lines:
-                safe_draw_text(line, x)
-                y_position -= line_height
-        safe_draw_text("МЕДИЧНА КЛІНІКА 'MEDICONNECT'", 50, 750, 14, True)
-        safe_draw_text("ОФІЦІЙНИЙ РЕЦЕПТ", 50, 735, 12, True)
-        y_position -= 20
-        safe_draw_text(f"Номер рецепту: PR-{record_id:06d}", bold=True)
-        safe_draw_text(f"Дата випису: {record.record_date.strftime('%d.%m.%Y %H:%M')}")
-        safe_draw_text(f"Дійсний до: {(record.record_date + timedelta(days=30)).strftime('%d.%m.%Y')}")
-        y_position -= 10
-        safe_draw_text("ІНФОРМАЦІЯ ПРО ПАЦІЄНТА", bold=True)
-        safe_draw_text(f"ПІБ: {patient.first_name} {patient.last_name}")
-        safe_draw_text(f"Дата народження: {patient.birthdate.strftime('%d.%m.%Y')}")
-        safe_draw_text(f"Телефон: {patient.phone or 'Не вказано'}")
-        safe_draw_text(f"Група крові: {patient.blood_type or 'Не вказано'}")
-        y_position -= 10
         doctor = db.session.get(Doctor, record.doctor_id)
-        safe_draw_text("ІНФОРМАЦІЯ ПРО ЛІКАРЯ", bold=True)
-        safe_draw_text(f"ПІБ: Др. {doctor.first_name} {doctor.last_name}")
-        safe_draw_text(f"Спеціалізація: {doctor.specialization}")
-        safe_draw_text(f"Ліцензія: {doctor.license_number}")
-        safe_draw_text(f"Телефон: {doctor.phone}")
-        y_position -= 10
-        if record.diagnosis and record.diagnosis.strip():
-            safe_draw_text("ДІАГНОЗ", bold=True)
-            draw_multiline_text(record.diagnosis)
-            y_position -= 5
-
-        if record.treatment and record.treatment.strip():
-            safe_draw_text("ЛІКУВАННЯ", bold=True)
-            draw_multiline_text(record.treatment)
-            y_position -= 5
-
-        if record.prescriptions and record.prescriptions.strip():
-            safe_draw_text("ПРИЗНАЧЕННЯ", bold=True)
-            draw_multiline_text(record.prescriptions)
-            y_position -= 5
-
-        if record.notes and record.notes.strip():
-            safe_draw_text("ДОДАТКОВІ ПРИМІТКИ", bold=True)
-            draw_multiline_text(record.notes)
-            y_position -= 5
-        safe_draw_text("ВАЖЛИВІ ПРИМІТКИ", bold=True)
-        y_position -= 5
-
-        important_notes = [
-            "Цей рецепт дійсний протягом 30 днів з дати випису",
-            "Ліки приймати строго за призначенням лікаря",
-            "При виникненні побічних ефектів негайно звернутися до лікаря",
-            "Зберігати в недоступному для дітей місці",
-            "Не використовувати після закінчення терміну придатності"
-        ]
-
-        for note in important_notes:
-            safe_draw_text(f"• {note}")
-            y_position -= line_height
-
-        y_position -= 10
-
-        safe_draw_text("_________________________", 50, y_position)
-        safe_draw_text("Підпис пацієнта", 70, y_position - 15, 8)
-
-        safe_draw_text("_________________________", 300, y_position)
-        safe_draw_text("Підпис лікаря", 320, y_position - 15, 8)
-
-        safe_draw_text(f"Документ створено: {datetime.now().strftime('%d.%m.%Y %H:%M')}", 50, 50, 8)
-
-        p.showPage()
-        p.save()
-        buffer.seek(0)
-
         return send_file(
-            buffer,
+            get_record_pdf('prescription', record, patient, doctor),
             as_attachment=True,
-            download_name=f'рецепт_{patient.last_name}_{record.record_date.strftime("%Y%m%d")}.pdf',
+            download_name=get_record_pdf_download_name('prescription', record, patient),
             mimetype='application/pdf'
         )
 
     except Exception as e:
         return jsonify({'error': f'Помилка генерації PDF: {str(e)}'}), 500
 
+
 @app.route('/api/patient/prescription/<int:record_id>/pdf-simple')
 def download_prescription_pdf_simple(record_id):
     if 'user_id' not in session or session.get('user_type') != 'patient':
@@ -1945,113 +2493,18 @@ def download_prescription_pdf_simple(record_id):
         return jsonify({'error': 'Access denied'}), 403
 
     try:
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        p.setFont("Helvetica", 10)
-
-        y = 750
-        line_height = 14
-
-        def draw_ascii_text(text, y_pos=None):
-            nonlocal y
-            if y_pos is None:
-                y_pos = y
-            if text is None:
-                text = ""
-            ukrainian_to_latin = {
-                'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'G', 'Ґ': 'G', 'Д': 'D',
-                'Е': 'E', 'Є': 'Ye', 'Ж': 'Zh', 'З': 'Z', 'И': 'Y',
-                'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
-                'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R',
-                'С': 'S', 'Т': 'T', 'У': 'U', 'Ф': 'F', 'Х': 'Kh',
-                'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch',
-                'Ю': 'Yu', 'Я': 'Ya',
-                'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd',
-                'е': 'e', 'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'y',
-                'і': 'i', 'ї': 'yi', 'й': 'y', 'к': 'k', 'л': 'l',
-                'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
-                'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh',
-                'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
-                'ю': 'yu', 'я': 'ya'
-            }
-
-            ascii_text = ''.join(ukrainian_to_latin.get(char, char) for char in str(text))
-            p.drawString(50, y_pos, ascii_text[:80])
-
-            if y_pos == y:
-                y -= line_height
-            return y
-        draw_ascii_text("MEDYCHNA KLINIKA 'MEDICONNECT'")
-        draw_ascii_text("OFITSIIYNYI RETSEPT")
-        y -= 20
-        draw_ascii_text(f"Nomier retseptu: PR-{record_id:06d}")
-        draw_ascii_text(f"Data vypysu: {record.record_date.strftime('%d.%m.%Y %H:%M')}")
-        draw_ascii_text(f"Diisnyi do: {(record.record_date + timedelta(days=30)).strftime('%d.%m.%Y')}")
-        y -= 10
-        draw_ascii_text("INFORMATSIIA PRO PATSIiENTA")
-        draw_ascii_text(f"PIB: {patient.first_name} {patient.last_name}")
-        draw_ascii_text(f"Data narodzhennia: {patient.birthdate.strftime('%d.%m.%Y')}")
-        draw_ascii_text(f"Telefon: {patient.phone or 'Ne vkazano'}")
-        draw_ascii_text(f"Grupa krovi: {patient.blood_type or 'Ne vkazano'}")
-        y -= 10
         doctor = db.session.get(Doctor, record.doctor_id)
-        draw_ascii_text("INFORMATSIIA PRO LIKARIA")
-        draw_ascii_text(f"PIB: Dr. {doctor.first_name} {doctor.last_name}")
-        draw_ascii_text(f"Spetsializatsiia: {doctor.specialization}")
-        draw_ascii_text(f"Litsenziia: {doctor.license_number}")
-        draw_ascii_text(f"Telefon: {doctor.phone}")
-        y -= 10
-        if record.diagnosis:
-            draw_ascii_text("DIAHNOZ")
-            words = record.diagnosis.split()
-            lines = []
-            current_line = []
-            for word in words:
-                if len(' '.join(current_line + [word])) <= 80:
-                    current_line.append(word)
-                else:
-                    if current_line:
-                        lines.append(' '.join(current_line))
-                    current_line = [word]
-            if current_line:
-                lines.append(' '.join(current_line))
-
-            for line in lines:
-                draw_ascii_text(line)
-            y -= 5
-
-        if record.prescriptions:
-            draw_ascii_text("PRYZNACHENNIA")
-            words = record.prescriptions.split()
-            lines = []
-            current_line = []
-            for word in words:
-                if len(' '.join(current_line + [word])) <= 80:
-                    current_line.append(word)
-                else:
-                    if current_line:
-                        lines.append(' '.join(current_line))
-                    current_line = [word]
-            if current_line:
-                lines.append(' '.join(current_line))
-
-            for line in lines:
-                draw_ascii_text(line)
-
-        p.showPage()
-        p.save()
-        buffer.seek(0)
-
         return send_file(
-            buffer,
+            get_record_pdf('prescription-simple', record, patient, doctor),
             as_attachment=True,
-            download_name=f'prescription_{patient.last_name}.pdf',
+            download_name=get_record_pdf_download_name('prescription-simple', record, patient),
             mimetype='application/pdf'
         )
 
     except Exception as e:
         return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
 
+
 @app.route('/api/patient/medical-record/<int:record_id>/pdf')
 def download_medical_record_pdf(record_id):
     if 'user_id' not in session or session.get('user_type') != 'patient':
@@ -2066,154 +2519,69 @@ def download_medical_record_pdf(record_id):
         return jsonify({'error': 'Access denied'}), 403
 
     try:
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        p.setFont("Helvetica", 10)
-
-        y_position = 750
-        line_height = 14
-
-        def ukrainian_to_ascii(text):
-            if not text:
-                return ""
-
-            translit_map = {
-                'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'H', 'Ґ': 'G', 'Д': 'D',
-                'Е': 'E', 'Є': 'Ye', 'Ж': 'Zh', 'З': 'Z', 'И': 'Y',
-                'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
-                'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R',
-                'С': 'S', 'Т': 'T', 'У': 'U', 'Ф': 'F', 'Х': 'Kh',
-                'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch',
-                'Ю': 'Yu', 'Я': 'Ya',
-                'а': 'a', 'б': 'b', 'в': 'v', 'г': 'h', 'ґ': 'g', 'д': 'd',
-                'е': 'e', 'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'y',
-                'і': 'i', 'ї': 'yi', 'й': 'y', 'к': 'k', 'л': 'l',
-                'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
-                'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh',
-                'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
-                'ю': 'yu', 'я': 'ya',
-                'ʼ': "'", '`': "'", '´': "'", 'ь': '', 'ъ': ''
-            }
-            result = []
-            for char in str(text):
-                if char in translit_map:
-                    result.append(translit_map[char])
-                else:
-                    result.append(char)
-
-            return ''.join(result)
-
-        def wrap_text(text, max_length):
-            if not text:
-                return []
-
-            words = text.split()
-            lines = []
-            current_line = []
-
-            for word in words:
-                if len(' '.join(current_line + [word])) <= max_length:
-                    current_line.append(word)
-                else:
-                    if current_line:
-                        lines.append(' '.join(current_line))
-                    current_line = [word]
-
-            if current_line:
-                lines.append(' '.join(current_line))
-
-            return lines
+        doctor = db.session.get(Doctor, record.doctor_id)
+        pdf = get_record_pdf('medical-record', record, patient, doctor)
+        filename = get_record_pdf_download_name('medical-record', record, patient)
+        return send_file(pdf, as_attachment=True, download_name=filename, mimetype='application/pdf')
 
-        def draw_text(text, x=50, y=None, bold=False, font_size=10):
-            nonlocal y_position
-            if y is None:
-                y = y_position
-            safe_text = ukrainian_to_ascii(text)
+    except Exception as e:
+        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
 
-            if bold:
-                p.setFont("Helvetica-Bold", font_size)
-            else:
-                p.setFont("Helvetica", font_size)
+@app.route('/api/patient/pdf-jobs', methods=['POST'])
+def create_pdf_job():
+    if 'user_id' not in session or session.get('user_type') != 'patient':
+        return jsonify({'error': 'Not authenticated'}), 401
 
-            p.drawString(x, y, safe_text)
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    record_id = data.get('record_id')
+    if kind not in PDF_JOB_KINDS or not isinstance(record_id, int):
+        return jsonify({'error': 'Invalid PDF job'}), 400
 
-            if y == y_position:
-                y_position -= line_height
+    patient = Patient.query.filter_by(user_id=session['user_id']).first()
+    if not patient:
+        return jsonify({'error': 'Patient not found'}), 404
 
-            return y_position
+    record = db.session.get(MedicalRecord, record_id)
+    if not record or record.patient_id != patient.id:
+        return jsonify({'error': 'Access denied'}), 403
 
-        def draw_multiline(text, x=50):
-            nonlocal y_position
-            if not text:
-                return y_position
+    doctor = db.session.get(Doctor, record.doctor_id)
+    pdf_data = get_record_pdf_data(record, patient, doctor)
+    job = pdf_render_service.submit(
+        get_record_pdf_key(kind, record, pdf_data), kind, *pdf_data,
+        owner=session['user_id'],
+        download_name=get_record_pdf_download_name(kind, record, patient)
+    )
+    return jsonify(pdf_job_to_dict(job)), 202
 
-            lines = wrap_text(text, 80)
-            for line in lines:
-                draw_text(line, x)
-                y_position -= 2
+@app.route('/api/patient/pdf-jobs/<job_id>')
+def get_pdf_job(job_id):
+    if 'user_id' not in session or session.get('user_type') != 'patient':
+        return jsonify({'error': 'Not authenticated'}), 401
 
-            return y_position
+    job = pdf_render_service.get_job(job_id, owner=session['user_id'])
+    if not job:
+        return jsonify({'error': 'PDF job not found'}), 404
 
-        draw_text("MEDICAL RECORD - MEDICONNECT CLINIC", 50, 750, True, 14)
-        draw_text("Official Medical Documentation", 50, 735, False, 12)
-        y_position -= 20
+    return jsonify(pdf_job_to_dict(job))
 
-        draw_text("RECORD INFORMATION", bold=True)
-        draw_text(f"Record ID: MR-{record_id:06d}")
-        draw_text(f"Date of Visit: {record.record_date.strftime('%d.%m.%Y at %H:%M')}")
-        draw_text(f"Valid Until: {(record.record_date + timedelta(days=365)).strftime('%d.%m.%Y')}")
-        y_position -= 10
+@app.route('/api/patient/pdf-jobs/<job_id>/download')
+def download_pdf_job(job_id):
+    if 'user_id' not in session or session.get('user_type') != 'patient':
+        return jsonify({'error': 'Not authenticated'}), 401
 
-        draw_text("PATIENT INFORMATION", bold=True)
-        draw_text(f"Full Name: {patient.first_name} {patient.last_name}")
-        draw_text(f"Date of Birth: {patient.birthdate.strftime('%d.%m.%Y')}")
-        draw_text(f"Phone: {patient.phone or 'Not provided'}")
-        draw_text(f"Blood Type: {patient.blood_type or 'Not specified'}")
-        y_position -= 10
+    job = pdf_render_service.get_job(job_id, owner=session['user_id'])
+    if not job:
+        return jsonify({'error': 'PDF job not found'}), 404
+    if job.status != 'done':
+        return jsonify(pdf_job_to_dict(job)), 409
 
-        doctor = db.session.get(Doctor, record.doctor_id)
-        draw_text("DOCTOR INFORMATION", bold=True)
-        draw_text(f"Name: Dr. {doctor.first_name} {doctor.last_name}")
-        draw_text(f"Specialization: {doctor.specialization}")
-        draw_text(f"License: {doctor.license_number}")
-        draw_text(f"Contact: {doctor.phone}")
-        y_position -= 10
-
-        if record.diagnosis and record.diagnosis.strip():
-            draw_text("DIAGNOSIS", bold=True)
-            y_position = draw_multiline(record.diagnosis)
-            y_position -= 5
-
-        if record.treatment and record.treatment.strip():
-            draw_text("TREATMENT PLAN", bold=True)
-            y_position = draw_multiline(record.treatment)
-            y_position -= 5
-
-        if record.prescriptions and record.prescriptions.strip():
-            draw_text("PRESCRIPTIONS", bold=True)
-            y_position = draw_multiline(record.prescriptions)
-            y_position -= 5
-
-        if record.notes and record.notes.strip():
-            draw_text("MEDICAL NOTES", bold=True)
-            y_position = draw_multiline(record.notes)
-            y_position -= 5
-
-        y_position = 100
-        draw_text("MEDICONNECT MEDICAL CLINIC", 50, y_position, True)
-        draw_text("Official Medical Documentation", 50, y_position - 15)
-        draw_text("This document is generated electronically and is legally valid", 50, y_position - 30, font_size=8)
-        draw_text(f"Generated on: {datetime.now().strftime('%d.%m.%Y at %H:%M')}", 50, y_position - 45, font_size=8)
-
-        p.showPage()
-        p.save()
-        buffer.seek(0)
-
-        filename = f'medical_record_{patient.last_name}_{record.record_date.strftime("%Y%m%d")}.pdf'
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    path = pdf_render_service.get_path(job)
+    if not path:
+        return jsonify({'error': 'PDF expired, please request it again'}), 410
 
-    except Exception as e:
-        return jsonify({'error': f'PDF generation failed: {str(e)}'}), 500
+    return send_file(path, as_attachment=True, download_name=job.download_name, mimetype='application/pdf')
 
 @app.route('/api/patient/notifications/mark-all-read', methods=['POST'])
 def mark_all_notifications_read():
@@ -2221,6 +2589,7 @@ def mark_all_notifications_read():
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
+        reset_notification_counter(session['user_id'])
         Notification.query.filter_by(user_id=session['user_id'], is_read=False).update({'is_read': True})
         db.session.commit()
         return jsonify({'success': True, 'message': 'Всі сповіщення позначено як прочитані'})
@@ -2243,6 +2612,7 @@ def cancel_patient_appointment(appointment_id):
 
     try:
         appointment.status = 'cancelled'
+        sync_appointment_reminders(appointment)
 
         doctor = Doctor.query.get(appointment.doctor_id)
         notification = Notification(
@@ -2251,6 +2621,10 @@ def cancel_patient_appointment(appointment_id):
             message=f'Пацієнт {patient.first_name} {patient.last_name} скасував запис на {appointment.appointment_date}'
         )
         db.session.add(notification)
+        add_outbox_event('appointment_cancelled', patient.user_id,
+                         patient=f'{patient.first_name} {patient.last_name}',
+                         date=appointment.appointment_date.strftime('%Y-%m-%d'),
+                         time=appointment.appointment_time.strftime('%H:%M'))
 
         db.session.commit()
         return jsonify({'success': True, 'message': 'Запис успішно скасовано'})
@@ -2267,37 +2641,20 @@ def api_patient_doctors():
     if not patient:
         return jsonify({'error': 'Patient not found'}), 404
 
-    medical_record_doctors = db.session.query(Doctor).join(MedicalRecord).filter(
-        MedicalRecord.patient_id == patient.id
-    ).distinct().all()
-
-    appointment_doctors = db.session.query(Doctor).join(Appointment).filter(
-        Appointment.patient_id == patient.id
-    ).distinct().all()
-
-    all_doctors = list(set(medical_record_doctors + appointment_doctors))
+    rows = db.session.query(Doctor, DoctorPatient.last_visit, DoctorPatient.visit_count).join(
+        DoctorPatient, DoctorPatient.doctor_id == Doctor.id
+    ).filter(DoctorPatient.patient_id == patient.id).all()
 
     doctors_data = []
-    for doctor in all_doctors:
-        last_appointment = Appointment.query.filter_by(
-            patient_id=patient.id,
-            doctor_id=doctor.id
-        ).order_by(Appointment.appointment_date.desc()).first()
-
-        total_appointments = Appointment.query.filter_by(
-            patient_id=patient.id,
-            doctor_id=doctor.id
-        ).count()
-
+    for doctor, last_visit, total_visits in rows:
         doctors_data.append({
             'id': doctor.id,
             'name': f'Др. {doctor.first_name} {doctor.last_name}',
             'specialization': doctor.specialization,
             'phone': doctor.phone,
             'bio': doctor.bio or 'Інформація відсутня',
-            'last_visit': last_appointment.appointment_date.strftime(
-                '%d.%m.%Y') if last_appointment else 'Ще не було візитів',
-            'total_visits': total_appointments,
+            'last_visit': last_visit.strftime('%d.%m.%Y') if last_visit else 'Ще не було візитів',
+            'total_visits': total_visits or 0,
             'rating': 4.5,
             'reviews': 12
         })
@@ -2341,46 +2698,54 @@ def get_appointment_details(appointment_id):
     return jsonify(appointment_data)
 
 
-def register_ukrainian_font():
-    font_paths = [
-        'arial.ttf',
-        '/usr/share/fonts/truetype/freefont/FreeSans.ttf',
-        '/Library/Fonts/Arial.ttf',
-        'DejaVuSans.ttf',
-        'times.ttf'
-    ]
+def get_record_pdf_data(record, patient, doctor):
+    return (
+        SimpleNamespace(id=record.id, record_date=record.record_date, diagnosis=record.diagnosis,
+                        treatment=record.treatment, prescriptions=record.prescriptions, notes=record.notes),
+        SimpleNamespace(first_name=patient.first_name, last_name=patient.last_name, birthdate=patient.birthdate,
+                        phone=patient.phone, blood_type=patient.blood_type),
+        SimpleNamespace(first_name=doctor.first_name, last_name=doctor.last_name,
+                        specialization=doctor.specialization, license_number=doctor.license_number,
+                        phone=doctor.phone)
+    )
 
-    for font_path in font_paths:
-        try:
-            pdfmetrics.registerFont(TTFont('UkrainianFont', font_path))
-            return 'UkrainianFont'
-        except:
-            continue
 
-    try:
-        return 'Helvetica'
-    except:
-        return 'Helvetica'
-def wrap_text(text, max_length):
-    if not text:
-        return []
-
-    words = text.split()
-    lines = []
-    current_line = []
-
-    for word in words:
-        if len(' '.join(current_line + [word])) <= max_length:
-            current_line.append(word)
-        else:
-            if current_line:
-                lines.append(' '.join(current_line))
-            current_line = [word]
+def get_record_pdf_key(kind, record, pdf_data):
+    return make_pdf_key(kind, record.id, [vars(item) for item in pdf_data])
+
+
+def get_record_pdf_date(record):
+    return record.record_date.strftime('%Y%m%d') if record.record_date else 'undated'
+
+
+def get_record_pdf_name(record):
+    return f'{get_record_pdf_date(record)}_MR-{record.id:06d}.pdf'
 
-    if current_line:
-        lines.append(' '.join(current_line))
 
-    return lines
+def get_record_pdf_download_name(kind, record, patient):
+    if kind == 'prescription':
+        return f'рецепт_{patient.last_name}_{get_record_pdf_date(record)}.pdf'
+    if kind == 'prescription-simple':
+        return f'prescription_{patient.last_name}.pdf'
+    return f'medical_record_{patient.last_name}_{get_record_pdf_date(record)}.pdf'
+
+
+def get_record_pdf(kind, record, patient, doctor):
+    pdf_data = get_record_pdf_data(record, patient, doctor)
+    return pdf_render_service.render(get_record_pdf_key(kind, record, pdf_data), kind, *pdf_data)
+
+
+def pdf_job_to_dict(job):
+    job_data = {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('get_pdf_job', job_id=job.id)
+    }
+    if job.status == 'done':
+        job_data['download_url'] = url_for('download_pdf_job', job_id=job.id)
+    if job.error:
+        job_data['error'] = job.error
+    return job_data
 
 
 @app.route('/api/doctor/avatar', methods=['POST'])
@@ -2427,7 +2792,102 @@ def logout():
     return redirect(url_for('index'))
 
 
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    if db.engine.dialect.name != 'sqlite':
+        print(f'Skipping: EXPLAIN QUERY PLAN check only supports SQLite, not {db.engine.dialect.name}')
+        return
+
+    hot_queries = [
+        ('has_treated', 'sqlite_autoindex_doctor_patient_1',
+         DoctorPatient.query.filter_by(doctor_id=1, patient_id=1)),
+        ('doctor patients', 'sqlite_autoindex_doctor_patient_1',
+         DoctorPatient.query.filter_by(doctor_id=1)),
+        ('doctor appointments by day', 'ix_appointment_doctor_date_status',
+         Appointment.query.filter_by(doctor_id=1, appointment_date=date.today(), status='scheduled')),
+        ('patient appointments with doctor', 'ix_appointment_patient_doctor_date',
+         Appointment.query.filter_by(patient_id=1, doctor_id=1)),
+        ('patient doctors', 'ix_doctor_patient_patient',
+         DoctorPatient.query.filter_by(patient_id=1)),
+        ('patient medical records', 'ix_medical_record_patient_date',
+         MedicalRecord.query.filter_by(patient_id=1).order_by(MedicalRecord.record_date.desc())),
+        ('unread notifications', 'ix_notification_user_read_created',
+         Notification.query.filter_by(user_id=1, is_read=False).order_by(Notification.created_at.desc())),
+        ('working hours', 'ix_working_hours_doctor_day',
+         WorkingHours.query.filter_by(doctor_id=1, day_of_week=0)),
+        ('due appointment reminders', 'ix_appointment_reminder_sent_due',
+         AppointmentReminder.query.filter(AppointmentReminder.sent_at.is_(None),
+                                          AppointmentReminder.due_at <= datetime.now())
+         .order_by(AppointmentReminder.due_at)),
+        ('pending outbox events', 'ix_outbox_event_processed_id',
+         OutboxEvent.query.filter(OutboxEvent.processed_at.is_(None)).order_by(OutboxEvent.id)),
+        ('medical records page', 'ix_medical_record_patient_date',
+         page_query(MedicalRecord.query.filter_by(patient_id=1), [MedicalRecord.record_date, MedicalRecord.id],
+                    [datetime.now(), 1])),
+        ('notifications page', 'ix_notification_user_created',
+         page_query(Notification.query.filter_by(user_id=1), [Notification.created_at, Notification.id],
+                    [datetime.now(), 1])),
+        ('patient appointments page', 'ix_appointment_patient_schedule',
+         page_query(Appointment.query.filter_by(patient_id=1),
+                    [Appointment.appointment_date, Appointment.appointment_time, Appointment.id],
+                    [date.today(), time(9), 1])),
+        ('doctor appointments page', 'ix_appointment_doctor_schedule',
+         page_query(Appointment.query.filter_by(doctor_id=1),
+                    [Appointment.appointment_date, Appointment.appointment_time, Appointment.id],
+                    [date.today(), time(9), 1])),
+    ]
+
+    failures = 0
+    for name, index_name, query in hot_queries:
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = (None,) * len(compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).fetchall()
+        details = ' | '.join(row[-1] for row in plan)
+        if index_name in details and 'TEMP B-TREE' not in details:
+            print(f'OK    {name}: {details}')
+        else:
+            failures += 1
+            print(f'FAIL  {name}: expected {index_name} without a sort, got {details}')
+
+    if failures:
+        raise SystemExit(1)
+
+
+def create_patient_search_index():
+    connection = db.session.connection()
+    for statement in PATIENT_SEARCH_SCHEMA + PATIENT_SEARCH_REBUILD:
+        connection.exec_driver_sql(statement)
+    db.session.commit()
+    app.config.pop('PATIENT_SEARCH_FTS', None)
+
+
+@app.cli.command('backfill-doctor-patients')
+def backfill_doctor_patients():
+    count = backfill_doctor_patient_links()
+    db.session.commit()
+    print(f'Backfilled {count} doctor-patient links')
+
+
+@app.cli.command('rebuild-patient-search')
+def rebuild_patient_search():
+    if db.engine.dialect.name != 'sqlite':
+        print(f'Skipping: the FTS5 patient search index only supports SQLite, not {db.engine.dialect.name}')
+        return
+
+    create_patient_search_index()
+    count = db.session.execute(select(func.count()).select_from(patient_search_table)).scalar()
+    print(f'Indexed {count} patients')
+
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        migrations = os.path.join(basedir, 'migrations')
+        if inspect(db.engine).has_table('user'):
+            # Migrations backfill the derived tables that create_all would leave empty
+            upgrade(directory=migrations)
+        else:
+            db.create_all()
+            if db.engine.dialect.name == 'sqlite':
+                create_patient_search_index()
+            stamp(directory=migrations)
     app.run()
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""add composite indexes for hot query shapes
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_appointment_doctor_date_status', 'appointment',
+                    ['doctor_id', 'appointment_date', 'status'], unique=False, if_not_exists=True)
+    op.create_index('ix_appointment_patient_doctor_date', 'appointment',
+                    ['patient_id', 'doctor_id', 'appointment_date'], unique=False, if_not_exists=True)
+    op.create_index('ix_medical_record_doctor_patient', 'medical_record',
+                    ['doctor_id', 'patient_id'], unique=False, if_not_exists=True)
+    op.create_index('ix_medical_record_patient_date', 'medical_record',
+                    ['patient_id', 'record_date'], unique=False, if_not_exists=True)
+    op.create_index('ix_notification_user_read_created', 'notification',
+                    ['user_id', 'is_read', 'created_at'], unique=False, if_not_exists=True)
+    op.create_index('ix_working_hours_doctor_day', 'working_hours',
+                    ['doctor_id', 'day_of_week'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_working_hours_doctor_day', table_name='working_hours')
+    op.drop_index('ix_notification_user_read_created', table_name='notification')
+    op.drop_index('ix_medical_record_patient_date', table_name='medical_record')
+    op.drop_index('ix_medical_record_doctor_patient', table_name='medical_record')
+    op.drop_index('ix_appointment_patient_doctor_date', table_name='appointment')
+    op.drop_index('ix_appointment_doctor_date_status', table_name='appointment')
@@ -0,0 +1,28 @@
+"""add unique index on scheduled appointment slots
+
+Revision ID: 8a4e6c2f5d31
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 18:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6c2f5d31'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('uq_appointment_scheduled_slot', 'appointment',
+                    ['doctor_id', 'appointment_date', 'appointment_time'], unique=True,
+                    sqlite_where=sa.text("status = 'scheduled'"),
+                    postgresql_where=sa.text("status = 'scheduled'"),
+                    if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('uq_appointment_scheduled_slot', table_name='appointment')
@@ -0,0 +1,87 @@
+"""add doctor_patient link table
+
+Revision ID: a7c4e1b95d28
+Revises: f5b2d9e4c613
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e1b95d28'
+down_revision = 'f5b2d9e4c613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already exist, empty, if the app ran db.create_all() before migrating
+    columns = [
+        sa.Column('doctor_id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('first_visit', sa.Date(), nullable=True),
+        sa.Column('last_visit', sa.Date(), nullable=True),
+        sa.Column('visit_count', sa.Integer(), nullable=False),
+        sa.Column('record_count', sa.Integer(), nullable=False),
+    ]
+    if sa.inspect(op.get_bind()).has_table('doctor_patient'):
+        doctor_patient = sa.table('doctor_patient', *columns)
+    else:
+        doctor_patient = op.create_table(
+            'doctor_patient',
+            *columns,
+            sa.ForeignKeyConstraint(['doctor_id'], ['doctor.id'], ),
+            sa.ForeignKeyConstraint(['patient_id'], ['patient.id'], ),
+            sa.PrimaryKeyConstraint('doctor_id', 'patient_id')
+        )
+    op.create_index('ix_doctor_patient_patient', 'doctor_patient', ['patient_id'], unique=False, if_not_exists=True)
+
+    appointment = sa.table(
+        'appointment',
+        sa.column('id', sa.Integer),
+        sa.column('doctor_id', sa.Integer),
+        sa.column('patient_id', sa.Integer),
+        sa.column('appointment_date', sa.Date)
+    )
+    medical_record = sa.table(
+        'medical_record',
+        sa.column('id', sa.Integer),
+        sa.column('doctor_id', sa.Integer),
+        sa.column('patient_id', sa.Integer)
+    )
+    visits = sa.select(
+        appointment.c.doctor_id, appointment.c.patient_id,
+        sa.func.count(appointment.c.id).label('visit_count'),
+        sa.func.min(appointment.c.appointment_date).label('first_visit'),
+        sa.func.max(appointment.c.appointment_date).label('last_visit')
+    ).group_by(appointment.c.doctor_id, appointment.c.patient_id).subquery()
+    records = sa.select(
+        medical_record.c.doctor_id, medical_record.c.patient_id,
+        sa.func.count(medical_record.c.id).label('record_count')
+    ).group_by(medical_record.c.doctor_id, medical_record.c.patient_id).subquery()
+    pairs = sa.union(
+        sa.select(appointment.c.doctor_id, appointment.c.patient_id),
+        sa.select(medical_record.c.doctor_id, medical_record.c.patient_id)
+    ).subquery()
+    links = sa.select(
+        pairs.c.doctor_id, pairs.c.patient_id, visits.c.first_visit, visits.c.last_visit,
+        sa.func.coalesce(visits.c.visit_count, 0), sa.func.coalesce(records.c.record_count, 0)
+    ).select_from(
+        pairs.outerjoin(visits, sa.and_(visits.c.doctor_id == pairs.c.doctor_id,
+                                        visits.c.patient_id == pairs.c.patient_id))
+        .outerjoin(records, sa.and_(records.c.doctor_id == pairs.c.doctor_id,
+                                    records.c.patient_id == pairs.c.patient_id))
+    ).where(
+        ~sa.exists().where(doctor_patient.c.doctor_id == pairs.c.doctor_id,
+                           doctor_patient.c.patient_id == pairs.c.patient_id)
+    )
+    op.execute(doctor_patient.insert().from_select(
+        ['doctor_id', 'patient_id', 'first_visit', 'last_visit', 'visit_count', 'record_count'], links
+    ))
+
+
+def downgrade():
+    op.drop_index('ix_doctor_patient_patient', table_name='doctor_patient')
+    op.drop_table('doctor_patient')
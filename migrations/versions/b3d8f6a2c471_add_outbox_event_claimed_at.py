@@ -0,0 +1,30 @@
+"""add outbox_event.claimed_at
+
+Revision ID: b3d8f6a2c471
+Revises: a7c4e1b95d28
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f6a2c471'
+down_revision = 'a7c4e1b95d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('outbox_event')]
+    if 'claimed_at' in columns:
+        return
+
+    with op.batch_alter_table('outbox_event') as batch_op:
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('outbox_event') as batch_op:
+        batch_op.drop_column('claimed_at')
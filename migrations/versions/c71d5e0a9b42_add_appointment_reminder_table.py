@@ -0,0 +1,77 @@
+"""add appointment_reminder due-time table
+
+Revision ID: c71d5e0a9b42
+Revises: 8a4e6c2f5d31
+Create Date: 2026-10-18 19:10:00.000000
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71d5e0a9b42'
+down_revision = '8a4e6c2f5d31'
+branch_labels = None
+depends_on = None
+
+REMINDER_OFFSETS = {
+    '24h': timedelta(hours=24),
+    '1h': timedelta(hours=1),
+}
+
+
+def upgrade():
+    columns = [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('appointment_id', sa.Integer(), nullable=False),
+        sa.Column('reminder_type', sa.String(length=10), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+    ]
+    if sa.inspect(op.get_bind()).has_table('appointment_reminder'):
+        reminder = sa.table('appointment_reminder', *columns)
+    else:
+        reminder = op.create_table(
+            'appointment_reminder',
+            *columns,
+            sa.ForeignKeyConstraint(['appointment_id'], ['appointment.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('appointment_id', 'reminder_type', name='uq_appointment_reminder_type')
+        )
+    op.create_index('ix_appointment_reminder_sent_due', 'appointment_reminder', ['sent_at', 'due_at'],
+                    if_not_exists=True)
+
+    appointment = sa.table(
+        'appointment',
+        sa.column('id', sa.Integer),
+        sa.column('appointment_date', sa.Date),
+        sa.column('appointment_time', sa.Time),
+        sa.column('status', sa.String),
+    )
+    now = datetime.now()
+    rows = op.get_bind().execute(
+        sa.select(appointment.c.id, appointment.c.appointment_date, appointment.c.appointment_time)
+        .where(appointment.c.status == 'scheduled', appointment.c.appointment_date >= now.date())
+    ).fetchall()
+    existing = set(op.get_bind().execute(sa.select(reminder.c.appointment_id, reminder.c.reminder_type)).fetchall())
+
+    reminders = []
+    for appointment_id, appointment_date, appointment_time in rows:
+        starts_at = datetime.combine(appointment_date, appointment_time)
+        for reminder_type, offset in REMINDER_OFFSETS.items():
+            if starts_at - offset >= now and (appointment_id, reminder_type) not in existing:
+                reminders.append({
+                    'appointment_id': appointment_id,
+                    'reminder_type': reminder_type,
+                    'due_at': starts_at - offset,
+                })
+    if reminders:
+        op.bulk_insert(reminder, reminders)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_reminder_sent_due', table_name='appointment_reminder')
+    op.drop_table('appointment_reminder')
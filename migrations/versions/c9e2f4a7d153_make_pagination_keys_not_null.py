@@ -0,0 +1,51 @@
+"""make paginated sort keys NOT NULL and index page orderings
+
+Revision ID: c9e2f4a7d153
+Revises: b3d8f6a2c471
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e2f4a7d153'
+down_revision = 'b3d8f6a2c471'
+branch_labels = None
+depends_on = None
+
+# Rows that never had a date keep sorting after every dated row
+MISSING_DATE = datetime(1970, 1, 1)
+
+
+def upgrade():
+    medical_record = sa.table('medical_record', sa.column('record_date', sa.DateTime))
+    notification = sa.table('notification', sa.column('created_at', sa.DateTime))
+    op.execute(medical_record.update().where(medical_record.c.record_date.is_(None))
+               .values(record_date=MISSING_DATE))
+    op.execute(notification.update().where(notification.c.created_at.is_(None))
+               .values(created_at=MISSING_DATE))
+
+    with op.batch_alter_table('medical_record') as batch_op:
+        batch_op.alter_column('record_date', existing_type=sa.DateTime(), nullable=False)
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+    op.create_index('ix_notification_user_created', 'notification', ['user_id', 'created_at'],
+                    unique=False, if_not_exists=True)
+    op.create_index('ix_appointment_patient_schedule', 'appointment',
+                    ['patient_id', 'appointment_date', 'appointment_time'], unique=False, if_not_exists=True)
+    op.create_index('ix_appointment_doctor_schedule', 'appointment',
+                    ['doctor_id', 'appointment_date', 'appointment_time'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_doctor_schedule', table_name='appointment')
+    op.drop_index('ix_appointment_patient_schedule', table_name='appointment')
+    op.drop_index('ix_notification_user_created', table_name='notification')
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
+    with op.batch_alter_table('medical_record') as batch_op:
+        batch_op.alter_column('record_date', existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,31 @@
+"""drop the unused alert_cursors table
+
+Revision ID: d2f7a9c3e185
+Revises: c9e2f4a7d153
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a9c3e185'
+down_revision = 'c9e2f4a7d153'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The bot created it for prescription alerts before they moved to the outbox
+    op.execute('DROP TABLE IF EXISTS alert_cursors')
+
+
+def downgrade():
+    op.create_table(
+        'alert_cursors',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
@@ -0,0 +1,37 @@
+"""add outbox_event table
+
+Revision ID: d94b7e3f1a26
+Revises: c71d5e0a9b42
+Create Date: 2026-10-18 20:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94b7e3f1a26'
+down_revision = 'c71d5e0a9b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('outbox_event'):
+        op.create_table(
+            'outbox_event',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('event_type', sa.String(length=50), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('payload', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('processed_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_outbox_event_processed_id', 'outbox_event', ['processed_at', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_event_processed_id', table_name='outbox_event')
+    op.drop_table('outbox_event')
@@ -0,0 +1,60 @@
+"""add notification_counter table
+
+Revision ID: e3a8c5f27b94
+Revises: d94b7e3f1a26
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a8c5f27b94'
+down_revision = 'd94b7e3f1a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('unread_count', sa.Integer(), nullable=False),
+        sa.Column('urgent_count', sa.Integer(), nullable=False),
+    ]
+    if sa.inspect(op.get_bind()).has_table('notification_counter'):
+        notification_counter = sa.table('notification_counter', *columns)
+    else:
+        notification_counter = op.create_table(
+            'notification_counter',
+            *columns,
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('user_id')
+        )
+
+    user = sa.table('user', sa.column('id', sa.Integer))
+    notification = sa.table(
+        'notification',
+        sa.column('id', sa.Integer),
+        sa.column('user_id', sa.Integer),
+        sa.column('title', sa.String),
+        sa.column('is_read', sa.Boolean)
+    )
+    urgent = sa.case((sa.func.lower(notification.c.title).like('%urgent%'), 1), else_=0)
+    counts = sa.select(
+        user.c.id,
+        sa.func.count(notification.c.id),
+        sa.func.coalesce(sa.func.sum(urgent), 0)
+    ).select_from(
+        user.outerjoin(notification, sa.and_(
+            notification.c.user_id == user.c.id,
+            notification.c.is_read == sa.false()
+        ))
+    ).where(
+        user.c.id.not_in(sa.select(notification_counter.c.user_id))
+    ).group_by(user.c.id)
+    op.execute(notification_counter.insert().from_select(['user_id', 'unread_count', 'urgent_count'], counts))
+
+
+def downgrade():
+    op.drop_table('notification_counter')
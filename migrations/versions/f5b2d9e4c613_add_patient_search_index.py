@@ -0,0 +1,62 @@
+"""add FTS5 patient search index
+
+Revision ID: f5b2d9e4c613
+Revises: e3a8c5f27b94
+Create Date: 2026-10-18 23:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5b2d9e4c613'
+down_revision = 'e3a8c5f27b94'
+branch_labels = None
+depends_on = None
+
+PHONE_DIGITS_SQL = "replace(replace(replace(replace(replace(replace({}, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(
+        first_name, last_name, phone, phone_digits, email,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""")
+    op.execute("INSERT INTO patient_search(patient_search, rank) VALUES ('rank', 'bm25(10.0, 10.0, 2.0, 2.0, 1.0)')")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS patient_search_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+        SELECT new.id, new.first_name, new.last_name, new.phone, {PHONE_DIGITS_SQL.format('new.phone')},
+               (SELECT email FROM "user" WHERE id = new.user_id);
+    END""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS patient_search_update
+    AFTER UPDATE OF first_name, last_name, phone, user_id ON patient BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+        INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+        SELECT new.id, new.first_name, new.last_name, new.phone, {PHONE_DIGITS_SQL.format('new.phone')},
+               (SELECT email FROM "user" WHERE id = new.user_id);
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS patient_search_delete AFTER DELETE ON patient BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS patient_search_email AFTER UPDATE OF email ON "user" BEGIN
+        UPDATE patient_search SET email = new.email WHERE rowid IN (SELECT id FROM patient WHERE user_id = new.id);
+    END""")
+    op.execute('DELETE FROM patient_search')
+    op.execute(f"""INSERT INTO patient_search(rowid, first_name, last_name, phone, phone_digits, email)
+    SELECT patient.id, patient.first_name, patient.last_name, patient.phone,
+           {PHONE_DIGITS_SQL.format('patient.phone')}, "user".email
+    FROM patient JOIN "user" ON "user".id = patient.user_id""")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('DROP TRIGGER IF EXISTS patient_search_email')
+    op.execute('DROP TRIGGER IF EXISTS patient_search_delete')
+    op.execute('DROP TRIGGER IF EXISTS patient_search_update')
+    op.execute('DROP TRIGGER IF EXISTS patient_search_insert')
+    op.execute('DROP TABLE IF EXISTS patient_search')
@@ -0,0 +1,78 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+PDF_CACHE_FOLDER = os.environ.get('PDF_CACHE_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'pdf'))
+PDF_CACHE_MAX_FILES = 500
+PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+
+class PdfCache:
+    def __init__(self, directory, max_files=PDF_CACHE_MAX_FILES, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith('.pdf'):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pdf')
+
+    def get(self, key):
+        name = key + '.pdf'
+        path = self.path(key)
+        with self._lock:
+            if name in self._entries and os.path.exists(path):
+                self._entries.move_to_end(name)
+                self.stats['hits'] += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            if name in self._entries:
+                self._size -= self._entries.pop(name)
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, data):
+        name = key + '.pdf'
+        path = self.path(key)
+        temp_path = os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if name in self._entries:
+                self._size -= self._entries.pop(name)
+            self._entries[name] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_files or self._size > self.max_bytes):
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.stats['evictions'] += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,412 @@
+import io
+from datetime import date, datetime, timedelta
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.pagesizes import letter, A4
+from reportlab.pdfgen import canvas
+from reportlab.lib import colors
+
+PAGE_MARGIN = 50
+PAGE_BOTTOM_MARGIN = 60
+FOOTER_LINE_HEIGHT = 15
+WORD_WIDTH_CACHE_SIZE = 20000
+
+UKRAINIAN_TO_LATIN = {
+    'А': 'A', 'Б': 'B', 'В': 'V', 'Г': 'H', 'Ґ': 'G', 'Д': 'D',
+    'Е': 'E', 'Є': 'Ye', 'Ж': 'Zh', 'З': 'Z', 'И': 'Y',
+    'І': 'I', 'Ї': 'Yi', 'Й': 'Y', 'К': 'K', 'Л': 'L',
+    'М': 'M', 'Н': 'N', 'О': 'O', 'П': 'P', 'Р': 'R',
+    'С': 'S', 'Т': 'T', 'У': 'U', 'Ф': 'F', 'Х': 'Kh',
+    'Ц': 'Ts', 'Ч': 'Ch', 'Ш': 'Sh', 'Щ': 'Shch', 'Ь': '',
+    'Ю': 'Yu', 'Я': 'Ya',
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'h', 'ґ': 'g', 'д': 'd',
+    'е': 'e', 'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'y',
+    'і': 'i', 'ї': 'yi', 'й': 'y', 'к': 'k', 'л': 'l',
+    'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh',
+    'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ь': '',
+    'ю': 'yu', 'я': 'ya',
+    'ʼ': "'", '`': "'", '´': "'", 'ъ': ''
+}
+
+
+def register_ukrainian_font():
+    font_paths = [
+        'arial.ttf',
+        '/usr/share/fonts/truetype/freefont/FreeSans.ttf',
+        '/Library/Fonts/Arial.ttf',
+        'DejaVuSans.ttf',
+        'times.ttf'
+    ]
+
+    for font_path in font_paths:
+        try:
+            pdfmetrics.registerFont(TTFont('UkrainianFont', font_path))
+            return 'UkrainianFont'
+        except:
+            continue
+
+    return 'Helvetica'
+
+
+PDF_FONT_NAME = register_ukrainian_font()
+PDF_HAS_UNICODE_FONT = PDF_FONT_NAME != 'Helvetica'
+PDF_BOLD_FONT_NAME = PDF_FONT_NAME if PDF_HAS_UNICODE_FONT else 'Helvetica-Bold'
+
+
+class PdfLayout:
+    def __init__(self, font_name, bold_font_name, pagesize=letter, font_size=10, heading_size=None,
+                 title_size=14, subtitle_size=12, line_height=14, transliterate=False,
+                 accent_color=colors.black, center_title=False):
+        self.font_name = font_name
+        self.bold_font_name = bold_font_name
+        self.pagesize = pagesize
+        self.font_size = font_size
+        self.heading_size = heading_size or font_size
+        self.title_size = title_size
+        self.subtitle_size = subtitle_size
+        self.line_height = line_height
+        self.accent_color = accent_color
+        self.center_title = center_title
+        self.left = PAGE_MARGIN
+        self.top = pagesize[1] - 42
+        self.bottom = PAGE_BOTTOM_MARGIN
+        self.text_width = pagesize[0] - 2 * PAGE_MARGIN
+        self._translation = str.maketrans(UKRAINIAN_TO_LATIN) if transliterate else None
+        self._word_widths = {}
+
+    def prepare(self, text):
+        text = '' if text is None else str(text)
+        if self._translation:
+            return text.translate(self._translation)
+        return text
+
+    def get_word_widths(self, font_name, font_size):
+        key = (font_name, font_size)
+        widths = self._word_widths.get(key)
+        if widths is None or len(widths) > WORD_WIDTH_CACHE_SIZE:
+            widths = self._word_widths[key] = {}
+        return widths
+
+    def wrap(self, text, font_name, font_size, max_width):
+        widths = self.get_word_widths(font_name, font_size)
+        space_width = widths.get(' ')
+        if space_width is None:
+            space_width = widths[' '] = pdfmetrics.stringWidth(' ', font_name, font_size)
+
+        lines = []
+        for source_line in text.splitlines():
+            words = []
+            width = 0
+            for word in source_line.split():
+                word_width = widths.get(word)
+                if word_width is None:
+                    word_width = widths[word] = pdfmetrics.stringWidth(word, font_name, font_size)
+                if words and width + space_width + word_width > max_width:
+                    lines.append(' '.join(words))
+                    words = []
+                    width = 0
+                if words:
+                    width += space_width
+                words.append(word)
+                width += word_width
+            if words:
+                lines.append(' '.join(words))
+        return lines
+
+
+class PdfPageWriter:
+    def __init__(self, p, layout):
+        self.p = p
+        self.layout = layout
+        self.y = layout.top
+
+    def draw(self, text, x, y, font_name, font_size, color=colors.black):
+        self.p.setFont(font_name, font_size)
+        self.p.setFillColor(color)
+        self.p.drawString(x, y, self.layout.prepare(text))
+
+    def new_page(self):
+        self.p.showPage()
+        self.y = self.layout.top
+
+    def ensure_space(self, height):
+        if self.y - height < self.layout.bottom:
+            self.new_page()
+
+    def space(self, height):
+        self.y -= height
+
+    def line(self, text, bold=False, font_size=None, color=colors.black, x=None):
+        layout = self.layout
+        self.ensure_space(layout.line_height)
+        self.draw(text, layout.left if x is None else x, self.y,
+                  layout.bold_font_name if bold else layout.font_name, font_size or layout.font_size, color)
+        self.y -= layout.line_height
+
+    def paragraph(self, text, prefix=''):
+        layout = self.layout
+        indent = pdfmetrics.stringWidth(prefix, layout.font_name, layout.font_size)
+        lines = layout.wrap(layout.prepare(text), layout.font_name, layout.font_size, layout.text_width - indent)
+        for number, line in enumerate(lines):
+            self.ensure_space(layout.line_height)
+            self.draw((prefix if number == 0 else '') + line, layout.left + (0 if number == 0 else indent),
+                      self.y, layout.font_name, layout.font_size)
+            self.y -= layout.line_height
+
+    def title(self, text, font_size):
+        layout = self.layout
+        self.ensure_space(font_size + 4)
+        if layout.center_title:
+            self.p.setFont(layout.bold_font_name, font_size)
+            self.p.setFillColor(layout.accent_color)
+            self.p.drawCentredString(layout.pagesize[0] / 2, self.y, layout.prepare(text))
+        else:
+            self.draw(text, layout.left, self.y, layout.bold_font_name, font_size, layout.accent_color)
+        self.y -= font_size + 4
+
+    def signatures(self, labels):
+        layout = self.layout
+        self.ensure_space(30)
+        column_width = layout.text_width / len(labels)
+        for number, label in enumerate(labels):
+            x = layout.left + number * column_width
+            self.draw('_________________________', x, self.y, layout.font_name, layout.font_size)
+            self.draw(label, x + 20, self.y - 15, layout.font_name, 8)
+        self.y -= 30
+
+    def footer(self, lines):
+        layout = self.layout
+        height = len(lines) * FOOTER_LINE_HEIGHT
+        footer_top = layout.bottom - 10 + height
+        if self.y < footer_top + layout.line_height:
+            self.new_page()
+        y = footer_top
+        for text, bold, font_size in lines:
+            self.draw(text, layout.left, y, layout.bold_font_name if bold else layout.font_name,
+                      font_size or layout.font_size)
+            y -= FOOTER_LINE_HEIGHT
+
+
+def draw_document(p, layout, blocks):
+    writer = PdfPageWriter(p, layout)
+    for block in blocks:
+        kind = block[0]
+        if kind == 'title':
+            writer.title(block[1], layout.title_size)
+        elif kind == 'subtitle':
+            writer.title(block[1], layout.subtitle_size)
+        elif kind == 'heading':
+            writer.space(4)
+            writer.line(block[1], bold=True, font_size=layout.heading_size, color=layout.accent_color)
+        elif kind == 'line':
+            writer.line(block[1])
+        elif kind == 'section':
+            heading, body = block[1], block[2]
+            if body and str(body).strip():
+                writer.space(4)
+                writer.line(heading, bold=True, font_size=layout.heading_size, color=layout.accent_color)
+                writer.paragraph(body)
+        elif kind == 'bullets':
+            for item in block[1]:
+                writer.paragraph(item, prefix='• ')
+        elif kind == 'space':
+            writer.space(block[1])
+        elif kind == 'signatures':
+            writer.signatures(block[1])
+        elif kind == 'footer':
+            writer.footer(block[1])
+        else:
+            raise ValueError(f'Unknown PDF block {kind!r}')
+    p.showPage()
+
+
+def render_document(layout, blocks):
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=layout.pagesize)
+    draw_document(p, layout, blocks)
+    p.save()
+    return buffer.getvalue()
+
+
+def format_date(value, date_format):
+    if isinstance(value, (datetime, date)):
+        return value.strftime(date_format)
+    return value or ''
+
+
+PDF_LAYOUTS = {
+    'prescription': PdfLayout(PDF_FONT_NAME, PDF_BOLD_FONT_NAME, font_size=12,
+                              transliterate=not PDF_HAS_UNICODE_FONT),
+    'prescription-simple': PdfLayout('Helvetica', 'Helvetica', transliterate=True),
+    'medical-record': PdfLayout('Helvetica', 'Helvetica-Bold', transliterate=True),
+    'telegram-prescription': PdfLayout(PDF_FONT_NAME, PDF_BOLD_FONT_NAME, pagesize=A4, font_size=11,
+                                       heading_size=14, title_size=16, transliterate=not PDF_HAS_UNICODE_FONT,
+                                       accent_color=colors.darkblue, center_title=True),
+}
+
+PRESCRIPTION_NOTES = [
+    "Цей рецепт дійсний протягом 30 днів з дати випису",
+    "Ліки приймати строго за призначенням лікаря",
+    "При виникненні побічних ефектів негайно звернутися до лікаря",
+    "Зберігати в недоступному для дітей місці",
+    "Не використовувати після закінчення терміну придатності"
+]
+
+
+def prescription_blocks(record, patient, doctor):
+    return [
+        ('title', "МЕДИЧНА КЛІНІКА 'MEDICONNECT'"),
+        ('subtitle', "ОФІЦІЙНИЙ РЕЦЕПТ"),
+        ('space', 20),
+        ('heading', f"Номер рецепту: PR-{record.id:06d}"),
+        ('line', f"Дата випису: {record.record_date.strftime('%d.%m.%Y %H:%M')}"),
+        ('line', f"Дійсний до: {(record.record_date + timedelta(days=30)).strftime('%d.%m.%Y')}"),
+        ('space', 10),
+        ('heading', "ІНФОРМАЦІЯ ПРО ПАЦІЄНТА"),
+        ('line', f"ПІБ: {patient.first_name} {patient.last_name}"),
+        ('line', f"Дата народження: {patient.birthdate.strftime('%d.%m.%Y')}"),
+        ('line', f"Телефон: {patient.phone or 'Не вказано'}"),
+        ('line', f"Група крові: {patient.blood_type or 'Не вказано'}"),
+        ('space', 10),
+        ('heading', "ІНФОРМАЦІЯ ПРО ЛІКАРЯ"),
+        ('line', f"ПІБ: Др. {doctor.first_name} {doctor.last_name}"),
+        ('line', f"Спеціалізація: {doctor.specialization}"),
+        ('line', f"Ліцензія: {doctor.license_number}"),
+        ('line', f"Телефон: {doctor.phone}"),
+        ('space', 10),
+        ('section', "ДІАГНОЗ", record.diagnosis),
+        ('section', "ЛІКУВАННЯ", record.treatment),
+        ('section', "ПРИЗНАЧЕННЯ", record.prescriptions),
+        ('section', "ДОДАТКОВІ ПРИМІТКИ", record.notes),
+        ('space', 10),
+        ('heading', "ВАЖЛИВІ ПРИМІТКИ"),
+        ('bullets', PRESCRIPTION_NOTES),
+        ('space', 20),
+        ('signatures', ["Підпис пацієнта", "Підпис лікаря"]),
+        ('footer', [(f"Документ створено: {datetime.now().strftime('%d.%m.%Y %H:%M')}", False, 8)]),
+    ]
+
+
+def prescription_simple_blocks(record, patient, doctor):
+    return [
+        ('line', "MEDYCHNA KLINIKA 'MEDICONNECT'"),
+        ('line', "OFITSIIYNYI RETSEPT"),
+        ('space', 20),
+        ('line', f"Nomier retseptu: PR-{record.id:06d}"),
+        ('line', f"Data vypysu: {record.record_date.strftime('%d.%m.%Y %H:%M')}"),
+        ('line', f"Diisnyi do: {(record.record_date + timedelta(days=30)).strftime('%d.%m.%Y')}"),
+        ('space', 10),
+        ('line', "INFORMATSIIA PRO PATSIiENTA"),
+        ('line', f"PIB: {patient.first_name} {patient.last_name}"),
+        ('line', f"Data narodzhennia: {patient.birthdate.strftime('%d.%m.%Y')}"),
+        ('line', f"Telefon: {patient.phone or 'Ne vkazano'}"),
+        ('line', f"Grupa krovi: {patient.blood_type or 'Ne vkazano'}"),
+        ('space', 10),
+        ('line', "INFORMATSIIA PRO LIKARIA"),
+        ('line', f"PIB: Dr. {doctor.first_name} {doctor.last_name}"),
+        ('line', f"Spetsializatsiia: {doctor.specialization}"),
+        ('line', f"Litsenziia: {doctor.license_number}"),
+        ('line', f"Telefon: {doctor.phone}"),
+        ('space', 10),
+        ('section', "DIAHNOZ", record.diagnosis),
+        ('section', "PRYZNACHENNIA", record.prescriptions),
+    ]
+
+
+def medical_record_blocks(record, patient, doctor):
+    return [
+        ('title', "MEDICAL RECORD - MEDICONNECT CLINIC"),
+        ('subtitle', "Official Medical Documentation"),
+        ('space', 20),
+        ('heading', "RECORD INFORMATION"),
+        ('line', f"Record ID: MR-{record.id:06d}"),
+        ('line', f"Date of Visit: {record.record_date.strftime('%d.%m.%Y at %H:%M')}"),
+        ('line', f"Valid Until: {(record.record_date + timedelta(days=365)).strftime('%d.%m.%Y')}"),
+        ('space', 10),
+        ('heading', "PATIENT INFORMATION"),
+        ('line', f"Full Name: {patient.first_name} {patient.last_name}"),
+        ('line', f"Date of Birth: {patient.birthdate.strftime('%d.%m.%Y')}"),
+        ('line', f"Phone: {patient.phone or 'Not provided'}"),
+        ('line', f"Blood Type: {patient.blood_type or 'Not specified'}"),
+        ('space', 10),
+        ('heading', "DOCTOR INFORMATION"),
+        ('line', f"Name: Dr. {doctor.first_name} {doctor.last_name}"),
+        ('line', f"Specialization: {doctor.specialization}"),
+        ('line', f"License: {doctor.license_number}"),
+        ('line', f"Contact: {doctor.phone}"),
+        ('space', 10),
+        ('section', "DIAGNOSIS", record.diagnosis),
+        ('section', "TREATMENT PLAN", record.treatment),
+        ('section', "PRESCRIPTIONS", record.prescriptions),
+        ('section', "MEDICAL NOTES", record.notes),
+        ('footer', [
+            ("MEDICONNECT MEDICAL CLINIC", True, None),
+            ("Official Medical Documentation", False, None),
+            ("This document is generated electronically and is legally valid", False, 8),
+            (f"Generated on: {datetime.now().strftime('%d.%m.%Y at %H:%M')}", False, 8),
+        ]),
+    ]
+
+
+def telegram_prescription_blocks(prescription_data):
+    return [
+        ('title', "МЕДИЧНИЙ РЕЦЕПТ"),
+        ('space', 20),
+        ('heading', "ІНФОРМАЦІЯ ПРО ПАЦІЄНТА"),
+        ('line', f"ПІБ: {prescription_data[6]} {prescription_data[7]}"),
+        ('line', f"Дата народження: {format_date(prescription_data[8], '%d.%m.%Y')}"),
+        ('line', f"Дата призначення: {format_date(prescription_data[1], '%d.%m.%Y %H:%M')}"),
+        ('space', 15),
+        ('heading', "ЛІКАР"),
+        ('line', f"ПІБ: Др. {prescription_data[3]} {prescription_data[4]}"),
+        ('line', f"Спеціалізація: {prescription_data[5]}"),
+        ('space', 15),
+        ('section', "ПРИЗНАЧЕННЯ", prescription_data[2] or "Інформація відсутня"),
+        ('space', 20),
+        ('line', f"Згенеровано: {datetime.now().strftime('%d.%m.%Y о %H:%M')}"),
+    ]
+
+
+def build_prescription_pdf(record, patient, doctor):
+    return render_document(PDF_LAYOUTS['prescription'], prescription_blocks(record, patient, doctor))
+
+
+def build_prescription_pdf_simple(record, patient, doctor):
+    return render_document(PDF_LAYOUTS['prescription-simple'], prescription_simple_blocks(record, patient, doctor))
+
+
+def build_medical_record_pdf(record, patient, doctor):
+    return render_document(PDF_LAYOUTS['medical-record'], medical_record_blocks(record, patient, doctor))
+
+
+def build_telegram_prescription_pdf(prescription_data):
+    return render_document(PDF_LAYOUTS['telegram-prescription'], telegram_prescription_blocks(prescription_data))
+
+
+def build_medical_history_pdf(path, patient, entries):
+    layout = PDF_LAYOUTS['medical-record']
+    p = canvas.Canvas(path, pagesize=layout.pagesize, pageCompression=1)
+    for record, doctor in entries:
+        draw_document(p, layout, medical_record_blocks(record, patient, doctor))
+    p.save()
+
+
+PDF_RENDERERS = {
+    'prescription': build_prescription_pdf,
+    'prescription-simple': build_prescription_pdf_simple,
+    'medical-record': build_medical_record_pdf,
+    'telegram-prescription': build_telegram_prescription_pdf,
+}
+
+PDF_FILE_RENDERERS = {
+    'medical-history': build_medical_history_pdf,
+}
+
+
+def render_pdf(kind, *args):
+    return PDF_RENDERERS[kind](*args)
+
+
+def render_pdf_file(kind, path, *args):
+    PDF_FILE_RENDERERS[kind](path, *args)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_render import PDF_FONT_NAME, render_pdf, render_pdf_file
+
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+PDF_RENDER_TIMEOUT = 30
+PDF_EXPORT_TIMEOUT = 300
+PDF_EXPORT_WINDOW = 8
+PDF_TEMPLATE_VERSION = 2
+PDF_JOB_TTL_SECONDS = 600
+PDF_MAX_JOBS = 1000
+
+
+def make_pdf_key(kind, record_id, data):
+    values = [PDF_TEMPLATE_VERSION, PDF_FONT_NAME, data]
+    digest = hashlib.sha256(json.dumps(values, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f'{kind}-{record_id}-{digest[:16]}'
+
+
+class StreamBuffer:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(files):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+class PdfJob:
+    def __init__(self, key, owner):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.owner = owner
+        self.created_at = time.monotonic()
+        self.download_name = None
+        self.error = None
+        self.finished = threading.Event()
+
+    @property
+    def status(self):
+        if not self.finished.is_set():
+            return 'pending'
+        return 'failed' if self.error else 'done'
+
+
+class PdfRenderService:
+    def __init__(self, cache, workers=PDF_RENDER_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._pending_jobs = {}
+        self._lock = threading.RLock()
+
+    def submit(self, key, kind, *args, owner=None, download_name=None):
+        with self._lock:
+            waiting = self._pending_jobs.get(key)
+            for job in waiting or ():
+                if job.owner == owner:
+                    return job
+
+            # Jobs stay per owner, but every job for the same key shares a single render
+            job = PdfJob(key, owner)
+            if waiting is not None:
+                waiting.append(job)
+            elif self.cache.get(key):
+                job.finished.set()
+            else:
+                self._pending_jobs[key] = [job]
+                future = self._get_executor().submit(render_pdf, kind, *args)
+                future.add_done_callback(lambda future: self._finish(key, future))
+
+            job.download_name = download_name
+            self._jobs[job.id] = job
+            self._prune_jobs()
+            return job
+
+    def wait(self, job, timeout=PDF_RENDER_TIMEOUT):
+        if not job.finished.wait(timeout):
+            raise TimeoutError(f'PDF rendering for {job.key} timed out')
+        if job.error:
+            raise RuntimeError(job.error)
+        path = self.cache.get(job.key)
+        if not path:
+            raise RuntimeError(f'PDF {job.key} was evicted from the cache')
+        return path
+
+    def read(self, job, timeout=PDF_RENDER_TIMEOUT):
+        with open(self.wait(job, timeout), 'rb') as f:
+            return f.read()
+
+    def render(self, key, kind, *args, timeout=PDF_RENDER_TIMEOUT):
+        return self.wait(self.submit(key, kind, *args), timeout)
+
+    def render_bytes(self, key, kind, *args, timeout=PDF_RENDER_TIMEOUT):
+        return self.read(self.submit(key, kind, *args), timeout)
+
+    def render_many(self, items, window=PDF_EXPORT_WINDOW, timeout=PDF_RENDER_TIMEOUT):
+        # Only a few renders run ahead of the reader, so a long export cannot evict its own
+        # finished files from the cache before they are streamed
+        jobs = deque()
+        for name, key, kind, args in items:
+            jobs.append((name, key, kind, args, self.submit(key, kind, *args)))
+            if len(jobs) >= window:
+                yield self._read_rendered(*jobs.popleft(), timeout)
+        while jobs:
+            yield self._read_rendered(*jobs.popleft(), timeout)
+
+    def _read_rendered(self, name, key, kind, args, job, timeout):
+        try:
+            return name, self.read(job, timeout)
+        except (RuntimeError, FileNotFoundError):
+            if job.error:
+                raise
+            logging.warning(f"PDF {key} was evicted before it was read, rendering it again")
+            return name, self.render_bytes(key, kind, *args, timeout=timeout)
+
+    def render_file(self, kind, *args, timeout=PDF_EXPORT_TIMEOUT):
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            self._get_executor().submit(render_pdf_file, kind, path, *args).result(timeout)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    def get_job(self, job_id, owner=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def get_path(self, job):
+        if job.status != 'done':
+            return None
+        return self.cache.get(job.key)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _finish(self, key, future):
+        error = None
+        try:
+            data = future.result()
+            if not data:
+                raise RuntimeError('renderer returned no data')
+            self.cache.put(key, data)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            logging.error(f"PDF render for {key} failed: {error}")
+        finally:
+            with self._lock:
+                jobs = self._pending_jobs.pop(key, [])
+            for job in jobs:
+                job.error = error
+                job.finished.set()
+
+    def _prune_jobs(self):
+        now = time.monotonic()
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            expired = now - job.created_at > PDF_JOB_TTL_SECONDS
+            if not expired and len(self._jobs) <= PDF_MAX_JOBS:
+                break
+            if not job.finished.is_set() and not expired:
+                break
+            del self._jobs[job.id]
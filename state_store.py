@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+
+STATE_TTL_SECONDS = 24 * 60 * 60
+STATE_MAX_ENTRIES = 10000
+STATE_UPDATE_RETRIES = 5
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f'Cannot store {type(value).__name__} in conversation state')
+
+
+def decode_value(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__date__' in value:
+        return date.fromisoformat(value['__date__'])
+    return value
+
+
+def encode_state(state):
+    return json.dumps(state, default=encode_value, ensure_ascii=False)
+
+
+def decode_state(payload):
+    return json.loads(payload, object_hook=decode_value)
+
+
+def merge_state(state, data):
+    def updater(current):
+        return {'state': state, 'data': data if data else current.get('data', {})}
+    return updater
+
+
+class MemoryStateStore:
+    def __init__(self, max_entries=STATE_MAX_ENTRIES, ttl=STATE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, telegram_id, now):
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return {}
+        expires_at, payload = entry
+        if expires_at <= now:
+            del self._entries[telegram_id]
+            return {}
+        self._entries.move_to_end(telegram_id)
+        return decode_state(payload)
+
+    def get(self, telegram_id):
+        with self._lock:
+            return self._load(telegram_id, time.monotonic())
+
+    def update(self, telegram_id, updater):
+        with self._lock:
+            now = time.monotonic()
+            state = updater(self._load(telegram_id, now))
+            if state is None:
+                self._entries.pop(telegram_id, None)
+                return None
+            self._entries[telegram_id] = (now + self.ttl, encode_state(state))
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return state
+
+    def set(self, telegram_id, state, data=None):
+        return self.update(telegram_id, merge_state(state, data))
+
+    def clear(self, telegram_id):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def purge_expired(self):
+        with self._lock:
+            now = time.monotonic()
+            expired = [telegram_id for telegram_id, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for telegram_id in expired:
+                del self._entries[telegram_id]
+            return len(expired)
+
+
+class DatabaseStateStore:
+    def __init__(self, engine, table, ttl=STATE_TTL_SECONDS):
+        self.engine = engine
+        self.table = table
+        self.ttl = timedelta(seconds=ttl)
+
+    def _load(self, conn, telegram_id):
+        table = self.table
+        return conn.execute(
+            select(table.c.state, table.c.data, table.c.version, table.c.updated_at)
+            .where(table.c.telegram_id == telegram_id)
+        ).fetchone()
+
+    def _decode(self, row, now):
+        if row is None or row.updated_at < now - self.ttl:
+            return {}
+        return {'state': row.state, 'data': decode_state(row.data) if row.data else {}}
+
+    def get(self, telegram_id):
+        with self.engine.connect() as conn:
+            return self._decode(self._load(conn, telegram_id), datetime.utcnow())
+
+    def update(self, telegram_id, updater):
+        table = self.table
+        for _ in range(STATE_UPDATE_RETRIES):
+            try:
+                with self.engine.begin() as conn:
+                    now = datetime.utcnow()
+                    row = self._load(conn, telegram_id)
+                    state = updater(self._decode(row, now))
+                    if state is None:
+                        if row is not None:
+                            conn.execute(delete(table).where(table.c.telegram_id == telegram_id,
+                                                             table.c.version == row.version))
+                        return None
+
+                    values = {
+                        'state': state['state'],
+                        'data': encode_state(state.get('data') or {}),
+                        'updated_at': now
+                    }
+                    if row is None:
+                        conn.execute(insert(table).values(telegram_id=telegram_id, version=1, **values))
+                        return state
+                    result = conn.execute(
+                        update(table)
+                        .where(table.c.telegram_id == telegram_id, table.c.version == row.version)
+                        .values(version=row.version + 1, **values)
+                    )
+                    if result.rowcount:
+                        return state
+            except IntegrityError:
+                continue
+        raise RuntimeError(f'Conversation state for {telegram_id} is being updated concurrently')
+
+    def set(self, telegram_id, state, data=None):
+        return self.update(telegram_id, merge_state(state, data))
+
+    def clear(self, telegram_id):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.telegram_id == telegram_id))
+
+    def purge_expired(self):
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(self.table).where(self.table.c.updated_at < datetime.utcnow() - self.ttl)
+            ).rowcount
@@ -0,0 +1,45 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from main import db, User, Doctor, WorkingHours, Appointment, find_available_slots
+
+
+@pytest.fixture
+def doctor(app):
+    user = User(email='doctor@example.com', password_hash='x', user_type='doctor')
+    db.session.add(user)
+    db.session.flush()
+    doctor = Doctor(user_id=user.id, first_name='Doc', last_name='Tor', specialization='GP', license_number='1',
+                    phone='1')
+    db.session.add(doctor)
+    db.session.commit()
+    return doctor
+
+
+def add_hours(doctor, day, start, end):
+    db.session.add(WorkingHours(doctor_id=doctor.id, day_of_week=day.weekday(), start_time=start, end_time=end))
+    db.session.commit()
+
+
+def test_overlapping_working_hours_give_each_slot_once(doctor):
+    day = date.today() + timedelta(days=7)
+    add_hours(doctor, day, time(9), time(12))
+    add_hours(doctor, day, time(10), time(13))
+    db.session.add(Appointment(patient_id=1, doctor_id=doctor.id, appointment_date=day,
+                               appointment_time=time(11), duration=30))
+    db.session.commit()
+
+    slots = find_available_slots([doctor.id], day, day)[doctor.id][day]
+    assert slots == ['09:00', '09:30', '10:00', '10:30', '11:30', '12:00', '12:30']
+
+
+def test_slots_that_already_started_are_not_offered(doctor):
+    today = date.today()
+    add_hours(doctor, today, time(0), time(23, 30))
+    add_hours(doctor, today - timedelta(days=1), time(0), time(23, 30))
+    now = datetime.now()
+
+    slots = find_available_slots([doctor.id], today - timedelta(days=1), today)[doctor.id]
+    assert today - timedelta(days=1) not in slots
+    assert all(datetime.combine(today, time.fromisoformat(slot)) > now for slot in slots.get(today, []))
@@ -0,0 +1,25 @@
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from main import db, Appointment, Notification, book_appointment
+
+
+def make_booking(user_id=1):
+    appointment = Appointment(patient_id=1, doctor_id=1, appointment_date=date.today() + timedelta(days=3),
+                              appointment_time=time(10), status='scheduled')
+    notification = Notification(user_id=user_id, title='Booked', message='')
+    return appointment, notification
+
+
+def test_taken_slot_is_reported_as_conflict(app):
+    assert book_appointment(*make_booking())
+    assert not book_appointment(*make_booking())
+    assert Appointment.query.count() == 1
+
+
+def test_other_integrity_errors_are_not_reported_as_conflict(app):
+    with pytest.raises(IntegrityError):
+        book_appointment(*make_booking(user_id=None))
+    assert Appointment.query.count() == 0
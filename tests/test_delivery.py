@@ -0,0 +1,64 @@
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from delivery import DeliveryQueue, LocalTransport
+
+
+class FailingChatTransport(LocalTransport):
+    def __init__(self, chat_id, error):
+        super().__init__()
+        self.chat_id = chat_id
+        self.error = error
+        self.failed = threading.Event()
+
+    def send(self, message):
+        if message.chat_id == self.chat_id and not self.failed.is_set():
+            self.failed.set()
+            raise self.error
+        super().send(message)
+
+
+def rate_limited(retry_after):
+    return ApiTelegramException('sendMessage', None, {
+        'error_code': 429,
+        'description': 'Too Many Requests',
+        'parameters': {'retry_after': retry_after}
+    })
+
+
+def test_backoff_of_one_chat_does_not_delay_other_chats():
+    transport = FailingChatTransport(1, rate_limited(60))
+    queue = DeliveryQueue(transport, workers=1)
+    queue.start()
+    try:
+        started = time.monotonic()
+        queue.enqueue(1, 'first')
+        assert transport.failed.wait(1)
+        for chat_id in range(2, 6):
+            queue.enqueue(chat_id, f'to {chat_id}')
+
+        deadline = time.monotonic() + 2
+        while len(transport.sent) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        sent = {chat_id: stamp - started for stamp, chat_id, text in transport.sent}
+        assert sorted(sent) == [2, 3, 4, 5]
+        assert max(sent.values()) < 1
+        assert queue.pending() == 1
+    finally:
+        queue.stop(1)
+
+
+def test_retry_is_sent_once_backoff_expires():
+    transport = FailingChatTransport(1, ConnectionError('simulated'))
+    queue = DeliveryQueue(transport, workers=1)
+    queue.start()
+    try:
+        queue.enqueue(1, 'first')
+        assert queue.join(5)
+        assert [chat_id for stamp, chat_id, text in transport.sent] == [1]
+        assert queue.stats['retried'] == 1
+    finally:
+        queue.stop(1)
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from dispatcher import UpdateDispatcher, create_webhook_app, get_webhook_path
+
+UPDATE = json.dumps({
+    'update_id': 1,
+    'message': {'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'text': 'hi'}
+})
+
+
+def test_webhook_path_comes_from_the_https_url():
+    assert get_webhook_path('https://bot.example.com/hook/abc', 'secret-1') == '/hook/abc'
+    assert get_webhook_path('https://bot.example.com', 'secret-1') == '/'
+
+
+@pytest.mark.parametrize('url, secret_token', [
+    ('http://bot.example.com/hook', 'secret-1'),
+    ('https:///hook', 'secret-1'),
+    (None, 'secret-1'),
+    ('https://bot.example.com/hook', None),
+    ('https://bot.example.com/hook', 'not allowed!'),
+    ('https://bot.example.com/hook', 'x' * 257),
+])
+def test_invalid_webhook_config_is_rejected(url, secret_token):
+    with pytest.raises(ValueError):
+        get_webhook_path(url, secret_token)
+
+
+def test_webhook_requires_the_secret_token():
+    handled = []
+    dispatcher = UpdateDispatcher(handled.append, workers=1)
+    client = create_webhook_app(dispatcher, secret_token='secret-1', path='/hook').test_client()
+    dispatcher.start()
+    try:
+        assert client.post('/hook', data=UPDATE).status_code == 403
+        assert client.post('/hook', data=UPDATE,
+                           headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}).status_code == 403
+        assert client.post('/hook', data=UPDATE,
+                           headers={'X-Telegram-Bot-Api-Secret-Token': 'secret-1'}).status_code == 200
+        assert dispatcher.join(5)
+    finally:
+        dispatcher.stop()
+    assert [update.update_id for update in handled] == [1]
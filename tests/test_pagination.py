@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import null
+from sqlalchemy.exc import IntegrityError
+
+from main import db, User, Doctor, Patient, MedicalRecord, Notification, paginate_query, encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def patient(app):
+    doctor_user = User(email='doctor@example.com', password_hash='x', user_type='doctor')
+    patient_user = User(email='patient@example.com', password_hash='x', user_type='patient')
+    db.session.add_all([doctor_user, patient_user])
+    db.session.flush()
+    db.session.add(Doctor(user_id=doctor_user.id, first_name='Doc', last_name='Tor', specialization='GP',
+                          license_number='1', phone='1'))
+    patient = Patient(user_id=patient_user.id, first_name='Pat', last_name='Ient', birthdate=date(1990, 1, 1),
+                      phone='2')
+    db.session.add(patient)
+    db.session.commit()
+    return patient
+
+
+def collect_pages(app, query, columns, limit=2):
+    ids = []
+    cursor = None
+    while True:
+        path = f'/?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        with app.test_request_context(path):
+            items, cursor = paginate_query(query, columns)
+        ids.extend(item.id for item in items)
+        if not cursor:
+            return ids
+
+
+def test_medical_records_page_through_tied_dates(app, patient):
+    doctor = Doctor.query.one()
+    for i in range(7):
+        db.session.add(MedicalRecord(patient_id=patient.id, doctor_id=doctor.id,
+                                     record_date=datetime(2000, 1, 1) + timedelta(days=i // 2)))
+    db.session.commit()
+
+    query = MedicalRecord.query.filter_by(patient_id=patient.id)
+    expected = [record.id for record in sorted(query.all(), key=lambda r: (r.record_date, r.id), reverse=True)]
+    assert collect_pages(app, query, [MedicalRecord.record_date, MedicalRecord.id]) == expected
+
+
+def test_notifications_page_through_tied_timestamps(app, patient):
+    for i in range(7):
+        db.session.add(Notification(user_id=patient.user_id, title='t', message='',
+                                    created_at=datetime(2000, 1, 1) + timedelta(hours=i // 3)))
+    db.session.commit()
+
+    query = Notification.query.filter_by(user_id=patient.user_id)
+    expected = [item.id for item in sorted(query.all(), key=lambda n: (n.created_at, n.id), reverse=True)]
+    assert collect_pages(app, query, [Notification.created_at, Notification.id]) == expected
+
+
+def test_sort_keys_reject_null(app, patient):
+    db.session.add(MedicalRecord(patient_id=patient.id, doctor_id=1, record_date=null()))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+
+
+@pytest.mark.parametrize('payload', [['not a date', 1], [None, 1], ['2000-01-01T00:00:00', 'x'], [1]])
+def test_malformed_cursor_is_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(payload), [MedicalRecord.record_date, MedicalRecord.id])
@@ -0,0 +1,76 @@
+from concurrent.futures import Future
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from pdf_cache import PdfCache
+from pdf_service import PdfRenderService, make_pdf_key
+
+
+class RecordingRenderService(PdfRenderService):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submitted = []
+
+    def submit(self, *args, **kwargs):
+        job = super().submit(*args, **kwargs)
+        self.submitted.append(job)
+        return job
+
+
+class DeferredExecutor:
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.tasks.append((future, fn, args))
+        return future
+
+    def run(self):
+        for future, fn, args in self.tasks:
+            future.set_result(fn(*args))
+
+
+def record_items(count):
+    patient = SimpleNamespace(first_name='Pat', last_name='Ient', birthdate=date(1990, 1, 1), phone='1',
+                              blood_type=None)
+    doctor = SimpleNamespace(first_name='Doc', last_name='Tor', specialization='GP', license_number='1', phone='2')
+    for record_id in range(1, count + 1):
+        record = SimpleNamespace(id=record_id, record_date=datetime(2000, 1, record_id), diagnosis='d',
+                                 treatment='t', prescriptions='p', notes='n')
+        data = (record, patient, doctor)
+        key = make_pdf_key('medical-record', record_id, [vars(item) for item in data])
+        yield f'MR-{record_id}.pdf', key, 'medical-record', data
+
+
+def test_export_larger_than_cache_streams_every_record(tmp_path, caplog):
+    service = RecordingRenderService(PdfCache(str(tmp_path), max_files=3), workers=1)
+    files = []
+    try:
+        for name, data in service.render_many(record_items(10), window=2):
+            files.append((name, data))
+            # A slow client: everything already submitted finishes before the next file is read
+            for job in service.submitted:
+                assert job.finished.wait(30)
+    finally:
+        service._get_executor().shutdown()
+
+    assert [name for name, data in files] == [f'MR-{record_id}.pdf' for record_id in range(1, 11)]
+    assert all(data.startswith(b'%PDF') for name, data in files)
+    assert 'evicted before it was read' not in caplog.text
+
+
+def test_same_pdf_for_different_owners_renders_once(tmp_path):
+    service = PdfRenderService(PdfCache(str(tmp_path)))
+    service._executor = executor = DeferredExecutor()
+    name, key, kind, data = next(record_items(1))
+
+    patient_job = service.submit(key, kind, *data, owner=1)
+    doctor_job = service.submit(key, kind, *data, owner=2)
+    bot_job = service.submit(key, kind, *data)
+    assert service.submit(key, kind, *data, owner=1) is patient_job
+    assert len(executor.tasks) == 1
+
+    executor.run()
+    assert service.read(patient_job) == service.read(doctor_job) == service.read(bot_job)
+    assert service.get_job(doctor_job.id, owner=1) is None